@@ -1,12 +1,13 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import random
-import asyncio
 from typing import Optional, Literal
 
 # Importamos el gestor de base de datos
 from utils import database_manager as db
 from utils.lang_utils import _t
+from utils.lock_registry import balance_locks
+from utils.member_resolver import resolve_display_names
 
 def parse_amount(amount_str: str, current_balance: int) -> Optional[int]:
     """Interpreta textos como 'all', 'max', 'half' para facilitar la vida del usuario."""
@@ -25,7 +26,37 @@ class EconomyCog(commands.Cog, name="Economía"):
     """Sistema de economía dinámico y robusto similar a UnbelievaBoat. Compra, vende y roba."""
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self.user_locks = {}
+
+    async def cog_load(self):
+        self.economy_jobs_loop.start()
+        self.economy_snapshot_loop.start()
+
+    async def cog_unload(self):
+        self.economy_jobs_loop.cancel()
+        self.economy_snapshot_loop.cancel()
+
+    @tasks.loop(minutes=5)
+    async def economy_jobs_loop(self):
+        """Ejecuta las tareas periódicas vencidas (intereses, impuestos) de todos los servidores."""
+        # Una excepción sin capturar detendría el bucle para siempre; las tareas vencidas se reintentan en la siguiente vuelta
+        try:
+            for result in await db.run_due_economy_jobs():
+                print(f"Tarea de economía '{result['kind']}' en {result['guild_id']}: {result['affected']} balances actualizados.")
+        except Exception as e:
+            print(f"Error ejecutando las tareas periódicas de economía: {e}")
+
+    @tasks.loop(hours=6)
+    async def economy_snapshot_loop(self):
+        """Guarda la serie temporal de indicadores (masa monetaria, Gini...) que muestra el dashboard."""
+        for guild in list(self.bot.guilds):
+            try:
+                await db.take_economy_snapshot(guild.id)
+            except Exception as e:
+                print(f"Error guardando la instantánea de economía de {guild.id}: {e}")
+
+    @economy_snapshot_loop.before_loop
+    async def before_economy_snapshot_loop(self):
+        await self.bot.wait_until_ready()
 
     async def cog_check(self, ctx: commands.Context):
         """Check global para este Cog."""
@@ -36,33 +67,37 @@ class EconomyCog(commands.Cog, name="Economía"):
             return False
         
         # Check active channels
-        allowed_channels = await db.fetchall("SELECT channel_id FROM economy_active_channels WHERE guild_id = ?", (ctx.guild.id,))
-        if allowed_channels:
-            allowed_ids = [int(ch['channel_id']) for ch in allowed_channels]
+        allowed_ids = await db.get_active_channels('economy', ctx.guild.id)
+        if allowed_ids:
             if ctx.channel.id not in allowed_ids:
-                channels_mentions = " ".join([f"<#{cid}>" for cid in allowed_ids])
+                channels_mentions = " ".join([f"<#{cid}>" for cid in sorted(allowed_ids)])
                 await ctx.send(f"❌ Los comandos de economía solo están permitidos en: {channels_mentions}", ephemeral=True)
                 return False
                 
         return True
         
-    def get_user_lock(self, user_id: int) -> asyncio.Lock:
-        if user_id not in self.user_locks:
-            self.user_locks[user_id] = asyncio.Lock()
-        return self.user_locks[user_id]
+    def get_user_lock(self, guild_id: int, *user_ids: int):
+        """Candado del saldo de cada usuario en este servidor (compartido con el casino)."""
+        return balance_locks.hold(*((guild_id, user_id) for user_id in user_ids))
         
     async def get_max_bank(self, guild_id: int, user_id: int) -> int:
         """El límite del banco aumenta pasivamente en base al nivel de XP del usuario."""
-        level, xp = await db.get_user_level(guild_id, user_id)
+        # Del ledger de XP si el cog de niveles está cargado: incluye el XP aún sin volcar
+        leveling = self.bot.get_cog("Niveles")
+        if leveling is not None:
+            level, xp = await leveling.ledger.get(guild_id, user_id)
+        else:
+            level, xp = await db.get_user_level(guild_id, user_id)
         # Nivel 1 = 10,000 | Nivel 10 = 55,000 | Nivel 50 = 255,000
-        return 5000 + (level * 5000)
+        return db.max_bank_for_level(level)
 
 # Comandos de administrador
     @commands.hybrid_group(name="economy", description="Configura la economía del servidor.")
     @commands.has_permissions(administrator=True)
     async def economy(self, ctx: commands.Context):
         if ctx.invoked_subcommand is None:
-            await ctx.send("Comandos: `/economy set-currency`, `/economy config-work`, `/economy config-daily`, `/economy config-rob`", ephemeral=True)
+            await ctx.send("Comandos: `/economy set-currency`, `/economy config-work`, `/economy config-daily`, `/economy config-rob`, "
+                           "`/economy interest`, `/economy wealth-tax`, `/economy jobs`, `/economy remove-job`, `/economy reset`", ephemeral=True)
 
     @economy.command(name="set-currency", description="Cambia el nombre y emoji de la moneda.")
     async def set_currency(self, ctx: commands.Context, nombre: str, emoji: str):
@@ -97,6 +132,51 @@ class EconomyCog(commands.Cog, name="Economía"):
         await db.execute("UPDATE economy_settings SET rob_cooldown = ? WHERE guild_id = ?", (segundos_espera, ctx.guild.id))
         await ctx.send(f"✅ **Cooldown de robo:** {segundos_espera}s.", ephemeral=True)
 
+    @economy.command(name="interest", description="Programa un interés periódico sobre el banco (respeta el límite por nivel).")
+    @commands.has_permissions(administrator=True)
+    async def interest(self, ctx: commands.Context, porcentaje: float, cada_horas: int = 24):
+        if not 0 < porcentaje <= 100 or cada_horas < 1:
+            return await ctx.send("❌ Valores inválidos. El porcentaje va de 0 a 100 y el intervalo es de al menos 1 hora.", ephemeral=True)
+        await db.set_economy_job(ctx.guild.id, 'interest', porcentaje / 100, interval_hours=cada_horas)
+        await ctx.send(f"✅ **Interés programado:** {porcentaje}% del banco cada {cada_horas}h.", ephemeral=True)
+
+    @economy.command(name="wealth-tax", description="Programa un impuesto periódico sobre el patrimonio por encima de un umbral.")
+    @commands.has_permissions(administrator=True)
+    async def wealth_tax(self, ctx: commands.Context, porcentaje: float, umbral: int, cada_horas: int = 24):
+        if not 0 < porcentaje <= 100 or umbral < 0 or cada_horas < 1:
+            return await ctx.send("❌ Valores inválidos. El porcentaje va de 0 a 100, el umbral es >= 0 y el intervalo es de al menos 1 hora.", ephemeral=True)
+        await db.set_economy_job(ctx.guild.id, 'wealth_tax', porcentaje / 100, threshold=umbral, interval_hours=cada_horas)
+        await ctx.send(f"✅ **Impuesto programado:** {porcentaje}% de lo que supere {umbral:,} cada {cada_horas}h.", ephemeral=True)
+
+    @economy.command(name="jobs", description="Muestra las tareas periódicas de economía del servidor.")
+    @commands.has_permissions(administrator=True)
+    async def jobs(self, ctx: commands.Context):
+        jobs = await db.get_economy_jobs(ctx.guild.id)
+        if not jobs:
+            return await ctx.send("No hay tareas periódicas configuradas.", ephemeral=True)
+        lines = []
+        for job in jobs:
+            umbral = f", umbral {job['threshold']:,}" if job['kind'] == 'wealth_tax' else ""
+            lines.append(f"**{job['kind']}**: {job['rate'] * 100:g}%{umbral}, cada {job['interval_hours']}h "
+                         f"(próxima: {job['next_run']} UTC, última: {job['last_run'] or 'nunca'})")
+        await ctx.send("\n".join(lines), ephemeral=True)
+
+    @economy.command(name="remove-job", description="Elimina una tarea periódica de economía.")
+    @commands.has_permissions(administrator=True)
+    async def remove_job(self, ctx: commands.Context, tipo: Literal['interest', 'wealth_tax']):
+        if await db.delete_economy_job(ctx.guild.id, tipo):
+            await ctx.send(f"✅ Tarea **{tipo}** eliminada.", ephemeral=True)
+        else:
+            await ctx.send(f"❌ No hay ninguna tarea **{tipo}** configurada.", ephemeral=True)
+
+    @economy.command(name="reset", description="Reinicia la economía: todos vuelven al saldo inicial con el banco vacío.")
+    @commands.has_permissions(administrator=True)
+    async def reset_economy(self, ctx: commands.Context, confirmar: bool = False):
+        if not confirmar:
+            return await ctx.send("⚠️ Esto reinicia el saldo de **todos** los usuarios. Repite el comando con `confirmar: True`.", ephemeral=True)
+        affected = await db.reset_guild_economy(ctx.guild.id, ref=ctx.author.id)
+        await ctx.send(f"✅ Economía reiniciada: {affected:,} balances restablecidos.", ephemeral=True)
+
         
     @commands.hybrid_command(name="add-money", description="Añade dinero del servidor a un usuario (Admin).")
     @commands.has_permissions(administrator=True)
@@ -105,7 +185,8 @@ class EconomyCog(commands.Cog, name="Economía"):
         settings = await db.get_cached_economy_settings(ctx.guild.id) or {}
         emoji = settings.get('currency_emoji', '🪙')
 
-        await db.update_balance(ctx.guild.id, miembro.id, wallet_change=cantidad)
+        async with self.get_user_lock(ctx.guild.id, miembro.id):
+            await db.update_balance(ctx.guild.id, miembro.id, wallet_change=cantidad, reason='add_money', ref=ctx.author.id)
         await ctx.send(f"✅ Se han impreso **{cantidad} {emoji}** y añadido a la cartera de {miembro.mention}.")
 
     @commands.hybrid_command(name="remove-money", description="Quita dinero a un usuario. (Paga tus impuestos)")
@@ -115,7 +196,8 @@ class EconomyCog(commands.Cog, name="Economía"):
         settings = await db.get_cached_economy_settings(ctx.guild.id) or {}
         emoji = settings.get('currency_emoji', '🪙')
 
-        await db.update_balance(ctx.guild.id, miembro.id, wallet_change=-cantidad)
+        async with self.get_user_lock(ctx.guild.id, miembro.id):
+            await db.update_balance(ctx.guild.id, miembro.id, wallet_change=-cantidad, reason='remove_money', ref=ctx.author.id)
         await ctx.send(f"🛑 Se han deducido **{cantidad} {emoji}** de la cartera de {miembro.mention}.")
 
     # Bancos y transferencias
@@ -155,7 +237,7 @@ class EconomyCog(commands.Cog, name="Economía"):
         emoji = settings.get('currency_emoji', '🪙')
 
         
-        async with self.get_user_lock(ctx.author.id):
+        async with self.get_user_lock(ctx.guild.id, ctx.author.id):
             wallet, bank = await db.get_balance(ctx.guild.id, ctx.author.id)
             amount = parse_amount(cantidad, wallet)
             
@@ -173,7 +255,7 @@ class EconomyCog(commands.Cog, name="Economía"):
                     # Generic error for now, could be localized too
                     return await ctx.send(f"🏦 Tu banco está rebosando el límite ({max_bank:,} {emoji}).", ephemeral=True)
             
-            new_wallet, new_bank = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-amount, bank_change=amount)
+            new_wallet, new_bank = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-amount, bank_change=amount, reason='deposit')
             await ctx.send(_t('bot.economy.deposit_success', lang=lang, amount=f"{amount:,}", emoji=emoji) + f"\n**Saldo Protegido:** {new_bank:,} / {max_bank:,} {emoji}")
 
     @commands.hybrid_command(name='withdraw', aliases=['with'], description="Saca dinero de tu banco a tu cartera. Uso: 'all' / '100'")
@@ -184,7 +266,7 @@ class EconomyCog(commands.Cog, name="Economía"):
         emoji = settings.get('currency_emoji', '🪙')
 
         
-        async with self.get_user_lock(ctx.author.id):
+        async with self.get_user_lock(ctx.guild.id, ctx.author.id):
             wallet, bank = await db.get_balance(ctx.guild.id, ctx.author.id)
             amount = parse_amount(cantidad, bank)
             
@@ -195,7 +277,7 @@ class EconomyCog(commands.Cog, name="Economía"):
             if amount is None or amount <= 0: return await ctx.send(_t('bot.economy.invalid_amount', lang=lang), ephemeral=True)
             if amount > bank: return await ctx.send(_t('bot.economy.not_enough_money', lang=lang, balance=bank, emoji=emoji), ephemeral=True)
             
-            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=amount, bank_change=-amount)
+            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=amount, bank_change=-amount, reason='withdraw')
             await ctx.send(_t('bot.economy.withdraw_success', lang=lang, amount=f"{amount:,}", emoji=emoji))
 
     @commands.hybrid_command(name='give', aliases=['transfer', 'pay'], description="Págale a un usuario (Impuesto gubernamental de 2% para evitar abusos).")
@@ -209,7 +291,7 @@ class EconomyCog(commands.Cog, name="Economía"):
         emoji = settings.get('currency_emoji', '🪙')
 
 
-        async with self.get_user_lock(ctx.author.id):
+        async with self.get_user_lock(ctx.guild.id, ctx.author.id, miembro.id):
             wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
             
             # Fetch language for localization
@@ -222,8 +304,13 @@ class EconomyCog(commands.Cog, name="Economía"):
             tax = int(cantidad * 0.02)
             real_amount = cantidad - tax
             
-            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-cantidad)
-            await db.update_balance(ctx.guild.id, miembro.id, wallet_change=real_amount)
+            # Transferencia atómica: o se aplican los dos movimientos o ninguno
+            try:
+                async with db.transaction() as tx:
+                    tx.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-cantidad, require_funds=True, reason='give', ref=miembro.id)
+                    tx.update_balance(ctx.guild.id, miembro.id, wallet_change=real_amount, reason='give', ref=ctx.author.id)
+            except db.InsufficientFunds:
+                return await ctx.send(_t('bot.economy.not_enough_money', lang=lang, balance=wallet, emoji=emoji), ephemeral=True)
             
             await ctx.send(_t('bot.economy.give_success', lang=lang, amount=f"{real_amount:,}", emoji=emoji, target=miembro.mention) + f" (Tax: {tax:,} {emoji})")
 
@@ -238,7 +325,7 @@ class EconomyCog(commands.Cog, name="Economía"):
         emoji = settings.get('currency_emoji', '🪙')
 
         
-        async with self.get_user_lock(ctx.author.id):
+        async with self.get_user_lock(ctx.guild.id, ctx.author.id):
             # Fetch language for localization
             server_settings = await db.get_cached_server_settings(ctx.guild.id)
             lang = server_settings.get('language', 'es')
@@ -260,8 +347,9 @@ class EconomyCog(commands.Cog, name="Economía"):
             d_max = eco_conf.get('daily_max', 2500)
             
             reward = random.randint(d_min, d_max)
-            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=reward)
-            await db.set_last_daily(ctx.guild.id, ctx.author.id, now)
+            async with db.transaction() as tx:
+                tx.update_balance(ctx.guild.id, ctx.author.id, wallet_change=reward, reason='daily')
+                tx.set_cooldown(ctx.guild.id, ctx.author.id, 'daily', now)
             
             await ctx.send(_t('bot.economy.daily_success', lang=lang, amount=f"{reward:,}", emoji=emoji))
 
@@ -274,43 +362,45 @@ class EconomyCog(commands.Cog, name="Economía"):
         cooldown_time = settings.get('work_cooldown', 3600)
 
         
-        now_dt = discord.utils.utcnow()
-        last_use_dt = await db.get_cooldown(ctx.guild.id, ctx.author.id, 'work')
-        last_use = last_use_dt.timestamp() if last_use_dt else 0
+        # Con el candado, dos /work simultáneos no pueden saltarse el cooldown
+        async with self.get_user_lock(ctx.guild.id, ctx.author.id):
+            now_dt = discord.utils.utcnow()
+            last_use_dt = await db.get_cooldown(ctx.guild.id, ctx.author.id, 'work')
+            last_use = last_use_dt.timestamp() if last_use_dt else 0
         
-        # Fetch language for localization
-        server_settings = await db.get_cached_server_settings(ctx.guild.id)
-        lang = server_settings.get('language', 'es')
-
-        if now_dt.timestamp() - last_use < cooldown_time:
-            retry_after = cooldown_time - (now_dt.timestamp() - last_use)
-            hours = int(retry_after // 3600)
-            minutes = int((retry_after % 3600) // 60)
-            seconds = int(retry_after % 60)
-            time_str = ""
-            if hours > 0: time_str += f"{hours}h "
-            if minutes > 0: time_str += f"{minutes}m "
-            time_str += f"{seconds}s"
-            return await ctx.send(_t('bot.economy.work_cooldown', lang=lang, time=time_str.strip()), ephemeral=True)
-
-        # Registrar uso en la DB
-        await db.set_cooldown(ctx.guild.id, ctx.author.id, 'work', now_dt)
-
-        min_w = settings.get('work_min', 100)
+            # Fetch language for localization
+            server_settings = await db.get_cached_server_settings(ctx.guild.id)
+            lang = server_settings.get('language', 'es')
 
-        max_w = settings.get('work_max', 350)
-        emoji = settings.get('currency_emoji', '🪙')
-        ganancia = random.randint(min_w, max_w)
+            if now_dt.timestamp() - last_use < cooldown_time:
+                retry_after = cooldown_time - (now_dt.timestamp() - last_use)
+                hours = int(retry_after // 3600)
+                minutes = int((retry_after % 3600) // 60)
+                seconds = int(retry_after % 60)
+                time_str = ""
+                if hours > 0: time_str += f"{hours}h "
+                if minutes > 0: time_str += f"{minutes}m "
+                time_str += f"{seconds}s"
+                return await ctx.send(_t('bot.economy.work_cooldown', lang=lang, time=time_str.strip()), ephemeral=True)
+
+            min_w = settings.get('work_min', 100)
+
+            max_w = settings.get('work_max', 350)
+            emoji = settings.get('currency_emoji', '🪙')
+            ganancia = random.randint(min_w, max_w)
         
-        trabajos = [
-            f"Trabajaste limpiando el código de un bot raro y ganaste **{ganancia} {emoji}**.",
-            f"Sobreviviste a un turno de 4 horas en el McDonalds y tu jefe te arrojó **{ganancia} {emoji}**.",
-            f"Caminaste por la calle mirando el celular y te topaste con **{ganancia} {emoji}**.",
-            f"Hiciste comisiones de dudosa moral en Twitter y te depositaron **{ganancia} {emoji}**.",
-            f"Fuiste minero de cobalto en Minecraft y recolectaste el equivalente a **{ganancia} {emoji}**."
-        ]
+            trabajos = [
+                f"Trabajaste limpiando el código de un bot raro y ganaste **{ganancia} {emoji}**.",
+                f"Sobreviviste a un turno de 4 horas en el McDonalds y tu jefe te arrojó **{ganancia} {emoji}**.",
+                f"Caminaste por la calle mirando el celular y te topaste con **{ganancia} {emoji}**.",
+                f"Hiciste comisiones de dudosa moral en Twitter y te depositaron **{ganancia} {emoji}**.",
+                f"Fuiste minero de cobalto en Minecraft y recolectaste el equivalente a **{ganancia} {emoji}**."
+            ]
         
-        await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=ganancia)
+            # Registrar uso y pagar en una sola transacción
+            async with db.transaction() as tx:
+                tx.set_cooldown(ctx.guild.id, ctx.author.id, 'work', now_dt)
+                tx.update_balance(ctx.guild.id, ctx.author.id, wallet_change=ganancia, reason='work')
         embed = discord.Embed(title="💼 El Mundo Laboral", description=random.choice(trabajos), color=0x3498DB)
         await ctx.send(embed=embed)
 
@@ -331,32 +421,32 @@ class EconomyCog(commands.Cog, name="Economía"):
     async def shop(self, ctx: commands.Context):
         if not ctx.guild: return
         await ctx.defer()
-        items = await db.fetchall("SELECT * FROM shop_items WHERE guild_id = ?", (ctx.guild.id,))
+        items = await db.get_shop_catalog(ctx.guild.id)
         if not items: return await ctx.send("🛒 La tienda está vacía. Vuelve más tarde.", ephemeral=True)
         
         settings = await db.get_cached_economy_settings(ctx.guild.id) or {}
         emoji = settings.get('currency_emoji', '🪙')
 
         
-        embed = discord.Embed(title="🛒 Tienda del Servidor", description="Usa `/buy <ID>` para comprar un artículo.", color=discord.Color.gold())
+        embed = discord.Embed(title="🛒 Tienda del Servidor", description="Usa `/buy <ID o nombre>` para comprar un artículo.", color=discord.Color.gold())
         for item in items:
             tipo_humano = "🛡️ Rol de Discord" if item['type'] == 'role' else "🧪 Objeto Consumible"
             embed.add_field(name=f"ID: {item['item_id']} | {item['name']}", value=f"*- {tipo_humano}*\n{item['description']}\n**Precio:** {item['price']:,} {emoji}", inline=False)
             
         await ctx.send(embed=embed)
 
-    @commands.hybrid_command(name='buy', aliases=['comprar'], description="Compra un artículo de la tienda usando su ID.")
-    async def buy(self, ctx: commands.Context, item_id: int):
+    @commands.hybrid_command(name='buy', aliases=['comprar'], description="Compra un artículo de la tienda usando su ID o su nombre.")
+    async def buy(self, ctx: commands.Context, *, articulo: str):
         if not ctx.guild: return
         await ctx.defer()
-        item = await db.fetchone("SELECT * FROM shop_items WHERE item_id = ? AND guild_id = ?", (item_id, ctx.guild.id))
-        if not item: return await ctx.send("❌ No existe ningún artículo con esa ID en esta tienda.", ephemeral=True)
+        item = (await db.get_shop_catalog(ctx.guild.id)).lookup(articulo)
+        if not item: return await ctx.send("❌ No existe ningún artículo con esa ID o nombre en esta tienda.", ephemeral=True)
         
         settings = await db.get_cached_economy_settings(ctx.guild.id) or {}
         emoji = settings.get('currency_emoji', '🪙')
 
         
-        async with self.get_user_lock(ctx.author.id):
+        async with self.get_user_lock(ctx.guild.id, ctx.author.id):
             wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
             if wallet < item['price']: return await ctx.send(f"❌ Efectivo insuficiente. Cuesta **{item['price']:,} {emoji}** y tienes **{wallet:,} {emoji}**.", ephemeral=True)
             
@@ -373,20 +463,23 @@ class EconomyCog(commands.Cog, name="Economía"):
                 except discord.Forbidden:
                     return await ctx.send("❌ No tengo permisos suficientes para entregarte el rol. Dile a un admin que suba al bot por encima de este en la lista de roles de Discord.")
                     
-                await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-item['price'])
+                await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-item['price'], reason='buy', ref=item['item_id'])
                 await ctx.send(f"🛍️ Has comprado exitosamente el rol **{item['name']}** por {item['price']:,} {emoji}.")
                 
             elif item['type'] == 'consumable':
-                await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-item['price'])
-                await db.execute("INSERT INTO inventory (guild_id, user_id, item_id, quantity) VALUES (?, ?, ?, 1) ON CONFLICT(guild_id, user_id, item_id) DO UPDATE SET quantity = quantity + 1", (ctx.guild.id, ctx.author.id, item['item_id']))
+                try:
+                    async with db.transaction() as tx:
+                        tx.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-item['price'], require_funds=True, reason='buy', ref=item['item_id'])
+                        tx.execute("INSERT INTO inventory (guild_id, user_id, item_id, quantity) VALUES (?, ?, ?, 1) ON CONFLICT(guild_id, user_id, item_id) DO UPDATE SET quantity = quantity + 1", (ctx.guild.id, ctx.author.id, item['item_id']))
+                except db.InsufficientFunds:
+                    return await ctx.send(f"❌ Efectivo insuficiente. Cuesta **{item['price']:,} {emoji}**.", ephemeral=True)
                 await ctx.send(f"🛍️ Has comprado **{item['name']}** por {item['price']:,} {emoji}. Revisa tu `/inventory`.")
 
     @commands.hybrid_command(name='inventory', aliases=['inv', 'mochila'], description="Revisa los consumibles y objetos que has comprado.")
     async def inventory(self, ctx: commands.Context):
         if not ctx.guild: return
         await ctx.defer()
-        query = "SELECT i.quantity, s.name, s.description FROM inventory i JOIN shop_items s ON i.item_id = s.item_id WHERE i.guild_id = ? AND i.user_id = ? AND i.quantity > 0"
-        items = await db.fetchall(query, (ctx.guild.id, ctx.author.id))
+        items = await db.get_inventory(ctx.guild.id, ctx.author.id)
         
         if not items: return await ctx.send("🎒 Tu mochila está completamente vacía.", ephemeral=True)
         
@@ -408,18 +501,18 @@ class EconomyCog(commands.Cog, name="Economía"):
         settings = await db.get_cached_economy_settings(ctx.guild.id) or {}
         cooldown_time = settings.get('rob_cooldown', 21600)
 
-        
-        now_dt = discord.utils.utcnow()
-        last_use_dt = await db.get_cooldown(ctx.guild.id, ctx.author.id, 'rob')
-        last_use = last_use_dt.timestamp() if last_use_dt else 0
-        
-        if now_dt.timestamp() - last_use < cooldown_time:
-            retry_after = cooldown_time - (now_dt.timestamp() - last_use)
-            return await ctx.send(f"⏳ El último atraco fue demasiado tenso. La policía te busca. Intenta de nuevo en **{int(retry_after/3600)}h {int((retry_after%3600)/60)}m**.", ephemeral=True)
-        
         emoji = settings.get('currency_emoji', '🪙')
         
-        async with self.get_user_lock(ctx.author.id):
+        # Ladrón y víctima bloqueados: el cooldown y los saldos se leen y se cobran sin carreras
+        async with self.get_user_lock(ctx.guild.id, ctx.author.id, miembro.id):
+            now_dt = discord.utils.utcnow()
+            last_use_dt = await db.get_cooldown(ctx.guild.id, ctx.author.id, 'rob')
+            last_use = last_use_dt.timestamp() if last_use_dt else 0
+            
+            if now_dt.timestamp() - last_use < cooldown_time:
+                retry_after = cooldown_time - (now_dt.timestamp() - last_use)
+                return await ctx.send(f"⏳ El último atraco fue demasiado tenso. La policía te busca. Intenta de nuevo en **{int(retry_after/3600)}h {int((retry_after%3600)/60)}m**.", ephemeral=True)
+            
             # Fetch language for localization
             server_settings = await db.get_cached_server_settings(ctx.guild.id)
             lang = server_settings.get('language', 'es')
@@ -441,18 +534,18 @@ class EconomyCog(commands.Cog, name="Economía"):
             await db.set_cooldown(ctx.guild.id, ctx.author.id, 'rob', now_dt)
 
             # Revisar si la víctima tiene un consumible protector tipo "escudo" en el inventario
-            shield_item = await db.fetchone("""
-                SELECT i.item_id 
-                FROM inventory i JOIN shop_items s ON i.item_id = s.item_id 
-                WHERE i.guild_id = ? AND i.user_id = ? AND s.type = 'consumable' AND LOWER(s.name) LIKE '%escudo%' AND i.quantity > 0
-            """, (ctx.guild.id, miembro.id))
+            shield_ids = (await db.get_shop_catalog(ctx.guild.id)).ids_matching('consumable', 'escudo')
+            shield_item = None
+            if shield_ids:
+                shield_item = next((row for row in await db.get_inventory(ctx.guild.id, miembro.id) if row['item_id'] in shield_ids), None)
             
             if shield_item:
-                # Romper el escudo (consumirlo)
-                await db.execute("UPDATE inventory SET quantity = quantity - 1 WHERE guild_id = ? AND user_id = ? AND item_id = ?", (ctx.guild.id, miembro.id, shield_item['item_id']))
                 # Aplicar emboscada policial automática
                 multa = int(robador_w * 0.50) # El ladrón pierde el 50% de sus fondos líquidos
-                await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-multa)
+                async with db.transaction() as tx:
+                    # Romper el escudo (consumirlo)
+                    tx.execute("UPDATE inventory SET quantity = quantity - 1 WHERE guild_id = ? AND user_id = ? AND item_id = ?", (ctx.guild.id, miembro.id, shield_item['item_id']))
+                    tx.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-multa, reason='rob_shield', ref=miembro.id)
                 embed = discord.Embed(title="🚨 ¡EMBOSCADA POLICIAL!", description=f"{miembro.mention} tenía un **Escudo de Seguridad** activo.\nAl intentar robarle, saltó la trampa y fuiste acorralado por el FBI.\nHas sido multado severamente perdiendo **{multa:,} {emoji}**.\n\n*El escudo de tu objetivo se ha roto.*", color=discord.Color.red())
                 return await ctx.send(embed=embed)
 
@@ -462,21 +555,26 @@ class EconomyCog(commands.Cog, name="Economía"):
             exito = random.randint(1, 100)
             if exito <= 45: # 45% probabilidad de éxito
                 cantidad = random.randint(10, int(victima_w * 0.35))
-                await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=cantidad)
-                await db.update_balance(ctx.guild.id, miembro.id, wallet_change=-cantidad)
+                async with db.transaction() as tx:
+                    tx.update_balance(ctx.guild.id, ctx.author.id, wallet_change=cantidad, reason='rob', ref=miembro.id)
+                    tx.update_balance(ctx.guild.id, miembro.id, wallet_change=-cantidad, reason='robbed', ref=ctx.author.id)
                 await ctx.send(_t('bot.economy.rob_success', lang=lang, amount=f"{cantidad:,}", emoji=emoji, target=miembro.mention))
             else:
                 multa = random.randint(10, int(robador_w * 0.20))
-                await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-multa)
-                await db.update_balance(ctx.guild.id, miembro.id, wallet_change=multa)
+                async with db.transaction() as tx:
+                    tx.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-multa, reason='rob_fine', ref=miembro.id)
+                    tx.update_balance(ctx.guild.id, miembro.id, wallet_change=multa, reason='rob_fine', ref=ctx.author.id)
                 await ctx.send(_t('bot.economy.rob_failed', lang=lang, amount=f"{multa:,}", emoji=emoji, target=miembro.mention))
 
     @commands.hybrid_command(name='leaderboard', aliases=['richest'], description="Observa qué personas tienen más estatus que tú.")
-    async def leaderboard(self, ctx: commands.Context):
+    async def leaderboard(self, ctx: commands.Context, pagina: int = 1, cerca_de_mi: bool = False):
         if not ctx.guild: return
         await ctx.defer()
-        query = "SELECT user_id, wallet, bank FROM balances WHERE guild_id = ? ORDER BY (wallet + bank) DESC LIMIT 10"
-        top_users = await db.fetchall(query, (ctx.guild.id,))
+        # Ordenado por el índice (guild_id, net_worth): sin ordenar todo el servidor
+        if cerca_de_mi:
+            top_users = await db.get_leaderboard_around('economy', ctx.guild.id, ctx.author.id)
+        else:
+            top_users = await db.get_leaderboard_page('economy', ctx.guild.id, pagina)
         
         settings = await db.get_cached_economy_settings(ctx.guild.id) or {}
         emoji = settings.get('currency_emoji', '🪙')
@@ -486,20 +584,19 @@ class EconomyCog(commands.Cog, name="Economía"):
         
         embed = discord.Embed(title=f"🏆 Los Más Poderosos de {ctx.guild.name} 🏆", color=self.bot.CREAM_COLOR)
         description = ""
-        for i, row in enumerate(top_users):
-            user = self.bot.get_user(row['user_id'])
-            if not user:
-                try: user = await self.bot.fetch_user(row['user_id'])
-                except: name = f"Usuario ({row['user_id']})"
-            
-            if user: name = user.display_name
-            
-            net = row['wallet'] + row['bank']
-            rank = ["🥇", "🥈", "🥉"][i] if i < 3 else f"`{i+1}.`"
+        names = await resolve_display_names(self.bot, ctx.guild, [row['user_id'] for row in top_users])
+        for row in top_users:
+            name = names[row['user_id']]
+            net = row['net_worth']
+            rank = ["🥇", "🥈", "🥉"][row['rank'] - 1] if row['rank'] <= 3 else f"`{row['rank']}.`"
             description += f"{rank} **{name}**: {net:,} {emoji}\n"
             
         embed.description = description
-        embed.set_footer(text="Basado en el NETO (Cartera Líquida + Banco Segurizado)")
+        footer = "Basado en el NETO (Cartera Líquida + Banco Segurizado)"
+        me = await db.get_user_rank('economy', ctx.guild.id, ctx.author.id)
+        if me:
+            footer += f" • Tu puesto: #{me['rank']:,} de {me['total']:,}"
+        embed.set_footer(text=footer)
         await ctx.send(embed=embed)
 
 async def setup(bot: commands.Bot):
@@ -1,7 +1,6 @@
 import discord
 from discord.ext import commands
 import random
-from PIL import Image
 from io import BytesIO
 from typing import Literal, Optional
 import aiohttp
@@ -11,8 +10,11 @@ from utils.constants import WANTED_TEMPLATE_URL
 # Importamos nuestros helpers de API e integración de BD
 from utils.api_helpers import ask_gemini, search_anime
 from utils import database_manager as db
+from utils.member_resolver import resolve_display_names
+from utils.image_service import image_service
+from utils.interaction_guard import GuardedModal, GuardedView
 
-class TriviaView(discord.ui.View):
+class TriviaView(GuardedView):
     def __init__(self, ctx: commands.Context, cog, correct_ans: str, prize: int):
         super().__init__(timeout=20.0)
         self.ctx = ctx
@@ -37,7 +39,7 @@ class TriviaView(discord.ui.View):
                 item.disabled = True
                 if item.label == button.label: item.style = discord.ButtonStyle.success
             
-            await db.update_balance(interaction.guild.id, interaction.user.id, wallet_change=self.prize)
+            await db.update_balance(interaction.guild.id, interaction.user.id, wallet_change=self.prize, reason='trivia')
             embed = discord.Embed(title="🎉 ¡Correcto!", description=f"{interaction.user.mention} conocía la respuesta: **{self.correct_ans}**.\nSe le han transferido directamente **+{self.prize}** monedas a su cartera.", color=discord.Color.green())
             await interaction.response.edit_message(embed=embed, view=self)
         else:
@@ -52,7 +54,7 @@ class TriviaView(discord.ui.View):
     @discord.ui.button(label="D", style=discord.ButtonStyle.primary)
     async def btn_d(self, interaction: discord.Interaction, button: discord.ui.Button): await self.check_answer(interaction, button)
 
-class ConfessionModal(discord.ui.Modal, title="Confesión Anónima"):
+class ConfessionModal(GuardedModal, title="Confesión Anónima"):
     texto = discord.ui.TextInput(label="Escribe tu secreto aquí", style=discord.TextStyle.paragraph, max_length=1500, placeholder="Nadie sabrá que fuiste tú, ni siquiera los administradores...", required=True)
     
     async def on_submit(self, interaction: discord.Interaction):
@@ -70,7 +72,7 @@ class ConfessionModal(discord.ui.Modal, title="Confesión Anónima"):
         except Exception as e:
             await interaction.response.send_message(f"❌ Error al enviar la confesión: {e}", ephemeral=True)
 
-class ConfessView(discord.ui.View):
+class ConfessView(GuardedView):
     def __init__(self):
         super().__init__(timeout=None)
     
@@ -167,17 +169,6 @@ class FunCog(commands.Cog, name="Juegos e IA"):
 
     # --- Comandos que no usan APIs externas (se mantienen igual) ---
 
-    def process_wanted_image(self, template_bytes: bytes, avatar_bytes: bytes) -> BytesIO:
-        template = Image.open(BytesIO(template_bytes)).convert("RGBA")
-        avatar = Image.open(BytesIO(avatar_bytes)).convert("RGBA")
-        avatar_size = (833, 820); paste_position = (96, 445)
-        avatar = avatar.resize(avatar_size)
-        template.paste(avatar, paste_position, avatar)
-        final_buffer = BytesIO()
-        template.save(final_buffer, format="PNG")
-        final_buffer.seek(0)
-        return final_buffer
-
     @commands.hybrid_command(name='wanted', description="Crea un cartel de 'Se Busca' para un usuario.")
     async def wanted(self, ctx: commands.Context, miembro: Optional[discord.Member] = None):
         await ctx.defer()
@@ -191,9 +182,9 @@ class FunCog(commands.Cog, name="Juegos e IA"):
                 if resp.status != 200: return await ctx.send("❌ No pude descargar el avatar.")
                 avatar_bytes = await resp.read()
             
-            buffer = await self.bot.loop.run_in_executor(None, self.process_wanted_image, template_bytes, avatar_bytes)
+            png = await image_service.render('wanted', template_bytes, avatar_bytes)
             
-            file = discord.File(buffer, filename="wanted.png")
+            file = discord.File(BytesIO(png), filename="wanted.png")
             await ctx.send(file=file)
         except Exception as e:
             print(f"Error en /wanted: {e}")
@@ -305,7 +296,7 @@ class FunCog(commands.Cog, name="Juegos e IA"):
         wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
         if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente. Cada tirada cuesta **{apuesta:,} {emoji_currency}**.", ephemeral=True)
         
-        await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta)
+        await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta, reason='gacha_pull')
         
         try:
             async with self.bot.http_session.get("https://api.jikan.moe/v4/random/characters") as resp:
@@ -337,15 +328,20 @@ class FunCog(commands.Cog, name="Juegos e IA"):
         await ctx.send(embed=embed)
 
     @gacha.command(name="list", aliases=['collection'], description="Muestra tu colección de personajes del gacha.")
-    async def gacha_list(self, ctx: commands.Context):
-        chars = await db.fetchall("SELECT character_name, rarity FROM gacha_collection WHERE guild_id = ? AND user_id = ?", (ctx.guild.id, ctx.author.id))
-        if not chars: return await ctx.send("❌ No tienes ningún personaje en tu colección. Usa `/gacha pull`.", ephemeral=True)
+    async def gacha_list(self, ctx: commands.Context, usuario: Optional[discord.User] = None):
+        target_id = usuario.id if usuario else ctx.author.id
+        chars = await db.fetchall("SELECT character_name, rarity FROM gacha_collection WHERE guild_id = ? AND user_id = ?", (ctx.guild.id, target_id))
+        if not chars:
+            if usuario: return await ctx.send("❌ Ese usuario no tiene personajes en su colección.", ephemeral=True)
+            return await ctx.send("❌ No tienes ningún personaje en tu colección. Usa `/gacha pull`.", ephemeral=True)
+        # Nombre en el servidor (aunque el usuario ya no esté), desde la caché compartida de nombres
+        owner_name = (await resolve_display_names(self.bot, ctx.guild, [target_id]))[target_id]
         
         counts = {"Mítico": [], "Legendario": [], "Épico": [], "Raro": [], "Común": []}
         for c in chars:
             counts[c['rarity']].append(c['character_name'])
             
-        embed = discord.Embed(title=f"📚 Colección Gacha de {ctx.author.display_name}", color=self.bot.CREAM_COLOR)
+        embed = discord.Embed(title=f"📚 Colección Gacha de {owner_name}", color=self.bot.CREAM_COLOR)
         embed.description = f"Personajes totales: **{len(chars)}**"
         for r, lst in counts.items():
             if lst:
@@ -6,18 +6,24 @@ from typing import Optional
 
 # Importamos el gestor de base de datos
 from utils import database_manager as db
+from utils.lock_registry import balance_locks
+from utils.interaction_guard import GuardedView
 
-class BlackJackView(discord.ui.View):
+class BlackJackView(GuardedView):
     def __init__(self, cog: 'GamblingCog', ctx: commands.Context, bet: int):
         super().__init__(timeout=120.0)
         self.cog = cog
         self.author = ctx.author
         self.bet = bet
+        # Mensaje que abrió la mesa: une apuesta y pago en economy_ledger
+        self.ref = ctx.message.id
         self.player_hand = [self.cog.deal_card(), self.cog.deal_card()]
         self.dealer_hand = [self.cog.deal_card(), self.cog.deal_card()]
         self.message: Optional[discord.Message] = None
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if not await super().interaction_check(interaction):
+            return False
         if interaction.user.id != self.author.id:
             await interaction.response.send_message("No puedes jugar en la mesa de otra persona.", ephemeral=True, delete_after=10)
             return False
@@ -27,7 +33,8 @@ class BlackJackView(discord.ui.View):
         for item in self.children: item.disabled = True
         
         # Reembolsar la apuesta
-        await db.update_balance(self.author.guild.id, self.author.id, wallet_change=self.bet)
+        async with self.cog.balance_lock(self.author.guild.id, self.author.id):
+            await db.update_balance(self.author.guild.id, self.author.id, wallet_change=self.bet, reason='blackjack_refund', ref=self.ref)
         
         timeout_embed = self.create_embed()
         timeout_embed.description = "⌛ El crupier ha cerrado la mesa por inactividad. Recuperas tu apuesta."
@@ -82,10 +89,13 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
             return False
         return True
 
+    def balance_lock(self, guild_id: int, user_id: int):
+        """Mismo candado de saldo que usa la economía: una apuesta no se cruza con un /give o /deposit."""
+        return balance_locks.hold((guild_id, user_id))
+
     async def can_gamble(self, ctx: commands.Context) -> bool:
         """Verifica si el usuario puede apostar en este canal."""
-        active_channels_rows = await db.fetchall("SELECT channel_id FROM gambling_active_channels WHERE guild_id = ?", (ctx.guild.id,))
-        active_channels = [r['channel_id'] for r in active_channels_rows]
+        active_channels = await db.get_active_channels('gambling', ctx.guild.id)
 
         if not active_channels:
             if ctx.author.guild_permissions.administrator:
@@ -113,6 +123,8 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
         return score
 
     async def end_blackjack_game(self, interaction: discord.Interaction, view: BlackJackView):
+        # Partida resuelta: sin esto el timeout de la vista reembolsaría la apuesta otra vez
+        view.stop()
         player_score = self.calculate_score(view.player_hand)
         while self.calculate_score(view.dealer_hand) < 17:
             view.dealer_hand.append(self.deal_card())
@@ -130,14 +142,16 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
             ganancia_neta = view.bet 
             result_message = f"¡Le has ganado al Crupier! ¡Ganas **{ganancia_neta:,} {emoji}** netos!"
             # Se le devuelve la apuesta + la ganancia neta
-            await db.update_balance(interaction.guild.id, interaction.user.id, wallet_change=view.bet + ganancia_neta)
+            async with self.balance_lock(interaction.guild.id, interaction.user.id):
+                await db.update_balance(interaction.guild.id, interaction.user.id, wallet_change=view.bet + ganancia_neta, reason='blackjack_payout', ref=view.ref)
         elif player_score < dealer_score:
             result_message = f"El Crupier gana. ¡Perdiste tus **{view.bet:,} {emoji}**!"
             # Ya se cobró al inicio
         else:
             result_message = "Mismo puntaje, ha sido un Empate (Push). Se te devuelve tu dinero."
             # Se le devuelve la apuesta íntegra
-            await db.update_balance(interaction.guild.id, interaction.user.id, wallet_change=view.bet)
+            async with self.balance_lock(interaction.guild.id, interaction.user.id):
+                await db.update_balance(interaction.guild.id, interaction.user.id, wallet_change=view.bet, reason='blackjack_push', ref=view.ref)
 
         final_embed = view.create_embed(show_dealer_card=True)
         final_embed.description = result_message
@@ -147,8 +161,8 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
     @commands.has_permissions(administrator=True)
     async def gambling(self, ctx: commands.Context):
         if ctx.invoked_subcommand is None:
-            active_channels_rows = await db.fetchall("SELECT channel_id FROM gambling_active_channels WHERE guild_id = ?", (ctx.guild.id,))
-            channels_list = "\n".join([f"<#{r['channel_id']}>" for r in active_channels_rows]) if active_channels_rows else "Ninguno"
+            active_channels = await db.get_active_channels('gambling', ctx.guild.id)
+            channels_list = "\n".join([f"<#{cid}>" for cid in sorted(active_channels)]) if active_channels else "Ninguno"
             embed = discord.Embed(title="🎲 Configuración del Casino", color=self.bot.CREAM_COLOR)
             embed.add_field(name="Zonas de Apuestas Activas", value=channels_list)
             await ctx.send(embed=embed, ephemeral=True)
@@ -175,11 +189,12 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
         if apuesta <= 0: return await ctx.send("❌ Apuesta algo más que aire vacío.", ephemeral=True)
         if apuesta > 100000: return await ctx.send("❌ La casa limita las apuestas de Blackjack a 100,000 máximo para evitar bancarrota.", ephemeral=True)
 
-        wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-        if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente en la cartera. (Tienes **{wallet:,} {emoji}**)", ephemeral=True)
+        async with self.balance_lock(ctx.guild.id, ctx.author.id):
+            wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+            if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente en la cartera. (Tienes **{wallet:,} {emoji}**)", ephemeral=True)
 
-        # Cobro inmediato para evitar exploits
-        await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta)
+            # Cobro inmediato para evitar exploits
+            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta, reason='blackjack_bet', ref=ctx.message.id)
 
         view = BlackJackView(self, ctx, apuesta)
         msg = await ctx.send(embed=view.create_embed(), view=view)
@@ -197,32 +212,33 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
         if apuesta <= 0: return await ctx.send("❌ Inserta al menos 1 moneda.", ephemeral=True)
         if apuesta > 100000: return await ctx.send("❌ La máquina tragamonedas solo acepta hasta 100,000 por tirada.", ephemeral=True)
         
-        wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-        if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente en tu cartera. (Tienes **{wallet:,} {emoji}**)", ephemeral=True)
+        async with self.balance_lock(ctx.guild.id, ctx.author.id):
+            wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+            if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente en tu cartera. (Tienes **{wallet:,} {emoji}**)", ephemeral=True)
+
+            # Configuración "House Edge": Para que la economía no se infle desmedidamente por el trabajo diario.
+            emojis = ["🍒", "🔔", "🍋", "⭐", "💎", "🍀", "🍇", "💩"]
+
+            reels = [random.choice(emojis) for _ in range(3)]
+
+            result_text = f"**[ {reels[0]}  |  {reels[1]}  |  {reels[2]} ]**"
+
+            if reels[0] == reels[1] == reels[2]:
+                if reels[0] == "💎": winnings = apuesta * 20 # Súper jackpot
+                elif reels[0] == "💩": winnings = 1 # Premio troleo
+                else: winnings = apuesta * 7
+                result_text += f"\n\n**¡JACKPOT ABSOLUTO!** ¡El sistema escupe **{winnings:,} {emoji}**!"
+            elif reels[0] == reels[1] or reels[1] == reels[2]:
+                # Dos iguales
+                winnings = int(apuesta * 1.5)
+                result_text += f"\n\n¡Casi! Tienes dos iguales y ganas **{winnings:,} {emoji}**."
+            else:
+                winnings = 0
+                result_text += f"\n\n¡Mala suerte, tira otra vez! Perdiste tu apuesta de **{apuesta:,} {emoji}**."
 
-        # Configuración "House Edge": Para que la economía no se infle desmedidamente por el trabajo diario.
-        emojis = ["🍒", "🔔", "🍋", "⭐", "💎", "🍀", "🍇", "💩"]
-        
-        reels = [random.choice(emojis) for _ in range(3)]
-            
-        result_text = f"**[ {reels[0]}  |  {reels[1]}  |  {reels[2]} ]**"
-
-        if reels[0] == reels[1] == reels[2]:
-            if reels[0] == "💎": winnings = apuesta * 20 # Súper jackpot
-            elif reels[0] == "💩": winnings = 1 # Premio troleo
-            else: winnings = apuesta * 7
-            result_text += f"\n\n**¡JACKPOT ABSOLUTO!** ¡El sistema escupe **{winnings:,} {emoji}**!"
-        elif reels[0] == reels[1] or reels[1] == reels[2]:
-            # Dos iguales
-            winnings = int(apuesta * 1.5)
-            result_text += f"\n\n¡Casi! Tienes dos iguales y ganas **{winnings:,} {emoji}**."
-        else:
-            winnings = 0
-            result_text += f"\n\n¡Mala suerte, tira otra vez! Perdiste tu apuesta de **{apuesta:,} {emoji}**."
-        
-        # Cálculo de dinero
-        net_change = winnings - apuesta
-        new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=net_change)
+            # Cálculo de dinero
+            net_change = winnings - apuesta
+            new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=net_change, reason='slots', ref=ctx.message.id)
 
         # --- NUEVO DISEÑO PREMIUM ---
         embed = discord.Embed(color=self.bot.CREAM_COLOR)
@@ -245,29 +261,30 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
 
         if apuesta <= 0: return await ctx.send("❌ Apostar sentimientos no es válido aquí.", ephemeral=True)
 
-        wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-        if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente en tu cartera. (Tienes **{wallet:,} {emoji_currency}**)", ephemeral=True)
+        async with self.balance_lock(ctx.guild.id, ctx.author.id):
+            wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+            if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente en tu cartera. (Tienes **{wallet:,} {emoji_currency}**)", ephemeral=True)
 
-        # Cobro inmediato
-        await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta)
+            # Cobro inmediato
+            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta, reason='coinflip_bet', ref=ctx.message.id)
 
-        # Convertir a texto estandarizado
-        if choice == 'heads': choice = 'cara'
-        if choice == 'tails': choice = 'cruz'
+            # Convertir a texto estandarizado
+            if choice == 'heads': choice = 'cara'
+            if choice == 'tails': choice = 'cruz'
 
-        coin_faces = ['cara', 'cruz']
-        # El bot lanza la moneda
-        result = random.choice(coin_faces)
-        
-        # Calculamos si ganó o perdió
-        if choice == result:
-            ganancia_neta = apuesta
-            # Se devuelve apuesta + ganancia neta
-            new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=apuesta + ganancia_neta)
-            desc = f"La moneda voló y cayó en **{result.upper()}**.\n\n🎉 ¡Has acertado con precisión milimétrica! Te llevas tu ganancia de **{ganancia_neta:,} {emoji_currency}**."
-        else:
-            new_wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-            desc = f"La moneda dio volteretas y cayó en **{result.upper()}**.\n\n❌ Has fallado la predicción. Perdiste dramáticamente tu apuesta de **{apuesta:,} {emoji_currency}**."
+            coin_faces = ['cara', 'cruz']
+            # El bot lanza la moneda
+            result = random.choice(coin_faces)
+
+            # Calculamos si ganó o perdió
+            if choice == result:
+                ganancia_neta = apuesta
+                # Se devuelve apuesta + ganancia neta
+                new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=apuesta + ganancia_neta, reason='coinflip_payout', ref=ctx.message.id)
+                desc = f"La moneda voló y cayó en **{result.upper()}**.\n\n🎉 ¡Has acertado con precisión milimétrica! Te llevas tu ganancia de **{ganancia_neta:,} {emoji_currency}**."
+            else:
+                new_wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+                desc = f"La moneda dio volteretas y cayó en **{result.upper()}**.\n\n❌ Has fallado la predicción. Perdiste dramáticamente tu apuesta de **{apuesta:,} {emoji_currency}**."
         
         # --- NUEVO DISEÑO PREMIUM ---
         file = discord.File("gif-image/panic.gif", filename="panic.gif")
@@ -292,11 +309,12 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
         if apuesta <= 0: return await ctx.send("❌ Apostar sentimientos no es válido aquí.", ephemeral=True)
         if apuesta > 100000: return await ctx.send("❌ El hipódromo limita las apuestas a 100,000 máximo.", ephemeral=True)
         
-        wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-        if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente en tu cartera. (Tienes **{wallet:,} {emoji_currency}**)", ephemeral=True)
+        async with self.balance_lock(ctx.guild.id, ctx.author.id):
+            wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+            if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente en tu cartera. (Tienes **{wallet:,} {emoji_currency}**)", ephemeral=True)
 
-        # Cobro por adelantado para evitar exploits de duplicado durante el delay
-        await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta)
+            # Cobro por adelantado para evitar exploits de duplicado durante el delay
+            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta, reason='horse_race_bet', ref=ctx.message.id)
         
         # Carrera de caballos visual
         pista_length = 15
@@ -335,13 +353,14 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
                 break
             await asyncio.sleep(1.5)
             
-        if ganador == caballo:
-            ganancia_total = int(apuesta * 3.5) # Devuelve su apuesta + ganancia (2.5x netos)
-            new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=ganancia_total)
-            embed.description += f"\n\n🎉 ¡Tu caballo finalizó en **primer lugar**! Ganaste **{ganancia_total:,} {emoji_currency}**."
-        else:
-            new_wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-            embed.description += f"\n\n❌ El caballo **{ganador}** cruzó la meta primero. Perdiste tu apuesta de **{apuesta:,} {emoji_currency}**."
+        async with self.balance_lock(ctx.guild.id, ctx.author.id):
+            if ganador == caballo:
+                ganancia_total = int(apuesta * 3.5) # Devuelve su apuesta + ganancia (2.5x netos)
+                new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=ganancia_total, reason='horse_race_payout', ref=ctx.message.id)
+                embed.description += f"\n\n🎉 ¡Tu caballo finalizó en **primer lugar**! Ganaste **{ganancia_total:,} {emoji_currency}**."
+            else:
+                new_wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+                embed.description += f"\n\n❌ El caballo **{ganador}** cruzó la meta primero. Perdiste tu apuesta de **{apuesta:,} {emoji_currency}**."
         
         embed.color = self.bot.CREAM_COLOR
             
@@ -363,33 +382,34 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
         emoji_currency = settings.get('currency_emoji', '🪙')
 
         if apuesta <= 0: return await ctx.send("❌ Apuesta algo de verdad.", ephemeral=True)
-        wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-        if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente. (Tienes **{wallet:,} {emoji_currency}**)", ephemeral=True)
-
-        await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta)
-        
-        num = random.randint(0, 36)
-        rojos = [1,3,5,7,9,12,14,16,18,19,21,23,25,27,30,32,34,36]
-        color = 'verde' if num == 0 else ('rojo' if num in rojos else 'negro')
-        
-        color_emojis = {'rojo': '🔴', 'negro': '⚫', 'verde': '🟢'}
-        emoji_bola = color_emojis[color]
-        
-        ganancia_total = 0
-        if eleccion == str(num): # Pleno
-            ganancia_total = apuesta * 36
-        elif eleccion == color:
-            if color == 'verde': ganancia_total = apuesta * 14
-            else: ganancia_total = apuesta * 2
-            
-        if ganancia_total > 0:
-            new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=ganancia_total)
-            desc = f"La bola gira y cae en... **{num} {color.upper()} {emoji_bola}**\n\n🎉 ¡Acertaste tu apuesta a **{eleccion}**! Ganaste **{ganancia_total:,} {emoji_currency}**."
-            color_embed = discord.Color.green()
-        else:
-            new_wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-            desc = f"La bola gira y cae en... **{num} {color.upper()} {emoji_bola}**\n\n❌ Apostaste a **{eleccion}**, pierdes tus **{apuesta:,} {emoji_currency}**."
-            color_embed = discord.Color.red()
+        async with self.balance_lock(ctx.guild.id, ctx.author.id):
+            wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+            if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente. (Tienes **{wallet:,} {emoji_currency}**)", ephemeral=True)
+
+            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta, reason='roulette_bet', ref=ctx.message.id)
+
+            num = random.randint(0, 36)
+            rojos = [1,3,5,7,9,12,14,16,18,19,21,23,25,27,30,32,34,36]
+            color = 'verde' if num == 0 else ('rojo' if num in rojos else 'negro')
+
+            color_emojis = {'rojo': '🔴', 'negro': '⚫', 'verde': '🟢'}
+            emoji_bola = color_emojis[color]
+
+            ganancia_total = 0
+            if eleccion == str(num): # Pleno
+                ganancia_total = apuesta * 36
+            elif eleccion == color:
+                if color == 'verde': ganancia_total = apuesta * 14
+                else: ganancia_total = apuesta * 2
+
+            if ganancia_total > 0:
+                new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=ganancia_total, reason='roulette_payout', ref=ctx.message.id)
+                desc = f"La bola gira y cae en... **{num} {color.upper()} {emoji_bola}**\n\n🎉 ¡Acertaste tu apuesta a **{eleccion}**! Ganaste **{ganancia_total:,} {emoji_currency}**."
+                color_embed = discord.Color.green()
+            else:
+                new_wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+                desc = f"La bola gira y cae en... **{num} {color.upper()} {emoji_bola}**\n\n❌ Apostaste a **{eleccion}**, pierdes tus **{apuesta:,} {emoji_currency}**."
+                color_embed = discord.Color.red()
             
         # --- NUEVO DISEÑO PREMIUM ---
         embed = discord.Embed(color=color_embed)
@@ -407,10 +427,11 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
         emoji = settings.get('currency_emoji', '🪙')
 
         if apuesta <= 0: return await ctx.send("❌ No puedes jugar gratis.", ephemeral=True)
-        wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-        if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente. (Tienes **{wallet:,} {emoji}**)", ephemeral=True)
+        async with self.balance_lock(ctx.guild.id, ctx.author.id):
+            wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+            if wallet < apuesta: return await ctx.send(f"❌ Efectivo insuficiente. (Tienes **{wallet:,} {emoji}**)", ephemeral=True)
 
-        await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta)
+            await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=-apuesta, reason='russian_roulette_bet', ref=ctx.message.id)
         
         embed = discord.Embed(title="🔫 Ruleta Rusa", description="Has puesto el revólver en tu cabeza y girado el tambor...\n\n*Click...*", color=self.bot.CREAM_COLOR)
         msg = await ctx.send(embed=embed)
@@ -419,15 +440,16 @@ class GamblingCog(commands.Cog, name="Juegos de Azar"):
         # 1 bala, 6 recámaras (1/6 de morir)
         muerto = random.randint(1, 6) == 1
         
-        if muerto:
-            new_wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
-            embed.description = f"**B A N G !** 💥\n\nHas muerto. La bala estaba en esa recámara. Toda tu apuesta de **{apuesta:,} {emoji}** está manchada de sangre."
-            embed.color = discord.Color.dark_red()
-        else:
-            ganancia_total = int(apuesta * 1.15) # Retorna el 115% de lo apostado (+15% de fee por supervivencia)
-            new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=ganancia_total)
-            embed.description = f"**Click.** 💨\n\nSobreviviste. Había una recámara vacía. Te llevas tu apuesta de vuelta y además ganas un bono de supervivencia. Recibes **{ganancia_total:,} {emoji}**."
-            embed.color = discord.Color.green()
+        async with self.balance_lock(ctx.guild.id, ctx.author.id):
+            if muerto:
+                new_wallet, _ = await db.get_balance(ctx.guild.id, ctx.author.id)
+                embed.description = f"**B A N G !** 💥\n\nHas muerto. La bala estaba en esa recámara. Toda tu apuesta de **{apuesta:,} {emoji}** está manchada de sangre."
+                embed.color = discord.Color.dark_red()
+            else:
+                ganancia_total = int(apuesta * 1.15) # Retorna el 115% de lo apostado (+15% de fee por supervivencia)
+                new_wallet, _ = await db.update_balance(ctx.guild.id, ctx.author.id, wallet_change=ganancia_total, reason='russian_roulette_payout', ref=ctx.message.id)
+                embed.description = f"**Click.** 💨\n\nSobreviviste. Había una recámara vacía. Te llevas tu apuesta de vuelta y además ganas un bono de supervivencia. Recibes **{ganancia_total:,} {emoji}**."
+                embed.color = discord.Color.green()
             
         # --- NUEVO DISEÑO PREMIUM ---
         file_name = "buena.gif" if not muerto else "bang.gif"
@@ -1,95 +1,99 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import random
 import asyncio
-from typing import Optional
+import bisect
+from io import BytesIO
+from typing import List, Optional
 
 # Importamos el gestor de base de datos
 from utils import database_manager as db
 from utils.lang_utils import _t
+from utils.image_service import ImageServiceBusy, image_service
+from utils.leveling_math import LevelCurve
+from utils.member_resolver import resolve_display_names
+from utils.message_pipeline import STAGE_LEVELING, GuildContext
+from utils.xp_ledger import XPLedger
+
+# Cada cuántos segundos se vuelca a la DB el XP acumulado en memoria
+XP_FLUSH_INTERVAL = 5
 
 class LevelingCog(commands.Cog, name="Niveles"):
     """Comandos para ver tu nivel y competir en el ranking de XP."""
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.ledger = XPLedger()
+
+    async def cog_load(self):
+        self.bot.message_pipeline.register('leveling', self.leveling_stage, STAGE_LEVELING)
+        self.flush_xp_loop.start()
+
+    async def cog_unload(self):
+        self.bot.message_pipeline.unregister('leveling')
+        # También se llama al cerrar el bot: no perder el XP aún en memoria
+        self.flush_xp_loop.cancel()
+        await self.flush_xp()
+        self.ledger.close()
 
     # --- Las funciones de base de datos se han eliminado de aquí ---
 
-    async def check_role_rewards(self, member: discord.Member, new_level: int) -> Optional[discord.Role]:
-        """Comprueba y asigna recompensas de rol al subir de nivel."""
-        # Usamos el gestor de DB
-        result = await db.fetchone("SELECT role_id FROM role_rewards WHERE guild_id = ? AND level = ?", (member.guild.id, new_level))
-        if result and (role := member.guild.get_role(result['role_id'])):
-            try:
-                await member.add_roles(role)
-                return role
-            except discord.Forbidden:
-                print(f"No tengo permisos para dar el rol {role.name} en {member.guild.name}")
-        return None
-
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not message.guild:
-            return
-
-        # USAMOS EL CACHÉ PARA EVITAR CONSULTAS CONSTANTES POR MENSAJE
-        config_settings = await db.get_cached_server_settings(message.guild.id)
-        if config_settings and config_settings.get("leveling_enabled"):
-            await self.process_xp(message)
-
-    async def process_xp(self, message: discord.Message):
-        """Procesa la ganancia de XP de un usuario considerando cooldowns."""
-        import datetime
+    async def check_role_rewards(self, member: discord.Member, old_level: int, new_level: int) -> List[discord.Role]:
+        """Asigna de una vez todas las recompensas de rol de los niveles cruzados (old_level, new_level]."""
+        rewards = await db.get_role_rewards(member.guild.id)
+        start = bisect.bisect_right(rewards, (old_level, float('inf')))
+        end = bisect.bisect_right(rewards, (new_level, float('inf')))
+        roles = [role for _, role_id in rewards[start:end]
+                 if (role := member.guild.get_role(role_id)) and role not in member.roles]
+        if not roles:
+            return []
+        try:
+            await member.add_roles(*roles, reason=f"Recompensa por alcanzar el nivel {new_level}")
+            return roles
+        except discord.Forbidden:
+            print(f"No tengo permisos para dar los roles {', '.join(r.name for r in roles)} en {member.guild.name}")
+        return []
+
+    async def leveling_stage(self, message: discord.Message, context: GuildContext):
+        """Etapa de XP del pipeline de mensajes (los ajustes ya vienen en el contexto)."""
+        if context.leveling_enabled and not context.blacklisted:
+            await self.process_xp(message, context.settings)
+
+    async def process_xp(self, message: discord.Message, settings: Optional[dict] = None):
+        """Procesa la ganancia de XP de un usuario considerando cooldowns (todo en memoria, sin tocar la DB)."""
         guild_id, user_id = message.guild.id, message.author.id
-        now = datetime.datetime.now(datetime.timezone.utc)
-        
-        # --- NUEVO: Comprobación de Cooldown Persistente (Anti-Spam de XP) ---
-        last_use = await db.get_cooldown(guild_id, user_id, 'xp_gain')
-        if last_use:
-            time_since_last_xp = (now - last_use).total_seconds()
-            if time_since_last_xp < 60:
-                return # Ignora si pasaron menos de 60 segundos
-                
-        await db.set_cooldown(guild_id, user_id, 'xp_gain', now)
-        # --- FIN DE Comprobación ---
+        if settings is None:
+            settings = await db.get_cached_server_settings(guild_id)
+        curve = LevelCurve.from_settings(settings)
 
-        level, xp = await db.get_user_level(guild_id, user_id)
-        
-        new_xp = xp + random.randint(15, 25)
-        
-        # Lógica de múltiples niveles por si acaso (aunque con cooldown es difícil, mejor prevenir)
-        levels_gained = 0
-        while True:
-            xp_needed = 5 * (level ** 2) + 50 * level + 100
-            if new_xp >= xp_needed:
-                new_xp -= xp_needed
-                level += 1
-                levels_gained += 1
-            else:
-                break
-
-        if levels_gained > 0:
-            await db.update_user_xp(guild_id, user_id, level, new_xp)
-            
-            # Fetch language for localization
-            server_settings = await db.get_cached_server_settings(guild_id)
-            lang = server_settings.get('language', 'es')
+        result = await self.ledger.gain(guild_id, user_id, random.randint(15, 25), curve)
+        if result is None:
+            return # Ignora si pasaron menos de 60 segundos
+        old_level, level = result
+
+        if level > old_level:
+            lang = settings.get('language', 'es')
             
             msg = _t('bot.leveling.level_up', lang=lang, user=message.author.mention, level=level)
             
-            # Revisar recompensas para todos los niveles ganados
-            acquired_roles = []
-            for l in range(level - levels_gained + 1, level + 1):
-                role = await self.check_role_rewards(message.author, l)
-                if role: acquired_roles.append(role.mention)
+            # Recompensas de todos los niveles ganados, en una sola llamada
+            acquired_roles = [role.mention for role in await self.check_role_rewards(message.author, old_level, level)]
             
             if acquired_roles:
                 msg += "\n" + _t('bot.leveling.roles_earned', lang=lang, roles=', '.join(acquired_roles))
                 
             try: await message.channel.send(msg)
             except: pass
-        else:
-            await db.update_user_xp(guild_id, user_id, level, new_xp)
+
+    async def flush_xp(self):
+        """Escribe en la DB el XP acumulado en memoria."""
+        try:
+            await self.ledger.flush()
+        except Exception as e:
+            print(f"Error guardando el XP acumulado (se reintentará): {e}")
+
+    @tasks.loop(seconds=XP_FLUSH_INTERVAL)
+    async def flush_xp_loop(self):
+        await self.flush_xp()
 
     @commands.hybrid_command(name='rank', description="Muestra tu nivel y XP en este servidor.")
     async def rank(self, ctx: commands.Context, miembro: discord.Member | None = None):
@@ -97,47 +101,76 @@ class LevelingCog(commands.Cog, name="Niveles"):
         await ctx.defer()
         target = miembro or ctx.author
         
-        level, xp = await db.get_user_level(ctx.guild.id, target.id)
-        
-        xp_needed = 5 * (level ** 2) + 50 * level + 100
-        progress = int((xp / xp_needed) * 20) if xp_needed > 0 else 0
-        progress_bar = '🟩' * progress + '⬛' * (20 - progress)
+        level, xp = await self.ledger.get(ctx.guild.id, target.id)
         
         # Fetch language for localization
         server_settings = await db.get_cached_server_settings(ctx.guild.id)
         lang = server_settings.get('language', 'es')
 
+        xp_needed = LevelCurve.from_settings(server_settings).xp_for_next_level(level)
+        progress = int((xp / xp_needed) * 20) if xp_needed > 0 else 0
+        progress_bar = '🟩' * progress + '⬛' * (20 - progress)
+
         embed = discord.Embed(title=_t('bot.leveling.rank_title', lang=lang, user=target.display_name), color=self.bot.CREAM_COLOR)
         embed.set_thumbnail(url=target.display_avatar.url)
         embed.add_field(name=_t('bot.leveling.level_label', lang=lang), value=f"**{level}**", inline=True)
         embed.add_field(name=_t('bot.leveling.xp_label', lang=lang), value=f"**{xp} / {xp_needed}**", inline=True)
         embed.add_field(name=_t('bot.leveling.progress_label', lang=lang), value=f"`{progress_bar}`", inline=False)
+        # Puesto en el ranking: conteo sobre el índice (guild_id, total_xp)
+        await self.flush_xp()
+        position = await db.get_user_rank('levels', ctx.guild.id, target.id)
+        if position:
+            embed.set_footer(text=f"Puesto #{position['rank']:,} de {position['total']:,}")
+
+        # Tarjeta de rango renderizada en el pool de procesos; si no se puede, solo el embed
+        card = await self.render_rank_card(target, level, xp, xp_needed, position)
+        if card:
+            embed.set_image(url="attachment://rank.png")
+            return await ctx.send(embed=embed, file=card)
         await ctx.send(embed=embed)
 
+    async def render_rank_card(self, target: discord.abc.User, level: int, xp: int, xp_needed: int,
+                               position: Optional[dict]) -> Optional[discord.File]:
+        try:
+            avatar_bytes = await target.display_avatar.with_size(256).read()
+        except Exception:
+            avatar_bytes = None
+        try:
+            png = await image_service.render('rank_card', avatar_bytes, target.display_name, level, xp, xp_needed,
+                                             position['rank'] if position else None, position['total'] if position else None)
+        except ImageServiceBusy:
+            return None
+        except Exception as e:
+            print(f"Error renderizando la tarjeta de rango: {e}")
+            return None
+        return discord.File(BytesIO(png), filename="rank.png")
+
     @commands.hybrid_command(name='levelboard', aliases=['lb_level'], description="Muestra a los usuarios con más nivel.")
-    async def levelboard(self, ctx: commands.Context):
+    async def levelboard(self, ctx: commands.Context, pagina: int = 1, cerca_de_mi: bool = False):
         if not ctx.guild: return
         # Fetch language for localization
         server_settings = await db.get_cached_server_settings(ctx.guild.id)
         lang = server_settings.get('language', 'es')
         
-        top_users = await db.fetchall("SELECT user_id, level, xp FROM levels WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT 10", (ctx.guild.id,))
+        await self.flush_xp()
+        if cerca_de_mi:
+            top_users = await db.get_leaderboard_around('levels', ctx.guild.id, ctx.author.id)
+        else:
+            top_users = await db.get_leaderboard_page('levels', ctx.guild.id, pagina)
         
         if not top_users: return await ctx.send(_t('bot.leveling.lb_empty', lang=lang))
         
         embed = discord.Embed(title=_t('bot.leveling.lb_title', lang=lang, server=ctx.guild.name), color=self.bot.CREAM_COLOR)
         description = ""
-        for i, user_row in enumerate(top_users):
-            user = self.bot.get_user(user_row['user_id'])
-            if not user:
-                try: user = await self.bot.fetch_user(user_row['user_id'])
-                except: name = f"Usuario ({user_row['user_id']})"
-            
-            if user: name = user.display_name
-            
-            rank = ["🥇", "🥈", "🥉"][i] if i < 3 else f"`{i+1}.`"
+        names = await resolve_display_names(self.bot, ctx.guild, [row['user_id'] for row in top_users])
+        for user_row in top_users:
+            name = names[user_row['user_id']]
+            rank = ["🥇", "🥈", "🥉"][user_row['rank'] - 1] if user_row['rank'] <= 3 else f"`{user_row['rank']}.`"
             description += f"{rank} **{name}**: Nivel {user_row['level']} ({user_row['xp']} XP)\n"
         embed.description = description
+        me = await db.get_user_rank('levels', ctx.guild.id, ctx.author.id)
+        if me:
+            embed.set_footer(text=f"Tu puesto: #{me['rank']:,} de {me['total']:,}")
         await ctx.send(embed=embed)
 
     @commands.hybrid_command(name='set_level_role', description="Asigna un rol como recompensa por alcanzar un nivel.")
@@ -168,10 +201,10 @@ class LevelingCog(commands.Cog, name="Niveles"):
     async def list_level_roles(self, ctx: commands.Context):
         if not ctx.guild: return
         await ctx.defer()
-        rewards = await db.fetchall("SELECT level, role_id FROM role_rewards WHERE guild_id = ? ORDER BY level ASC", (ctx.guild.id,))
+        rewards = await db.get_role_rewards(ctx.guild.id)
         if not rewards: return await ctx.send("No hay recompensas de roles configuradas.")
         embed = discord.Embed(title=f"🎁 Recompensas de Roles de {ctx.guild.name}", color=self.bot.CREAM_COLOR)
-        description = "\n".join([f"**Nivel {r['level']}** → {(ctx.guild.get_role(r['role_id']).mention if ctx.guild.get_role(r['role_id']) else 'Rol no encontrado')}" for r in rewards])
+        description = "\n".join([f"**Nivel {level}** → {(role.mention if (role := ctx.guild.get_role(role_id)) else 'Rol no encontrado')}" for level, role_id in rewards])
         embed.description = description
         await ctx.send(embed=embed)
 
@@ -179,16 +212,41 @@ class LevelingCog(commands.Cog, name="Niveles"):
     @commands.has_permissions(administrator=True)
     async def reset_level(self, ctx: commands.Context, miembro: discord.Member):
         if not ctx.guild: return
-        await db.update_user_xp(ctx.guild.id, miembro.id, 1, 0)
+        await self.ledger.set(ctx.guild.id, miembro.id, 1, 0)
+        await self.flush_xp()
         await ctx.send(f"🔄 El nivel de {miembro.mention} ha sido reiniciado.", ephemeral=True)
 
     @commands.hybrid_command(name='give_xp', description="Otorga XP a un usuario.")
     @commands.has_permissions(administrator=True)
     async def give_xp(self, ctx: commands.Context, miembro: discord.Member, cantidad: int):
         if not ctx.guild: return
-        level, xp = await db.get_user_level(ctx.guild.id, miembro.id)
-        await db.update_user_xp(ctx.guild.id, miembro.id, level, xp + cantidad)
+        curve = LevelCurve.from_settings(await db.get_cached_server_settings(ctx.guild.id))
+        # Con el XP total el nivel sale de la fórmula cerrada, sin iterar nivel a nivel
+        old_level, new_level = await self.ledger.add(ctx.guild.id, miembro.id, cantidad, curve)
+        await self.flush_xp()
+        if new_level > old_level:
+            await self.check_role_rewards(miembro, old_level, new_level)
         await ctx.send(f"✨ Se han añadido **{cantidad} XP** a {miembro.mention}.", ephemeral=True)
 
+    @commands.hybrid_command(name='set_level_curve', description="Cambia la curva de XP por nivel (a·nivel² + b·nivel + c) y recalcula los niveles.")
+    @commands.has_permissions(administrator=True)
+    async def set_level_curve(self, ctx: commands.Context, a: int = 5, b: int = 50, c: int = 100):
+        if not ctx.guild: return
+        curve = LevelCurve(a, b, c)
+        if not curve.is_valid():
+            return await ctx.send("❌ Los coeficientes deben cumplir a ≥ 0, b ≥ 0 y c > 0.", ephemeral=True)
+        await ctx.defer(ephemeral=True)
+        # El XP total de cada usuario se conserva; solo cambian nivel y XP dentro del nivel
+        await self.flush_xp()
+        await db.execute(
+            "INSERT INTO server_settings (guild_id, xp_curve_a, xp_curve_b, xp_curve_c) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(guild_id) DO UPDATE SET xp_curve_a = excluded.xp_curve_a, xp_curve_b = excluded.xp_curve_b, xp_curve_c = excluded.xp_curve_c",
+            (ctx.guild.id, a, b, c)
+        )
+        updated = await db.recompute_guild_levels(ctx.guild.id, curve)
+        # El XP ganado desde el volcado sigue en memoria: se recalcula ahí con la curva nueva
+        self.ledger.recompute(ctx.guild.id, curve)
+        await ctx.send(f"📈 Curva actualizada a **{a}·nivel² + {b}·nivel + {c}**. Se recalcularon {updated} usuarios.", ephemeral=True)
+
 async def setup(bot: commands.Bot):
     await bot.add_cog(LevelingCog(bot))
\ No newline at end of file
@@ -7,6 +7,7 @@ from typing import Optional, Literal
 
 # Importamos el gestor de base de datos
 from utils import database_manager as db
+from utils.message_pipeline import STAGE_AUTOMOD, GuildContext
 
 def parse_duration(duration_str: str) -> Optional[datetime.timedelta]:
     """Convierte un string de tiempo (ej: 1d, 2h, 10m) a un objeto timedelta."""
@@ -38,6 +39,12 @@ class ModerationCog(commands.Cog, name="Moderación"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
+    async def cog_load(self):
+        self.bot.message_pipeline.register('automod', self.automod_stage, STAGE_AUTOMOD)
+
+    async def cog_unload(self):
+        self.bot.message_pipeline.unregister('automod')
+
     async def cog_check(self, ctx: commands.Context):
         """Check global para este Cog."""
         if not ctx.guild: return True
@@ -140,38 +147,32 @@ class ModerationCog(commands.Cog, name="Moderación"):
         except discord.Forbidden:
             pass
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        """Listener para automod y para procesar comandos."""
-        if message.author.bot or not message.guild:
-            return
-
-        settings = await db.get_cached_server_settings(message.guild.id)
-        if not settings or not settings.get('mod_enabled', 1): return
-        
-        if settings and settings.get('automod_banned_words'):
-            banned_words = [word for word in settings['automod_banned_words'].lower().split(',') if word]
-            if any(word in message.content.lower() for word in banned_words):
-                try:
-                    await message.delete()
-                    # Enviar log de automod
-                    if log_channel_id := settings.get('log_channel_id'):
-                        if log_channel := self.bot.get_channel(log_channel_id):
-                            embed = discord.Embed(
-                                color=self.bot.CREAM_COLOR,
-                                timestamp=datetime.datetime.now(),
-                                description=f"📛 **Mensaje de {message.author.mention} eliminado por Automod en {message.channel.mention}**"
-                            )
-                            embed.set_author(name="Automod", icon_url=self.bot.user.display_avatar.url)
-                            embed.add_field(name="Contenido Bloqueado", value=f"```{message.content}```", inline=False)
-                            await log_channel.send(embed=embed)
-
-                    warning_msg = await message.channel.send(f"⚠️ {message.author.mention}, tu mensaje ha sido eliminado por contener una palabra no permitida.")
-                    await asyncio.sleep(10)
-                    await warning_msg.delete()
-                except Exception as e:
-                    print(f"Error en automod on_message: {e}")
-                return # Detener procesamiento
+    async def automod_stage(self, message: discord.Message, context: GuildContext) -> bool:
+        """Etapa de automod del pipeline de mensajes: si borra el mensaje, corta XP, TTS y comandos."""
+        if not context.automod_enabled or not context.banned_words:
+            return False
+        content = message.content.lower()
+        if not any(word in content for word in context.banned_words):
+            return False
+        try:
+            await message.delete()
+            # Enviar log de automod
+            if log_channel_id := context.settings.get('log_channel_id'):
+                if log_channel := self.bot.get_channel(log_channel_id):
+                    embed = discord.Embed(
+                        color=self.bot.CREAM_COLOR,
+                        timestamp=datetime.datetime.now(),
+                        description=f"📛 **Mensaje de {message.author.mention} eliminado por Automod en {message.channel.mention}**"
+                    )
+                    embed.set_author(name="Automod", icon_url=self.bot.user.display_avatar.url)
+                    embed.add_field(name="Contenido Bloqueado", value=f"```{message.content}```", inline=False)
+                    await log_channel.send(embed=embed)
+
+            # delete_after en vez de esperar aquí: no retener el pipeline 10 segundos
+            await message.channel.send(f"⚠️ {message.author.mention}, tu mensaje ha sido eliminado por contener una palabra no permitida.", delete_after=10)
+        except Exception as e:
+            print(f"Error en automod: {e}")
+        return True # Detener procesamiento
 
     # Auditoría avanzada de servidor
 
@@ -687,6 +688,7 @@ class ModerationCog(commands.Cog, name="Moderación"):
     @commands.has_permissions(moderate_members=True)
     async def modlogs(self, ctx: commands.Context, miembro: discord.Member):
         await ctx.defer(ephemeral=True)
+        await db.flush_log_buffer()
         logs = await db.fetchall("SELECT * FROM mod_logs WHERE guild_id = ? AND user_id = ? ORDER BY timestamp DESC", (ctx.guild.id, miembro.id))
         
         if not logs:
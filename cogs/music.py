@@ -10,6 +10,7 @@ import random
 import lyricsgenius
 from utils import constants
 from utils import database_manager as db
+from utils.interaction_guard import GuardedView
 
 class LoopState(Enum):
     OFF = 0; SONG = 1; QUEUE = 2
@@ -45,12 +46,14 @@ class UmapyoiPlayer(pomice.Player):
                 
         return await super().play(track, *args, **kwargs)
 
-class MusicPanelView(discord.ui.View):
+class MusicPanelView(GuardedView):
     def __init__(self, music_cog: "MusicCog"):
         super().__init__(timeout=None)
         self.music_cog = music_cog
 
     async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if not await super().interaction_check(interaction):
+            return False
         if not interaction.user.voice or not interaction.guild.voice_client or interaction.user.voice.channel != interaction.guild.voice_client.channel:
             await interaction.response.send_message("Debes estar en el mismo canal de voz que yo para usar los botones.", ephemeral=True, delete_after=10)
             return False
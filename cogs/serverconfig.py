@@ -5,12 +5,12 @@ import datetime
 from typing import Optional, Literal
 from utils import database_manager as db
 from utils.lang_utils import _t
+from utils.image_service import image_service
 from utils.constants import (
     DEFAULT_WELCOME_MESSAGE, DEFAULT_WELCOME_BANNER, 
     DEFAULT_GOODBYE_MESSAGE, DEFAULT_GOODBYE_BANNER,
     TEMP_CHANNEL_PREFIX
 )
-from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 import aiohttp
 import re
@@ -43,24 +43,6 @@ async def generate_banner_image(
                 return None
             avatar_bytes = await resp.read()
 
-        bg = Image.open(BytesIO(background_bytes)).convert("RGBA")
-        avatar = Image.open(BytesIO(avatar_bytes)).convert("RGBA")
-        bg = bg.resize((1000, 400))
-        avatar = avatar.resize((256, 256))
-        mask = Image.new('L', avatar.size, 0)
-        draw_mask = ImageDraw.Draw(mask)
-        draw_mask.ellipse((0, 0) + avatar.size, fill=255)
-        bg.paste(avatar, (372, 20), mask)
-        draw = ImageDraw.Draw(bg)
-        try:
-            font_path = "utils/arial.ttf" 
-            title_font = ImageFont.truetype(font_path, 60)
-            subtitle_font = ImageFont.truetype(font_path, 32)
-        except IOError:
-            print("Fuente 'utils/arial.ttf' no encontrada, usando la fuente por defecto.")
-            title_font = ImageFont.load_default()
-            subtitle_font = ImageFont.load_default()
-
         processed_message = message.replace(member.mention, f"@{member.display_name}")
         max_length = 60 
         if len(processed_message) > max_length:
@@ -69,13 +51,11 @@ async def generate_banner_image(
         # Para asegurar que se lea en cualquier fondo, le aplicamos un borde negro suave (stroke) y default blanco
         if title_color == "#000000": title_color = "#ffffff"
         if subtitle_color == "#000000": subtitle_color = "#dddddd"
-        
-        draw.text((500, 320), member.display_name, fill=title_color, font=title_font, anchor="ms", stroke_width=2, stroke_fill="black")
-        draw.text((500, 365), processed_message, fill=subtitle_color, font=subtitle_font, anchor="ms", stroke_width=1, stroke_fill="black")
 
-        final_buffer = BytesIO()
-        bg.save(final_buffer, format="PNG")
-        final_buffer.seek(0)
+        # El dibujo con PIL se hace en el pool de procesos de imágenes
+        png = await image_service.render('banner', background_bytes, avatar_bytes, member.display_name,
+                                         processed_message, title_color, subtitle_color)
+        final_buffer = BytesIO(png)
         
         return discord.File(final_buffer, filename="banner.png")
 
@@ -565,7 +545,7 @@ class ServerConfigCog(commands.Cog, name="Configuración del Servidor"):
         eco_settings = await db.get_cached_economy_settings(ctx.guild.id)
         tts_settings = await db.fetchone("SELECT * FROM tts_guild_settings WHERE guild_id = ?", (ctx.guild.id,))
         tts_channel = await db.fetchone("SELECT * FROM tts_active_channels WHERE guild_id = ?", (ctx.guild.id,))
-        casino_channels_rows = await db.fetchall("SELECT channel_id FROM gambling_active_channels WHERE guild_id = ?", (ctx.guild.id,))
+        casino_channels = await db.get_active_channels('gambling', ctx.guild.id)
         
         embed = discord.Embed(title=f"⚙️ Panel de Configuración: {ctx.guild.name}", color=self.bot.CREAM_COLOR)
         if ctx.guild.icon:
@@ -592,7 +572,7 @@ class ServerConfigCog(commands.Cog, name="Configuración del Servidor"):
         # 3. Economía y Sistemas
         leveling = "✅ Activado" if settings.get('leveling_enabled', 1) else "🚫 Desactivado"
         currency = f"**{eco_settings.get('currency_name', 'créditos')}** {eco_settings.get('currency_emoji', '🪙')}" if eco_settings else "**créditos** 🪙"
-        casino_ch_list = ", ".join(f"<#{r['channel_id']}>" for r in casino_channels_rows) if casino_channels_rows else "🚫 Inactivo"
+        casino_ch_list = ", ".join(f"<#{cid}>" for cid in sorted(casino_channels)) if casino_channels else "🚫 Inactivo"
         
         work_info = f"{eco_settings['work_min']}-{eco_settings['work_max']}" if eco_settings else "50-250"
         daily_info = f"{eco_settings['daily_min']}-{eco_settings['daily_max']}" if eco_settings else "100-500"
@@ -3,8 +3,9 @@ from discord.ext import commands
 from typing import Optional
 from utils import database_manager as db
 from utils.lang_utils import _t
+from utils.interaction_guard import GuardedView
 
-class TicketCloseView(discord.ui.View):
+class TicketCloseView(GuardedView):
     def __init__(self, lang: str = 'es'):
         super().__init__(timeout=None)
         self.lang = lang
@@ -19,7 +20,7 @@ class TicketCloseView(discord.ui.View):
         await asyncio.sleep(5)
         await interaction.channel.delete()
 
-class TicketOpenView(discord.ui.View):
+class TicketOpenView(GuardedView):
     def __init__(self, lang: str = 'es'):
         super().__init__(timeout=None)
         self.lang = lang
@@ -1,16 +1,25 @@
 import discord
 from discord.ext import commands
 import os
+import asyncio
 from gtts import gTTS
 from typing import Optional
 
 # Importamos el gestor de base de datos
 from utils import database_manager as db
+from utils.message_pipeline import STAGE_TTS, GuildContext
 
 class TTSCog(commands.Cog, name="Texto a Voz"):
     """Comandos para que el bot hable y lea tus mensajes."""
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self._speak_tasks = set()
+
+    async def cog_load(self):
+        self.bot.message_pipeline.register('tts', self.tts_stage, STAGE_TTS)
+
+    async def cog_unload(self):
+        self.bot.message_pipeline.unregister('tts')
 
     async def cog_check(self, ctx: commands.Context):
         """Check global para este Cog."""
@@ -23,35 +32,27 @@ class TTSCog(commands.Cog, name="Texto a Voz"):
 
     # --- Las funciones de base de datos se han eliminado de aquí ---
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        if message.author.bot or not message.guild: return
-        
-        # USAMOS CACHÉ GLOBAL DE SETTINGS
-        settings = await db.get_cached_server_settings(message.guild.id)
-        if not settings or not settings.get('tts_enabled', 1): return
-        
-        if message.channel.id != settings.get('tts_channel_id'): # Asumimos que guardaremos tts_channel_id en server_settings
-            # Fallback legacy check
-            active_channel_row = await db.fetchone("SELECT text_channel_id FROM tts_active_channels WHERE guild_id = ?", (message.guild.id,))
-            if not active_channel_row or message.channel.id != active_channel_row['text_channel_id']: return
+    async def tts_stage(self, message: discord.Message, context: GuildContext):
+        """Etapa de TTS del pipeline de mensajes: canal e idioma ya vienen en el contexto."""
+        if context.blacklisted or not context.tts_enabled: return
+        if message.channel.id != context.tts_channel_id: return
         
         vc = message.guild.voice_client
         if not vc or not vc.is_connected() or vc.is_playing(): return
         if not message.author.voice or message.author.voice.channel != vc.channel: return
         
-        # Idioma desde tabla settings (preferido) o tabla legacy
-        lang_code = settings.get('tts_lang', 'es') if settings else 'es'
-        if not settings or 'tts_lang' not in settings:
-            lang_row = await db.fetchone("SELECT lang FROM tts_guild_settings WHERE guild_id = ?", (message.guild.id,))
-            if lang_row: lang_code = lang_row['lang']
-        
         text_to_speak = message.clean_content
         if not text_to_speak: return
         
+        # La síntesis (gTTS va por red) no debe retrasar las etapas siguientes (comandos)
+        task = asyncio.create_task(self.speak(vc, message.guild.id, text_to_speak, context.tts_lang))
+        self._speak_tasks.add(task)
+        task.add_done_callback(self._speak_tasks.discard)
+
+    async def speak(self, vc: discord.VoiceClient, guild_id: int, text_to_speak: str, lang_code: str):
         try:
             # Archivo único por servidor para evitar choques en el mismo canal
-            tts_file = f"tts_{message.guild.id}.mp3"
+            tts_file = f"tts_{guild_id}.mp3"
             
             def save_tts():
                 tts = gTTS(text=text_to_speak, lang=lang_code, slow=False)
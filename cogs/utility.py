@@ -1,11 +1,16 @@
 import discord
 from discord.ext import commands
 from typing import Optional
+import asyncio
 import datetime
 import io
+import json
 import psutil
 import platform
 from utils import constants
+from utils import database_manager as db
+from utils.fanout import BroadcastFanOut
+from utils.interaction_guard import GuardedView
 
 class HelpSelect(discord.ui.Select):
     """El menú desplegable para el panel de ayuda interactivo."""
@@ -69,7 +74,7 @@ class HelpSelect(discord.ui.Select):
                 embed.description = description or "Esta categoría no tiene comandos para mostrar."
         await interaction.response.edit_message(embed=embed)
 
-class HelpView(discord.ui.View):
+class HelpView(GuardedView):
     """La vista que contiene el menú desplegable de ayuda."""
     def __init__(self, bot: commands.Bot, cog_map: dict):
         super().__init__(timeout=180)
@@ -98,6 +103,84 @@ class UtilityCog(commands.Cog, name="Utilidad"):
             "tickets": "Tickets"
         }
 
+    # Tareas del panel de administración (broadcast_queue, ver utils/task_queue.py)
+    TASK_TYPES = ('broadcast', 'leave_guild', 'send_dm')
+
+    async def cog_load(self):
+        for task_type in self.TASK_TYPES:
+            self.bot.task_queue.register(task_type, getattr(self, f"task_{task_type}"))
+
+    async def cog_unload(self):
+        for task_type in self.TASK_TYPES:
+            self.bot.task_queue.unregister(task_type)
+
+    def broadcast_embed(self, message: str) -> discord.Embed:
+        embed = discord.Embed(
+            title="Anuncio Global de UmapyoiBot",
+            description=message,
+            color=0xff6b9e,
+            timestamp=datetime.datetime.now()
+        )
+        if self.bot.user:
+            embed.set_thumbnail(url=self.bot.user.display_avatar.url)
+            embed.set_footer(text="Comunicado oficial • Administración de UmapyoiBot", icon_url=self.bot.user.display_avatar.url)
+        return embed
+
+    async def task_broadcast(self, task: dict):
+        # Envío concurrente y reanudable: si la tarea se reintenta, se salta lo ya entregado
+        embed = self.broadcast_embed(task['message'])
+        async def send(channel):
+            await channel.send(embed=embed)
+        fanout = BroadcastFanOut(send, task_id=task['id'])
+        result = await fanout.run(sorted(self.bot.guilds, key=lambda g: g.id))
+        print(f"Broadcast {task['id']}: {result['sent']} enviados, {result['skipped']} sin canal, "
+              f"{result['failed']} fallidos ({result['resumed']} ya entregados antes de reanudar).")
+
+    async def task_leave_guild(self, task: dict):
+        guild_id = int(task['message'])
+        guild = self.bot.get_guild(guild_id)
+        if not guild:
+            # Reintentar no cambiaría nada
+            print(f"Tarea fallida: No pude encontrar el servidor {guild_id} para salir.")
+            return
+        await guild.leave()
+        print(f"Tarea ejecutada: Me salí del servidor {guild.name} ({guild_id}) por petición administrativa.")
+
+    async def task_send_dm(self, task: dict):
+        data = json.loads(task['message'])
+        u_id = int(data.get('user_id'))
+        content = data.get('content')
+        try:
+            user = self.bot.get_user(u_id) or await self.bot.fetch_user(u_id)
+        except discord.NotFound:
+            user = None
+        if not user:
+            print(f"Tarea fallida: No se pudo localizar al usuario {u_id}")
+            await db.log_system_event("WARNING", "Broadcast", f"No se pudo enviar DM: usuario {u_id} no encontrado.")
+            return
+        embed = discord.Embed(
+            title="Mensaje Directo de UmapyoiBot",
+            description=content,
+            color=0xff6b9e,
+            timestamp=datetime.datetime.now()
+        )
+        if self.bot.user:
+            embed.set_author(name="Administración", icon_url=self.bot.user.display_avatar.url)
+            embed.set_footer(text="UmapyoiBot System", icon_url=self.bot.user.display_avatar.url)
+        try:
+            await user.send(embed=embed)
+        except discord.Forbidden:
+            # DMs cerrados: no tiene sentido reintentar
+            print(f"Tarea fallida: {user} ({u_id}) no acepta mensajes directos")
+            await db.log_system_event("WARNING", "Broadcast", f"No se pudo enviar DM a {user} ({u_id}): mensajes directos cerrados.")
+            return
+        except Exception as e:
+            # Cualquier otro error (red, Discord caído) se reintenta desde la cola
+            await db.log_system_event("ERROR", "Broadcast", f"Error enviando DM a {u_id}: {str(e)}")
+            raise
+        print(f"Tarea ejecutada: DM enviado a {user} ({u_id})")
+        await db.log_system_event("INFO", "Broadcast", f"DM enviado con éxito a {user} ({u_id})")
+
     @commands.hybrid_command(name='help', description="Muestra ayuda sobre los comandos del bot.")
     async def help(self, ctx: commands.Context, categoría: Optional[str] = None):
         if categoría is None:
@@ -113,7 +196,7 @@ class UtilityCog(commands.Cog, name="Utilidad"):
             embed.set_image(url="https://umapyoibot.com/static/assets/hero_landing_web.png")
             embed.set_thumbnail(url=self.bot.user.display_avatar.url)
             
-            view = discord.ui.View(timeout=180)
+            view = GuardedView(timeout=180)
             view.add_item(HelpSelect(self.bot, self.cog_map))
             await ctx.send(embed=embed, view=view)
         else:
@@ -145,35 +228,22 @@ class UtilityCog(commands.Cog, name="Utilidad"):
     @commands.command(name='announce', hidden=True)
     @commands.is_owner()
     async def announce(self, ctx: commands.Context, *, mensaje: str):
-        await ctx.defer(ephemeral=True) # Hacemos la respuesta efímera para no molestar en el canal
-        embed = discord.Embed(title="📢 Anuncio del Bot", description=mensaje, color=self.bot.CREAM_COLOR, timestamp=datetime.datetime.now())
-        embed.set_footer(text=f"Enviado por el desarrollador de Umapyoi")
-        successful, failed = 0, 0
-        for guild in self.bot.guilds:
-            # Lógica mejorada para encontrar un canal donde enviar el mensaje
-            target_channel = None
-            if guild.system_channel and guild.system_channel.permissions_for(guild.me).send_messages:
-                target_channel = guild.system_channel
-            else:
-                # Busca el primer canal de texto donde pueda hablar
-                for channel in guild.text_channels:
-                    if channel.permissions_for(guild.me).send_messages:
-                        target_channel = channel
-                        break
-            if target_channel:
-                try: 
-                    await target_channel.send(embed=embed)
-                    successful += 1
-                except discord.Forbidden:
-                    print(f"Fallo al enviar en {guild.name} ({guild.id}): Sin permisos en {target_channel.name}")
-                    failed += 1
-                except Exception as e:
-                    print(f"Fallo al enviar en {guild.name} ({guild.id}): {e}")
-                    failed += 1
-            else: 
-                print(f"Fallo al enviar en {guild.name} ({guild.id}): No se encontró un canal válido.")
-                failed += 1
-        await ctx.send(f"✅ Anuncio enviado a **{successful} servidores**.\n❌ Falló en **{failed} servidores**.")
+        # Mismo camino que las transmisiones del panel: cola de tareas + envío concurrente y reanudable
+        task_id = await db.enqueue_task('broadcast', mensaje)
+        status_msg = await ctx.send(f"📢 Anuncio **#{task_id}** en cola...")
+        while True:
+            await asyncio.sleep(5)
+            progress = await db.get_broadcast_progress(task_id)
+            if not progress:
+                return
+            text = (f"📢 Anuncio **#{task_id}**: {progress['done']}/{progress['total'] or '?'} servidores "
+                    f"(✅ {progress['sent']} · ⏭️ {progress['skipped']} · ❌ {progress['failed']})")
+            finished = progress['status'] in ('completed', 'failed')
+            if finished:
+                text += " — terminado." if progress['status'] == 'completed' else f" — falló: {progress['last_error']}"
+            await status_msg.edit(content=text)
+            if finished:
+                return
 
     @commands.command(name='serverlist', hidden=True)
     @commands.is_owner()
@@ -294,6 +364,16 @@ class UtilityCog(commands.Cog, name="Utilidad"):
     
 # Los comandos de ticket han sido movidos a tickets.py
         
+    @commands.command(name='pipelinestats', hidden=True)
+    @commands.is_owner()
+    async def pipelinestats(self, ctx: commands.Context):
+        # Tiempos por etapa del pipeline de mensajes de este proceso
+        lines = [f"{'etapa':<10} {'llamadas':>9} {'media':>8} {'p95':>8} {'máx':>9} {'cortes':>7} {'errores':>8}"]
+        for stage in self.bot.message_pipeline.stats():
+            lines.append(f"{stage['stage']:<10} {stage['calls']:>9} {stage['avg_ms']:>6.2f}ms {stage['p95_ms']:>6.2f}ms "
+                         f"{stage['max_ms']:>7.1f}ms {stage['stops']:>7} {stage['errors']:>8}")
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
     @commands.command(name='sync', hidden=True)
     @commands.is_owner()
     async def sync(self, ctx: commands.Context):
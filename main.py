@@ -19,6 +19,11 @@ import certifi
 # Importamos nuestros módulos de utilidades
 from utils import database_manager
 from utils import constants
+from utils.image_service import image_service
+from utils.interaction_guard import reject_blacklisted
+from utils.message_pipeline import STAGE_COMMANDS, GuildContext, MessagePipeline
+from utils.rate_limiter import RateLimiter
+from utils.task_queue import TaskQueue
 from utils.lang_utils import _t
 from dotenv import load_dotenv
 import asyncio
@@ -53,6 +58,37 @@ class UmapyoiBot(commands.Bot):
         self.http_session = None
         self.start_time = datetime.datetime.now(datetime.timezone.utc)
         self.first_on_ready = True
+        # Único procesado de mensajes: los cogs registran sus etapas en cog_load
+        self.message_pipeline = MessagePipeline()
+        self.message_pipeline.register('commands', self.commands_stage, STAGE_COMMANDS)
+        # Tareas encoladas desde el dashboard (broadcast_queue); cada cog registra las suyas
+        self.task_queue = TaskQueue()
+        self.task_queue.register('sync_all', self.sync_all_task)
+
+    async def commands_stage(self, message: discord.Message, context: GuildContext):
+        """Última etapa del pipeline: respuesta a la mención y comandos de prefijo.
+
+        Su tiempo incluye la ejecución completa del comando invocado.
+        """
+        if message.content == f'<@{self.user.id}>' or message.content == f'<@!{self.user.id}>':
+            lang = context.language
+            
+            embed = discord.Embed(
+                title=_t('bot.general.ping_title', lang=lang, user=message.author.display_name),
+                description=_t('bot.general.ping_desc', lang=lang),
+                color=self.CREAM_COLOR
+            )
+            embed.set_thumbnail(url=self.user.display_avatar.url)
+            view = discord.ui.View()
+            view.add_item(discord.ui.Button(label=_t('bot.general.btn_commands', lang=lang), emoji="🌐", url=constants.COMMANDS_PAGE_URL))
+            invite_link = discord.utils.oauth_url(self.user.id, permissions=discord.Permissions(permissions=8))
+            view.add_item(discord.ui.Button(label=_t('bot.general.btn_invite', lang=lang), emoji="🥳", url=invite_link))
+            view.add_item(discord.ui.Button(label=_t('bot.general.btn_support', lang=lang), emoji="🆘", url="https://discord.gg/fwNeZsGkSj"))
+            
+            await message.channel.send(embed=embed, view=view)
+            return True
+
+        await self.process_commands(message)
 
     async def setup_hook(self):
         ssl_context = ssl.create_default_context(cafile=certifi.where())
@@ -65,6 +101,12 @@ class UmapyoiBot(commands.Bot):
         cleanup_tts_files()
         print("Verificando y creando tablas de la base de datos si no existen...")
         database_manager.setup_database()
+        # Invalidaciones de caché hechas desde el dashboard cuando corre en otro proceso
+        database_manager.start_change_watcher()
+        # Lista negra en memoria desde el arranque: cada comprobación es una búsqueda en un set
+        await database_manager.load_blacklist()
+        # Arrancar los procesos de imágenes ahora y no en la primera tarjeta de /rank
+        await image_service.start()
 
         print('-----------------------------------------')
         print("Cargando Cogs...")
@@ -77,162 +119,74 @@ class UmapyoiBot(commands.Bot):
                     print(f"Error al cargar el Cog '{filename[:-3]}': {e}")
         print("Cogs cargados.")
 
-        # === Cooldown Global para Comandos Slash ===
+        # === Límite global de comandos (slash y prefijo) ===
+        # Cubetas de tokens por usuario y por servidor; exenciones y costes en utils/rate_limiter.py
+        self.rate_limiter = RateLimiter(exempt_users=[int(OWNER_ID)] if OWNER_ID else [])
+
         async def global_interaction_cooldown(interaction: discord.Interaction):
+            # Lista negra antes que nada (también cubre los comandos híbridos usados como slash)
+            if await reject_blacklisted(interaction):
+                return False
             if interaction.type != discord.InteractionType.application_command:
                 return True
-            
-            exempt_commands = {'work', 'rob', 'daily', 'deposit', 'withdraw', 'balance', 'rank', 'play', 'pause', 'resume', 'skip'}
-            if interaction.command and interaction.command.name in exempt_commands:
-                return True
 
-            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
-            user_id = interaction.user.id
-            if OWNER_ID and str(user_id) == str(OWNER_ID):
-                return True
-                
-            if not hasattr(self, '_last_cmd_times'):
-                self._last_cmd_times = {}
-                
-            last_time = self._last_cmd_times.get(user_id, 0)
-            if now - last_time < 3.0:
-                time_left = 3.0 - (now - last_time)
-                await interaction.response.send_message(f"⏳ Te estás apresurando. Por favor, espera **{time_left:.1f}** segundos.", ephemeral=True)
+            command_name = interaction.command.name if interaction.command else interaction.data.get('name')
+            retry_after = self.rate_limiter.hit(interaction.user.id, interaction.guild_id, command_name)
+            if retry_after:
+                await interaction.response.send_message(f"⏳ Te estás apresurando. Por favor, espera **{retry_after:.1f}** segundos.", ephemeral=True)
                 return False
-                
-            self._last_cmd_times[user_id] = now
             return True
         
         self.tree.interaction_check = global_interaction_cooldown
 
-        # === Cooldown Global para Comandos de Prefijo (!!ping) ===
         @self.check
         async def global_prefix_cooldown(ctx: commands.Context):
-            if not ctx.command:
-                return True
-                
-            exempt_commands = {'work', 'rob', 'daily', 'deposit', 'withdraw', 'balance', 'rank', 'play', 'pause', 'resume', 'skip'}
-            if ctx.command.name in exempt_commands:
+            # Los híbridos invocados como slash ya pasaron por el check del árbol
+            if not ctx.command or ctx.interaction is not None:
                 return True
 
-            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
-            user_id = ctx.author.id
-            if OWNER_ID and str(user_id) == str(OWNER_ID):
-                return True
-                
-            if not hasattr(self, '_last_cmd_times'):
-                self._last_cmd_times = {}
-                
-            last_time = self._last_cmd_times.get(user_id, 0)
-            if now - last_time < 3.0:
-                time_left = 3.0 - (now - last_time)
+            retry_after = self.rate_limiter.hit(ctx.author.id, ctx.guild.id if ctx.guild else None, ctx.command.name)
+            if retry_after:
                 # Avisar al usuario pero borrar el mensaje rápido para no hacer spam (prefijo no tiene ephemeral)
                 try:
-                    await ctx.send(f"⏳ Te estás apresurando. Por favor, espera **{time_left:.1f}** segundos.", delete_after=3.0)
+                    await ctx.send(f"⏳ Te estás apresurando. Por favor, espera **{retry_after:.1f}** segundos.", delete_after=3.0)
                 except discord.HTTPException:
                     pass
                 return False
-                
-            self._last_cmd_times[user_id] = now
             return True
 
         # Sincronización de comandos slash
         await self.tree.sync()
         print("¡Comandos sincronizados!")
 
-        if not self.check_broadcasts.is_running():
-            self.check_broadcasts.start()
-
-    @tasks.loop(seconds=15)
-    async def check_broadcasts(self):
-        pending = await database_manager.fetchall("SELECT * FROM broadcast_queue WHERE status = 'pending'")
-        if not pending: return
-        for item in pending:
-            b_id = item['id']
-            message = item['message']
-            task_type = item.get('type', 'broadcast')
-            
-            await database_manager.execute("UPDATE broadcast_queue SET status = 'processing' WHERE id = ?", (b_id,))
-            
-            if task_type == 'broadcast':
-                embed = discord.Embed(
-                    title="Anuncio Global de UmapyoiBot",
-                    description=message,
-                    color=0xff6b9e,
-                    timestamp=datetime.datetime.now()
-                )
-                if self.user:
-                    embed.set_thumbnail(url=self.user.display_avatar.url)
-                    embed.set_footer(text="Comunicado oficial • Administración de UmapyoiBot", icon_url=self.user.display_avatar.url)
-
-                count = 0
-                for guild in self.guilds:
-                    try:
-                        target_channel = guild.system_channel
-                        if target_channel and target_channel.permissions_for(guild.me).send_messages:
-                            await target_channel.send(embed=embed)
-                            count += 1
-                            continue
-                        for c in guild.text_channels:
-                            if c.permissions_for(guild.me).send_messages:
-                                await c.send(embed=embed)
-                                count += 1
-                                break
-                    except Exception: pass
-                print(f"Broadcast {b_id} enviado a {count} servidores.")
-
-            elif task_type == 'sync_all':
-                print(f"Tarea recibida: Sincronización completa solicitada via broadcast_queue (ID: {b_id})")
-                await database_manager.log_system_event("INFO", "Sync", "Iniciando sincronización forzada por administrador.")
-                # Lanzamos la sincronización en una tarea separada para no bloquear el procesador de colas
-                asyncio.create_task(sync_guilds_background())
-            
-            elif task_type == 'leave_guild':
-                try:
-                    guild_id = int(message)
-                    guild = self.get_guild(guild_id)
-                    if guild:
-                        await guild.leave()
-                        print(f"Tarea ejecutada: Me salí del servidor {guild.name} ({guild_id}) por petición administrativa.")
-                    else:
-                        print(f"Tarea fallida: No pude encontrar el servidor {guild_id} para salir.")
-                except Exception as e:
-                    print(f"Error procesando leave_guild: {e}")
-            
-            elif task_type == 'send_dm':
-                u_id = 'desconocido'
-                try:
-                    import json
-                    data = json.loads(message)
-                    u_id = int(data.get('user_id'))
-                    content = data.get('content')
-                    user = self.get_user(u_id) or await self.fetch_user(u_id)
-                    if user:
-                        embed = discord.Embed(
-                            title="Mensaje Directo de UmapyoiBot",
-                            description=content,
-                            color=0xff6b9e,
-                            timestamp=datetime.datetime.now()
-                        )
-                        if self.user:
-                            embed.set_author(name="Administración", icon_url=self.user.display_avatar.url)
-                            embed.set_footer(text="UmapyoiBot System", icon_url=self.user.display_avatar.url)
-                        
-                        await user.send(embed=embed)
-                        print(f"Tarea ejecutada: DM enviado a {user} ({u_id})")
-                        await database_manager.log_system_event("INFO", "Broadcast", f"DM enviado con éxito a {user} ({u_id})")
-                    else:
-                        print(f"Tarea fallida: No se pudo localizar al usuario {u_id}")
-                        await database_manager.log_system_event("WARNING", "Broadcast", f"No se pudo enviar DM: usuario {u_id} no encontrado.")
-                except Exception as e:
-                    print(f"Error procesando send_dm a {u_id}: {e}")
-                    await database_manager.log_system_event("ERROR", "Broadcast", f"Error enviando DM a {u_id}: {str(e)}")
+        # Cola de tareas del panel: los cogs ya registraron sus handlers al cargarse
+        self.task_queue.start()
+        if not self.compact_logs.is_running():
+            self.compact_logs.start()
 
-            await database_manager.execute("UPDATE broadcast_queue SET status = 'completed' WHERE id = ?", (b_id,))
+    async def sync_all_task(self, task: dict):
+        # Tarea 'sync_all' de la cola: la sincronización va en segundo plano para no ocupar el consumidor
+        print("Tarea recibida: Sincronización completa solicitada desde el panel.")
+        await database_manager.log_system_event("INFO", "Sync", "Iniciando sincronización forzada por administrador.")
+        asyncio.create_task(sync_guilds_background())
+
+    @tasks.loop(minutes=15)
+    async def compact_logs(self):
+        # Agrega los logs de comandos por hora y borra los logs crudos fuera de la retención
+        try:
+            result = await database_manager.compact_logs()
+            if result['pruned_command_logs'] or result['pruned_system_logs']:
+                print(f"Logs compactados: {result}")
+        except Exception as e:
+            print(f"Error compactando logs: {e}")
 
     async def close(self):
+        await self.task_queue.stop()
         await super().close()
+        # Vaciar los logs diferidos antes de cerrar las conexiones
+        await database_manager.flush_log_buffer()
         database_manager.close_database()
+        image_service.close()
         if self.http_session:
             await self.http_session.close()
 
@@ -246,6 +200,9 @@ intents.moderation = True
 async def get_prefix(bot, message):
     if not message.guild:
         return '!'
+    # Durante el pipeline el prefijo ya está resuelto en el contexto del mensaje
+    if context := bot.message_pipeline.context_for(message):
+        return context.prefix
     settings = await database_manager.get_cached_server_settings(message.guild.id)
     return settings.get('prefix', '!') if settings else '!'
 
@@ -370,30 +327,8 @@ async def sync_guilds_background():
 # Evento al recibir mensaje
 @bot.event
 async def on_message(message: discord.Message):
-    if message.author.bot or not message.guild:
-        return
-        
-    if message.content == f'<@{bot.user.id}>' or message.content == f'<@!{bot.user.id}>':
-        # Fetch language for localization
-        settings = await database_manager.get_cached_server_settings(message.guild.id)
-        lang = settings.get('language', 'es')
-        
-        embed = discord.Embed(
-            title=_t('bot.general.ping_title', lang=lang, user=message.author.display_name),
-            description=_t('bot.general.ping_desc', lang=lang),
-            color=bot.CREAM_COLOR
-        )
-        embed.set_thumbnail(url=bot.user.display_avatar.url)
-        view = discord.ui.View()
-        view.add_item(discord.ui.Button(label=_t('bot.general.btn_commands', lang=lang), emoji="🌐", url=constants.COMMANDS_PAGE_URL))
-        invite_link = discord.utils.oauth_url(bot.user.id, permissions=discord.Permissions(permissions=8))
-        view.add_item(discord.ui.Button(label=_t('bot.general.btn_invite', lang=lang), emoji="🥳", url=invite_link))
-        view.add_item(discord.ui.Button(label=_t('bot.general.btn_support', lang=lang), emoji="🆘", url="https://discord.gg/fwNeZsGkSj"))
-        
-        await message.channel.send(embed=embed, view=view)
-        return
-
-    await bot.process_commands(message)
+    # Automod, XP, TTS y comandos en orden, con un solo contexto por mensaje (ver utils/message_pipeline.py)
+    await bot.message_pipeline.run(message)
 
 # Evento al unirse a un servidor
 @bot.event
@@ -528,13 +463,9 @@ async def on_interaction(interaction: discord.Interaction):
 
 @bot.check
 async def global_blacklist_check(ctx):
-    # Validar si el usuario o el servidor están en la lista negra
+    # Validar si el usuario o el servidor están en la lista negra (índice en memoria)
     try:
-        if await database_manager.is_blacklisted(ctx.author.id):
-            return False
-        if ctx.guild and await database_manager.is_blacklisted(ctx.guild.id):
-            return False
-        return True
+        return not await database_manager.is_blacklisted(ctx.author.id, ctx.guild.id if ctx.guild else None)
     except Exception as e:
         print(f"Error en el check de blacklist: {e}")
         return True # En caso de error en DB, permitimos el comando para no romper el bot
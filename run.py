@@ -27,7 +27,7 @@ async def main():
     try:
         await asyncio.gather(
             bot.start(DISCORD_TOKEN),
-            run_app()
+            run_app(with_bot=True)
         )
     except Exception as e:
         print(f"Error crítico en la ejecución: {e}")
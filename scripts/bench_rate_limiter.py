@@ -0,0 +1,59 @@
+"""Micro-benchmark del limitador global: la memoria sigue a los usuarios activos.
+
+Simula N usuarios distintos (uno nuevo cada `--interval` segundos de reloj
+simulado) usando un comando cada uno, y muestra cuántas cubetas quedan vivas y
+el pico de memoria. Sin expiración crecería con N; con la rueda temporal se
+estabiliza en ~capacidad·periodo / intervalo cubetas.
+
+Uso:
+    python scripts/bench_rate_limiter.py [--users 1000000] [--interval 0.001] [--guilds 1000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rate_limiter import RateLimiter
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de memoria del limitador de comandos")
+    parser.add_argument("--users", type=int, default=1_000_000, help="Usuarios distintos a simular")
+    parser.add_argument("--interval", type=float, default=0.001, help="Segundos simulados entre comandos")
+    parser.add_argument("--guilds", type=int, default=1000, help="Servidores entre los que se reparten")
+    args = parser.parse_args()
+
+    clock = SimulatedClock()
+    # Sin límite de servidor efectivo: aquí solo interesa cuántas cubetas se guardan
+    limiter = RateLimiter(guild_burst=args.users, guild_period=0.001, exempt_commands=(), clock=clock)
+    tracemalloc.start()
+    started = time.perf_counter()
+    peak_tracked = 0
+    checkpoint = max(1, args.users // 10)
+    for user_id in range(args.users):
+        clock.now += args.interval
+        limiter.hit(user_id, user_id % args.guilds, "ping")
+        if (user_id + 1) % checkpoint == 0:
+            stats = limiter.stats()
+            peak_tracked = max(peak_tracked, stats['tracked_users'])
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"{user_id + 1:>9} usuarios: {stats['tracked_users']:>6} cubetas vivas, "
+                  f"{stats['expired']:>9} expiradas, memoria {current / 1024:.0f} KiB (pico {peak / 1024:.0f} KiB)")
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.users} comandos en {elapsed:.2f} s ({args.users / elapsed:,.0f}/s con tracemalloc activo)")
+    print(f"Máximo de cubetas vivas: {peak_tracked}; pico de memoria: {peak / 1024 / 1024:.2f} MiB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Comprueba o reconstruye los balances a partir de economy_ledger.
+
+Uso:
+    python scripts/economy_ledger.py check [--guild ID] [--db RUTA]
+    python scripts/economy_ledger.py replay [--guild ID] [--db RUTA] [--yes]
+
+Conviene ejecutarlo con el bot apagado (o sobre una copia) antes de un replay.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import economy_ledger
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot_data.db")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Herramientas del libro mayor de economía")
+    parser.add_argument("action", choices=["check", "replay"])
+    parser.add_argument("--db", default=os.environ.get("BOT_TEST_DB", DEFAULT_DB))
+    parser.add_argument("--guild", type=int, default=None, help="Limitar a un servidor")
+    parser.add_argument("--yes", action="store_true", help="No pedir confirmación antes del replay")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"No existe la base de datos: {args.db}")
+        return 1
+    conn = sqlite3.connect(args.db)
+    try:
+        mismatches = 0
+        for drift in economy_ledger.iter_drift(conn, args.guild):
+            mismatches += 1
+            print(f"[{drift['guild_id']}] {drift['user_id']}: balances=({drift['wallet']}, {drift['bank']}) "
+                  f"ledger=({drift['ledger_wallet']}, {drift['ledger_bank']}) en {drift['entries']} movimientos")
+        print(f"{mismatches} usuarios no cuadran con el ledger.")
+        if args.action == "check":
+            return 1 if mismatches else 0
+
+        if mismatches == 0:
+            print("Nada que reconstruir.")
+            return 0
+        if not args.yes and input("¿Reescribir balances desde el ledger? [s/N] ").strip().lower() != "s":
+            print("Cancelado.")
+            return 1
+        result = economy_ledger.replay(conn, args.guild)
+        print(f"Reconstruidos {result['restored']} balances, {result['zeroed']} puestos a cero.")
+        return 0
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,7 @@ import sqlite3
 import discord
 from discord.ext import commands
 import asyncio
+import itertools
 import aiohttp
 
 # Forzamos que la base de datos use memoria RAM en las pruebas
@@ -11,6 +12,8 @@ os.environ["BOT_TEST_DB"] = ":memory:"
 
 # Importamos el database_manager (después del environ override)
 from utils import database_manager as db
+from utils.message_pipeline import MessagePipeline
+from utils.task_queue import TaskQueue
 
 # ============================================================
 #  MOCKS — Simulan objetos de discord.py sin conectar a Discord
@@ -61,15 +64,29 @@ class MockGuild(discord.Object):
         self.voice_client = None
         self.icon = None
         self._roles = {}
+        self._members = {}  # Caché local de miembros (get_member)
+        self._gateway_members = {}  # Miembros que solo devuelve query_members
+        self.chunked = False
+        self.member_queries = []
 
     def get_role(self, role_id):
         return self._roles.get(role_id)
 
+    def get_member(self, user_id):
+        return self._members.get(user_id)
+
+    async def query_members(self, query=None, *, limit=5, user_ids=None, presences=False, cache=True):
+        self.member_queries.append(list(user_ids or []))
+        return [self._gateway_members[uid] for uid in (user_ids or []) if uid in self._gateway_members]
+
     def get_channel(self, channel_id):
         return None
 
+_message_ids = itertools.count(900000)
+
 class MockMessage:
     def __init__(self, content):
+        self.id = next(_message_ids)
         self.content = content
         self.clean_content = content
 
@@ -117,12 +134,15 @@ class MockMember(MockUser):
         self.guild = guild
         self.top_role = MockRole(id=10, position=top_role_pos)
         self.voice = None
+        self.roles = []
+        self.add_roles_calls = 0
 
-    async def add_roles(self, role, **kwargs):
-        pass
+    async def add_roles(self, *roles, **kwargs):
+        self.add_roles_calls += 1
+        self.roles.extend(roles)
 
-    async def remove_roles(self, role, **kwargs):
-        pass
+    async def remove_roles(self, *roles, **kwargs):
+        self.roles = [r for r in self.roles if r not in roles]
 
     async def send(self, *args, **kwargs):
         pass
@@ -145,6 +165,9 @@ async def setup_test_db():
     
     yield
     
+    # Volcar los logs diferidos para que no caigan en la siguiente prueba
+    await db.flush_log_buffer()
+
     # Limpieza: Borrar datos de todas las tablas
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
@@ -155,6 +178,7 @@ async def setup_test_db():
     conn.commit()
     # Limpiar caché
     db._settings_cache.clear()
+    db.invalidate_all()
 
 class MyMockBot(commands.Bot):
     def __init__(self):
@@ -162,6 +186,8 @@ class MyMockBot(commands.Bot):
         self.CREAM_COLOR = discord.Color(0xFFFDD0)
         self.GEMINI_API_KEY = "test_key"
         self.http_session = None  # Se setea en fixture async si necesario
+        self.message_pipeline = MessagePipeline()
+        self.task_queue = TaskQueue()
 
     @property
     def user(self):
@@ -1,7 +1,10 @@
 """Tests para el sistema de base de datos (database_manager)."""
 import pytest
+import asyncio
 import datetime
+import threading
 from utils import database_manager as db
+from utils import economy_ledger
 
 
 class TestDatabaseSetup:
@@ -29,6 +32,66 @@ class TestDatabaseSetup:
         db.setup_database()  # Ya se ejecutó en fixture, esta es la segunda vez
         # Si no lanza excepción, pasa
 
+    async def test_schema_version_recorded(self):
+        conn = db.get_connection()
+        assert db.get_schema_version(conn) == max(v for v, _, _ in db.MIGRATIONS)
+
+    async def test_hot_queries_use_indexes(self):
+        conn = db.get_connection()
+        queries = [
+            ("SELECT * FROM mod_logs WHERE guild_id = ? AND user_id = ? ORDER BY timestamp DESC", (1, 2)),
+            ("SELECT * FROM warnings WHERE guild_id = ? AND user_id = ? ORDER BY timestamp DESC", (1, 2)),
+            ("SELECT * FROM global_command_logs ORDER BY timestamp DESC LIMIT 50", ()),
+            ("SELECT * FROM bot_guilds WHERE is_active = 1 ORDER BY member_count DESC", ()),
+        ]
+        for query, params in queries:
+            plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall())
+            assert "USING INDEX" in plan or "USING COVERING INDEX" in plan, plan
+            assert "TEMP B-TREE" not in plan, plan
+
+
+class TestConnectionManager:
+    """Pool de lectura + hilo escritor sobre un fichero temporal en modo WAL."""
+
+    async def test_wal_and_pool_roundtrip(self, tmp_path):
+        manager = db.ConnectionManager(str(tmp_path / "pool.db"), read_pool_size=2)
+        try:
+            mode = manager.writer().execute("PRAGMA journal_mode").fetchone()[0]
+            assert mode == "wal"
+
+            def _write(conn):
+                conn.execute("CREATE TABLE t (x INTEGER)")
+                conn.execute("INSERT INTO t (x) VALUES (1)")
+                conn.commit()
+            await manager.run_write(_write)
+
+            rows = await manager.run_read(lambda conn: conn.execute("SELECT x FROM t").fetchall())
+            assert [r['x'] for r in rows] == [1]
+        finally:
+            manager.close()
+
+    async def test_reads_do_not_wait_for_writer(self, tmp_path):
+        """Una transacción larga del escritor no bloquea a los lectores."""
+        manager = db.ConnectionManager(str(tmp_path / "pool.db"), read_pool_size=2)
+        try:
+            await manager.run_write(lambda conn: (conn.execute("CREATE TABLE t (x INTEGER)"), conn.commit()))
+            release = threading.Event()
+
+            def _slow_write(conn):
+                conn.execute("INSERT INTO t (x) VALUES (1)")
+                release.wait(5)
+                conn.commit()
+            pending = asyncio.ensure_future(manager.run_write(_slow_write))
+            await asyncio.sleep(0.05)
+
+            count = await asyncio.wait_for(
+                manager.run_read(lambda conn: conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]), timeout=2)
+            assert count == 0  # El lector ve la última versión confirmada
+            release.set()
+            await pending
+        finally:
+            manager.close()
+
 
 class TestBalances:
     """Tests del sistema de balances (wallet/bank)."""
@@ -66,6 +129,150 @@ class TestBalances:
         assert w1 != w2
 
 
+class TestTransactions:
+    """Tests de db.transaction() y del UPSERT de balances."""
+
+    async def test_update_balance_applies_max_balance(self):
+        await db.get_guild_economy_settings(12345)
+        await db.execute("UPDATE economy_settings SET max_balance = ? WHERE guild_id = ?", (1000, 12345))
+        wallet, _ = await db.update_balance(12345, 999, wallet_change=5000)
+        assert wallet == 1000
+
+    async def test_transaction_commits_all_statements(self):
+        async with db.transaction() as tx:
+            debit = tx.update_balance(12345, 1, wallet_change=-40)
+            credit = tx.update_balance(12345, 2, wallet_change=40)
+        assert debit.result() == (60, 0)
+        assert credit.result() == (140, 0)
+
+    async def test_insufficient_funds_rolls_back_everything(self):
+        await db.get_balance(12345, 1)
+        with pytest.raises(db.InsufficientFunds):
+            async with db.transaction() as tx:
+                tx.update_balance(12345, 2, wallet_change=500)
+                tx.update_balance(12345, 1, wallet_change=-500, require_funds=True)
+        assert await db.get_balance(12345, 1) == (100, 0)
+        assert await db.fetchone("SELECT * FROM balances WHERE user_id = ?", (2,)) is None
+
+    async def test_require_funds_uses_existing_wallet(self):
+        # Un cargo mayor que el start_balance debe evaluarse contra la cartera real
+        await db.update_balance(12345, 1, wallet_change=900)
+        async with db.transaction() as tx:
+            charge = tx.update_balance(12345, 1, wallet_change=-300, require_funds=True)
+        assert charge.result() == (700, 0)
+
+
+class TestEconomyLedger:
+    """economy_ledger: cada cambio de balance queda anotado y los balances se pueden reconstruir."""
+
+    async def test_movements_sum_to_balance(self):
+        await db.get_guild_economy_settings(12345)
+        await db.execute("UPDATE economy_settings SET max_balance = ? WHERE guild_id = ?", (1000, 12345))
+        await db.update_balance(12345, 999, wallet_change=300, reason='work')
+        await db.update_balance(12345, 999, wallet_change=5000, reason='slots', ref=42)  # topado a 1000
+        await db.update_balance(12345, 999, wallet_change=-200, bank_change=200, reason='deposit')
+
+        entries = await db.get_economy_ledger(12345, 999)
+        assert [e['reason'] for e in entries] == ['deposit', 'slots', 'work', 'apertura']
+        assert entries[1]['delta_wallet'] == 600 and entries[1]['ref'] == '42'
+        assert sum(e['delta_wallet'] for e in entries) == 800
+        assert sum(e['delta_bank'] for e in entries) == 200
+        assert (await db.check_economy_ledger())['ok']
+
+    async def test_clamped_opening_keeps_real_start_balance(self):
+        await db.get_guild_economy_settings(12345)
+        await db.execute("UPDATE economy_settings SET max_balance = ? WHERE guild_id = ?", (1000, 12345))
+        assert await db.update_balance(12345, 999, wallet_change=5000, reason='slots') == (1000, 0)
+
+        entries = await db.get_economy_ledger(12345, 999)
+        assert [(e['reason'], e['delta_wallet']) for e in reversed(entries)] == [('apertura', 100), ('slots', 5000), ('tope', -4100)]
+        assert (await db.check_economy_ledger())['ok']
+
+    async def test_failed_charge_is_not_recorded(self):
+        await db.get_balance(12345, 1)
+        with pytest.raises(db.InsufficientFunds):
+            async with db.transaction() as tx:
+                tx.update_balance(12345, 1, wallet_change=-500, require_funds=True, reason='give')
+        assert [e['reason'] for e in await db.get_economy_ledger(12345, 1)] == ['apertura']
+
+    async def test_check_and_replay_after_corruption(self):
+        for user_id in range(1, 6):
+            await db.update_balance(12345, user_id, wallet_change=user_id * 10, reason='work')
+        await db.update_balance(999, 1, wallet_change=5, reason='work')
+        # Corrupción: cambios fuera del ledger
+        await db.execute("UPDATE balances SET wallet = 0 WHERE guild_id = ? AND user_id IN (2, 4)", (12345,))
+        await db.execute("INSERT INTO balances (guild_id, user_id, wallet, bank) VALUES (12345, 77, 500, 0)")
+
+        report = await db.check_economy_ledger()
+        assert report['mismatches'] == 3
+        assert {e['user_id'] for e in report['examples']} == {2, 4, 77}
+        assert (await db.check_economy_ledger(guild_id=999))['ok']
+
+        conn = db._manager.writer()
+        with db._db_lock:
+            result = economy_ledger.replay(conn, 12345)
+        assert result == {'restored': 2, 'zeroed': 1}
+        assert await db.get_balance(12345, 4) == (140, 0)
+        assert (await db.check_economy_ledger())['ok']
+
+
+class TestBulkEconomy:
+    """Operaciones masivas: una sentencia por servidor que deja el ledger cuadrado."""
+
+    async def _seed(self):
+        await db.update_balance(12345, 1, wallet_change=900, bank_change=1000, reason='work')
+        await db.update_balance(12345, 2, bank_change=9800, reason='work')   # cerca del límite de nivel 1
+        await db.update_balance(12345, 3, bank_change=20000, reason='work')  # ya por encima del límite
+        await db.update_balance(999, 1, bank_change=1000, reason='work')     # otro servidor
+
+    async def test_interest_is_capped_by_level(self):
+        await self._seed()
+        await db.update_user_xp(12345, 1, 3, 0)
+        changed = await db.apply_bank_interest(12345, 0.10)
+        assert changed == 2
+        assert await db.get_balance(12345, 1) == (1000, 1100)
+        assert await db.get_balance(12345, 2) == (100, db.max_bank_for_level(1))
+        assert await db.get_balance(12345, 3) == (100, 20000)
+        assert await db.get_balance(999, 1) == (100, 1000)
+        assert [e['reason'] for e in await db.get_economy_ledger(12345, 2)][0] == 'interest'
+        assert (await db.check_economy_ledger())['ok']
+
+    async def test_wealth_tax_takes_bank_then_wallet(self):
+        await self._seed()
+        await db.update_balance(12345, 4, wallet_change=2000, reason='work')
+        await db.apply_wealth_tax(12345, 0.5, threshold=2000)
+        assert await db.get_balance(12345, 1) == (1000, 1000)   # 2000 -> sin impuesto
+        assert await db.get_balance(12345, 2) == (100, 5850)    # (9900 - 2000) / 2 = 3950 del banco
+        assert await db.get_balance(12345, 4) == (2050, 0)      # 2100 -> 50 de la cartera
+        assert (await db.check_economy_ledger())['ok']
+
+    async def test_reset_uses_start_balance(self):
+        await self._seed()
+        await db.get_guild_economy_settings(12345)
+        await db.execute("UPDATE economy_settings SET start_balance = 250 WHERE guild_id = ?", (12345,))
+        assert await db.reset_guild_economy(12345, ref=1) == 3
+        assert {await db.get_balance(12345, u) for u in (1, 2, 3)} == {(250, 0)}
+        assert await db.get_balance(999, 1) == (100, 1000)
+        assert (await db.check_economy_ledger())['ok']
+
+    async def test_due_jobs_run_once_and_reschedule(self):
+        await self._seed()
+        await db.set_economy_job(12345, 'interest', 0.10, interval_hours=6)
+        with pytest.raises(ValueError):
+            await db.set_economy_job(12345, 'lottery', 0.5)
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        assert await db.run_due_economy_jobs(now) == []
+        later = now + datetime.timedelta(hours=7)
+        assert await db.run_due_economy_jobs(later) == [{'guild_id': 12345, 'kind': 'interest', 'affected': 2}]
+        assert await db.run_due_economy_jobs(later) == []
+
+        job, = await db.get_economy_jobs(12345)
+        assert job['next_run'] == (later + datetime.timedelta(hours=6)).strftime('%Y-%m-%d %H:%M:%S')
+        assert await db.delete_economy_job(12345, 'interest')
+        assert await db.get_economy_jobs(12345) == []
+
+
 class TestCooldowns:
     """Tests del sistema de cooldowns."""
 
@@ -121,6 +328,62 @@ class TestBlacklist:
         await db.remove_from_blacklist(999)
         assert await db.is_blacklisted(999) is False
 
+    async def test_checks_use_memory_index(self, monkeypatch):
+        await db.add_to_blacklist(999, "user", "spam")
+        await db.is_blacklisted(1)
+        calls = []
+        real_fetchall = db.fetchall
+        async def counting_fetchall(*args, **kwargs):
+            calls.append(args)
+            return await real_fetchall(*args, **kwargs)
+        monkeypatch.setattr(db, "fetchall", counting_fetchall)
+        for _ in range(100):
+            assert await db.is_blacklisted(999, None) is True
+            assert await db.is_blacklisted(555, 12345) is False
+        assert calls == []
+
+    async def test_writes_from_other_process_refresh_index(self):
+        assert await db.is_blacklisted(4242) is False
+        # Otro proceso (el dashboard) escribe y el bus entrega la invalidación
+        db.get_connection().execute("INSERT INTO global_blacklist (discord_id, entity_type) VALUES (4242, 'guild')")
+        db.publish_invalidation('global_blacklist', 4242)
+        assert await db.is_blacklisted(1, 4242) is True
+
+    async def test_writes_are_announced_to_other_processes(self):
+        await db.add_to_blacklist(31337, "user")
+        row = await db.fetchone("SELECT cache_key FROM cache_invalidations WHERE table_name = 'global_blacklist'")
+        assert row['cache_key'] == 31337
+
+    async def test_views_reject_blacklisted_users(self):
+        from utils.interaction_guard import GuardedModal, GuardedView
+
+        class FakeResponse:
+            def __init__(self):
+                self.sent = []
+            def is_done(self):
+                return bool(self.sent)
+            async def send_message(self, content, ephemeral=False):
+                self.sent.append(content)
+
+        class FakeInteraction:
+            type = None
+            def __init__(self, user_id):
+                self.user = type("User", (), {"id": user_id})()
+                self.guild_id = 12345
+                self.response = FakeResponse()
+
+        await db.add_to_blacklist(666, "user")
+        view = GuardedView()
+        blocked, allowed = FakeInteraction(666), FakeInteraction(777)
+        assert await view.interaction_check(blocked) is False
+        assert blocked.response.sent
+        assert await view.interaction_check(allowed) is True
+
+        modal = GuardedModal(title="Prueba")
+        blocked = FakeInteraction(666)
+        assert await modal.interaction_check(blocked) is False
+        assert blocked.response.sent
+
     async def test_get_all_blacklisted(self):
         await db.add_to_blacklist(1, "user", "r1")
         await db.add_to_blacklist(2, "guild", "r2")
@@ -144,6 +407,73 @@ class TestServerSettings:
         assert settings2 is not None
 
 
+class TestInvalidationBus:
+    """Tests del bus de invalidación de cachés."""
+
+    def test_parse_insert_and_update_targets(self):
+        assert db.parse_write_target("INSERT INTO gambling_active_channels (guild_id, channel_id) VALUES (?, ?)", (5, 99)) == ('gambling_active_channels', 5)
+        assert db.parse_write_target("REPLACE INTO role_rewards (level, guild_id, role_id) VALUES (?, ?, ?)", (3, 7, 8)) == ('role_rewards', 7)
+        assert db.parse_write_target("UPDATE server_settings SET log_channel_id = ?, prefix = ? WHERE guild_id = ?", (2222222, '?', 42)) == ('server_settings', 42)
+        assert db.parse_write_target("DELETE FROM shop_items WHERE item_id = ? AND guild_id = ?", (1, 9)) == ('shop_items', 9)
+        assert db.parse_write_target("UPDATE bot_guilds SET is_active = 0") == ('bot_guilds', None)
+        assert db.parse_write_target("SELECT * FROM server_settings") is None
+
+    async def test_write_only_invalidates_its_guild(self):
+        await db.get_cached_server_settings(12345)
+        await db.get_cached_server_settings(54321)
+        await db.execute("UPDATE server_settings SET log_channel_id = ? WHERE guild_id = ?", (54321, 12345))
+        assert 12345 not in db._settings_cache
+        assert 54321 in db._settings_cache
+        settings = await db.get_cached_server_settings(12345)
+        assert settings['log_channel_id'] == 54321
+
+    async def test_explicit_invalidates_and_subscribers(self):
+        seen = []
+        db.subscribe_invalidation('test_table', seen.append)
+        try:
+            await db.execute("UPDATE server_settings SET prefix = '?' WHERE guild_id = 12345", invalidates=('test_table', 12345))
+            assert seen == [12345]
+        finally:
+            db._invalidation_subscribers.pop('test_table', None)
+            db.CACHED_TABLES.discard('test_table')
+
+    async def test_remote_invalidations_are_applied(self):
+        await db._seed_remote_invalidations()  # Fija el punto de partida
+        await db.get_cached_server_settings(12345)
+        await db.execute("INSERT INTO cache_invalidations (table_name, cache_key, origin) VALUES ('server_settings', 12345, 'otro-proceso')",
+                         invalidates=[])
+        assert 12345 in db._settings_cache
+        await db._consume_remote_invalidations()
+        assert 12345 not in db._settings_cache
+
+    async def test_first_remote_invalidation_after_start_is_applied(self, monkeypatch):
+        # El vigilante fija el punto de partida al arrancar, no con el primer cambio
+        monkeypatch.setattr(db, "_last_invalidation_id", None)
+        seen = []
+        async def watcher():
+            seen.append(True)
+        monkeypatch.setattr(db, "_change_watchers", [db._consume_remote_invalidations, watcher])
+        # data_version solo cambia cuando el "otro proceso" ya escribió
+        written = asyncio.Event()
+        async def data_version():
+            return 2 if written.is_set() else 1
+        monkeypatch.setattr(db._manager, "data_version", data_version)
+
+        task = asyncio.create_task(db._change_watch_loop(0.01))
+        try:
+            while db._last_invalidation_id is None:
+                await asyncio.sleep(0.005)
+            await db.get_cached_server_settings(12345)
+            await db.execute("INSERT INTO cache_invalidations (table_name, cache_key, origin) VALUES ('server_settings', 12345, 'otro-proceso')",
+                             invalidates=[])
+            written.set()
+            while not seen:
+                await asyncio.sleep(0.005)
+        finally:
+            task.cancel()
+        assert 12345 not in db._settings_cache
+
+
 class TestEconomySettings:
     """Tests de economy settings."""
 
@@ -179,8 +509,120 @@ class TestLogs:
         assert len(logs) == 1
         assert logs[0]['action'] == "ban"
 
+    async def test_logs_are_buffered_until_flush(self):
+        await db.log_global_command(12345, "TestGuild", 999, "TestUser", "/a")
+        await db.add_mod_log(12345, 999, 1, "Warn", "spam")
+        raw = await db.fetchone("SELECT COUNT(*) AS n FROM global_command_logs")
+        assert raw['n'] == 0
+        await db.flush_log_buffer()
+        assert (await db.fetchone("SELECT COUNT(*) AS n FROM global_command_logs"))['n'] == 1
+        assert (await db.fetchone("SELECT COUNT(*) AS n FROM mod_logs"))['n'] == 1
+
+    async def test_buffer_flushes_on_size_threshold(self, monkeypatch):
+        monkeypatch.setattr(db._log_buffer, "flush_size", 3)
+        for i in range(3):
+            await db.log_system_event("INFO", "Test", f"msg {i}")
+        await asyncio.sleep(0.05)  # El volcado por tamaño corre en segundo plano
+        row = await db.fetchone("SELECT COUNT(*) AS n FROM bot_logs")
+        assert row['n'] == 3
+
     async def test_dashboard_login(self):
         await db.record_dashboard_login(999, "TestUser", "avatar_url")
         row = await db.fetchone("SELECT * FROM dashboard_users WHERE user_id = ?", (999,))
         assert row is not None
         assert row['username'] == "TestUser"
+
+
+class TestQueryMetrics:
+    """Métricas por sentencia y log de consultas lentas."""
+
+    def test_normalize_sql_strips_literals(self):
+        from utils.query_metrics import normalize_sql
+        assert normalize_sql("SELECT *  FROM levels\n WHERE guild_id = 123 AND name = 'x'") == \
+            "SELECT * FROM levels WHERE guild_id = ? AND name = ?"
+        assert normalize_sql("SELECT * FROM t WHERE id IN (?, ?, ?)") == "SELECT * FROM t WHERE id IN (?, ...)"
+
+    async def test_statements_are_recorded(self):
+        db.query_metrics.reset()
+        await db.execute("INSERT INTO levels (guild_id, user_id, level, xp) VALUES (?, ?, ?, ?)", (1, 2, 1, 0))
+        for _ in range(3):
+            await db.fetchall("SELECT * FROM levels WHERE guild_id = ?", (1,))
+        stats = db.query_metrics.get("SELECT * FROM levels WHERE guild_id = ?")
+        assert stats['calls'] == 3
+        assert stats['rows'] == 3
+        assert stats['p50_ms'] <= stats['p99_ms'] <= stats['max_ms']
+        top = db.get_query_metrics(limit=5, sort='calls')['statements']
+        assert top[0]['sql'] == "SELECT * FROM levels WHERE guild_id = ?"
+
+    async def test_slow_query_log(self, monkeypatch):
+        db.query_metrics.reset()
+        monkeypatch.setattr(db.query_metrics, "slow_query_ms", 0)
+        await db.fetchone("SELECT 1 AS uno")
+        slow = db.get_query_metrics()['slow_queries']
+        assert slow and slow[0]['sql'] == "SELECT ? AS uno"
+
+
+class TestLogCompaction:
+    """Agregados horarios y retención de los logs."""
+
+    async def _insert_command(self, guild_id, command, timestamp):
+        await db.execute("INSERT INTO global_command_logs (guild_id, guild_name, user_id, user_name, command_name, timestamp) VALUES (?, 'G', 1, 'U', ?, ?)",
+                         (guild_id, command, timestamp))
+
+    async def test_rollup_and_retention(self):
+        now = datetime.datetime(2026, 5, 20, 12, 30, tzinfo=datetime.timezone.utc)
+        await self._insert_command(1, "play", "2026-03-01 10:05:00")  # fuera de la retención
+        await self._insert_command(1, "play", "2026-05-20 10:05:00")
+        await self._insert_command(1, "play", "2026-05-20 10:45:00")
+        await self._insert_command(2, "rank", "2026-05-20 11:10:00")
+        await self._insert_command(1, "play", "2026-05-20 12:10:00")  # hora aún abierta
+        await db.execute("INSERT INTO bot_logs (level, category, message, timestamp) VALUES ('INFO', 'T', 'viejo', '2026-01-01 00:00:00')")
+
+        result = await db.compact_logs(now=now)
+        assert result['pruned_command_logs'] == 1
+        assert result['pruned_system_logs'] == 1
+
+        rows = await db.fetchall("SELECT * FROM command_stats_hourly ORDER BY hour, guild_id")
+        assert [(r['hour'], r['guild_id'], r['command_name'], r['count']) for r in rows] == [
+            ("2026-03-01 10:00:00", 1, "play", 1),
+            ("2026-05-20 10:00:00", 1, "play", 2),
+            ("2026-05-20 11:00:00", 2, "rank", 1),
+        ]
+        assert await db.get_total_commands_run() == 5
+
+        # Repetir no vuelve a contar las mismas horas
+        await db.compact_logs(now=now)
+        assert await db.get_total_commands_run() == 5
+        raw = await db.fetchone("SELECT COUNT(*) AS n FROM global_command_logs")
+        assert raw['n'] == 4
+
+
+class TestLeaderboards:
+    """Rankings paginados y puesto de un usuario sobre los índices de ranking."""
+
+    async def _seed(self):
+        # net_worth: 1→300, 2→200, 3→200, 4→100, 5→50
+        for user_id, wallet, bank in [(1, 100, 200), (2, 200, 0), (3, 150, 50), (4, 100, 0), (5, 50, 0)]:
+            await db.execute("INSERT INTO balances (guild_id, user_id, wallet, bank) VALUES (?, ?, ?, ?)", (12345, user_id, wallet, bank))
+
+    async def test_rank_and_ties(self):
+        await self._seed()
+        assert await db.get_user_rank('economy', 12345, 1) == {'score': 300, 'rank': 1, 'total': 5}
+        assert (await db.get_user_rank('economy', 12345, 3))['rank'] == 3  # empate con 2: desempata user_id
+        assert await db.get_user_rank('economy', 12345, 99) is None
+
+    async def test_pages_and_around_me(self):
+        await self._seed()
+        page = await db.get_leaderboard_page('economy', 12345, page=2, per_page=2)
+        assert [(r['user_id'], r['rank']) for r in page] == [(3, 3), (4, 4)]
+        around = await db.get_leaderboard_around('economy', 12345, 3, radius=1)
+        assert [(r['user_id'], r['rank']) for r in around] == [(2, 2), (3, 3), (4, 4)]
+
+    async def test_rank_queries_use_indexes(self):
+        conn = db.get_connection()
+        for table, score in db.LEADERBOARDS.values():
+            for query in (f"SELECT COUNT(*) FROM {table} WHERE guild_id = 1 AND ({score} > 5 OR ({score} = 5 AND user_id < 3))",
+                          f"SELECT * FROM {table} WHERE guild_id = 1 ORDER BY {score} DESC, user_id ASC LIMIT 10"):
+                plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query).fetchall())
+                assert "USING" in plan and "INDEX" in plan, plan
+                assert "TEMP B-TREE" not in plan, plan
@@ -113,3 +113,93 @@ class TestMaxBank:
         max_bank_l10 = await eco_cog.get_max_bank(mock_ctx.guild.id, mock_ctx.author.id)
         
         assert max_bank_l10 > max_bank_l1
+
+    async def test_max_bank_uses_unflushed_xp(self, eco_cog, mock_bot, mock_ctx, monkeypatch):
+        from cogs.leveling import LevelingCog
+        leveling = LevelingCog(mock_bot)
+        monkeypatch.setattr(mock_bot, 'get_cog', lambda name: leveling if name == "Niveles" else None)
+        try:
+            await leveling.ledger.add(mock_ctx.guild.id, mock_ctx.author.id, 10_000)
+            assert await eco_cog.get_max_bank(mock_ctx.guild.id, mock_ctx.author.id) > db.max_bank_for_level(1)
+        finally:
+            leveling.ledger.close()
+
+
+class TestEconomyLoops:
+    async def test_jobs_loop_survives_errors(self, eco_cog, monkeypatch):
+        async def broken(*args, **kwargs):
+            raise RuntimeError("base de datos bloqueada")
+        monkeypatch.setattr(db, "run_due_economy_jobs", broken)
+        # Si la excepción escapara, tasks.loop dejaría de ejecutarse para siempre
+        await eco_cog.economy_jobs_loop.coro(eco_cog)
+
+    async def test_snapshot_loop_waits_for_guild_cache(self, eco_cog, mock_bot, monkeypatch):
+        # La primera instantánea no puede salir antes de tener los servidores en caché
+        waited = []
+        async def wait_until_ready():
+            waited.append(True)
+        monkeypatch.setattr(mock_bot, "wait_until_ready", wait_until_ready)
+        before = eco_cog.economy_snapshot_loop._before_loop
+        assert before is not None
+        await before(eco_cog)
+        assert waited
+
+
+class TestLeaderboard:
+    async def test_leaderboard_shows_own_position(self, eco_cog, mock_ctx):
+        await db.get_balance(mock_ctx.guild.id, mock_ctx.author.id)
+        await eco_cog.leaderboard.callback(eco_cog, mock_ctx)
+        assert len(mock_ctx.embeds_sent) == 1
+        assert "#1 de 1" in mock_ctx.embeds_sent[0].footer.text
+
+
+class TestActiveChannels:
+    async def test_cog_check_uses_cached_allowlist(self, eco_cog, mock_ctx):
+        assert await eco_cog.cog_check(mock_ctx) is True
+        await db.execute("INSERT INTO economy_active_channels (guild_id, channel_id) VALUES (?, ?)", (mock_ctx.guild.id, 4242))
+        # La escritura invalida la caché: el canal actual deja de estar permitido
+        assert await db.get_active_channels('economy', mock_ctx.guild.id) == frozenset({4242})
+        assert await eco_cog.cog_check(mock_ctx) is False
+        assert any("<#4242>" in msg for msg in mock_ctx.ephemeral_responses)
+
+
+class TestShop:
+    async def _add(self, eco_cog, mock_ctx, nombre="Escudo Anti-Robo", precio=300):
+        await eco_cog.add_item.callback(eco_cog, mock_ctx, nombre=nombre, descripcion="Protege tu cartera", precio=precio, tipo='consumable', raw_data="x")
+        return (await db.get_shop_catalog(mock_ctx.guild.id)).find(nombre)
+
+    async def test_catalog_is_invalidated_by_writes(self, eco_cog, mock_ctx):
+        assert len(await db.get_shop_catalog(mock_ctx.guild.id)) == 0
+        item = await self._add(eco_cog, mock_ctx)
+        catalog = await db.get_shop_catalog(mock_ctx.guild.id)
+        assert catalog.get(item['item_id']) is item
+        assert catalog.find("escudo ANTI-robo") is item
+        await eco_cog.remove_item.callback(eco_cog, mock_ctx, item_id=item['item_id'])
+        assert len(await db.get_shop_catalog(mock_ctx.guild.id)) == 0
+
+    async def test_nocase_only_folds_ascii(self):
+        catalog = db.ShopCatalog([{'item_id': 1, 'name': 'Poción', 'type': 'consumable', 'price': 5}])
+        assert catalog.find('POCIóN') is not None
+        assert catalog.find('POCIÓN') is None  # igual que COLLATE NOCASE
+
+    async def test_buy_by_name_and_inventory(self, eco_cog, mock_ctx):
+        item = await self._add(eco_cog, mock_ctx)
+        await db.update_balance(mock_ctx.guild.id, mock_ctx.author.id, wallet_change=900)
+        await eco_cog.buy.callback(eco_cog, mock_ctx, articulo="escudo anti-robo")
+        await eco_cog.buy.callback(eco_cog, mock_ctx, articulo=str(item['item_id']))
+        assert await db.get_balance(mock_ctx.guild.id, mock_ctx.author.id) == (400, 0)
+
+        inventory = await db.get_inventory(mock_ctx.guild.id, mock_ctx.author.id)
+        assert [(row['name'], row['quantity']) for row in inventory] == [("Escudo Anti-Robo", 2)]
+        await eco_cog.inventory.callback(eco_cog, mock_ctx)
+        assert mock_ctx.embeds_sent[-1].fields[0].name == "2x Escudo Anti-Robo"
+
+    async def test_rob_breaks_shield(self, eco_cog, mock_ctx, mock_target):
+        item = await self._add(eco_cog, mock_ctx)
+        await db.execute("INSERT INTO inventory (guild_id, user_id, item_id, quantity) VALUES (?, ?, ?, 1)", (mock_ctx.guild.id, mock_target.id, item['item_id']))
+        await db.update_balance(mock_ctx.guild.id, mock_ctx.author.id, wallet_change=900)
+        await db.update_balance(mock_ctx.guild.id, mock_target.id, wallet_change=900)
+        await eco_cog.rob.callback(eco_cog, mock_ctx, miembro=mock_target)
+        assert mock_ctx.embeds_sent[-1].title == "🚨 ¡EMBOSCADA POLICIAL!"
+        assert await db.get_balance(mock_ctx.guild.id, mock_ctx.author.id) == (500, 0)
+        assert await db.get_inventory(mock_ctx.guild.id, mock_target.id) == []
@@ -0,0 +1,72 @@
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+
+from utils import database_manager as db
+from utils import economy_analytics as analytics
+
+def _balances_db(rows=(), fill_sql: str = "") -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE balances (guild_id INTEGER, user_id INTEGER, wallet INTEGER DEFAULT 0, bank INTEGER DEFAULT 0, PRIMARY KEY (guild_id, user_id))")
+    conn.executemany("INSERT INTO balances VALUES (?, ?, ?, ?)", rows)
+    if fill_sql:
+        conn.execute(fill_sql)
+    conn.execute("CREATE INDEX idx_balances_guild_cover ON balances (guild_id, user_id, wallet, bank)")
+    return conn
+
+class TestSummarize:
+    def test_equal_wealth(self):
+        stats = analytics.summarize(np.full(100, 50), np.full(100, 50))
+        assert stats['money_supply'] == 10000 and stats['bank_share'] == 0.5
+        assert stats['gini'] == 0.0
+        assert stats['top1_share'] == 0.01
+
+    def test_one_user_has_everything(self):
+        wallet = np.zeros(200, dtype=np.int64)
+        wallet[7] = 1000
+        stats = analytics.summarize(wallet, np.zeros(200, dtype=np.int64))
+        assert stats['gini'] == round(199 / 200, 4)
+        assert stats['top1_share'] == 1.0  # top 1% = 2 usuarios
+
+    def test_negative_wallets_do_not_break_inequality(self):
+        stats = analytics.summarize(np.array([-50, 10, 10]), np.array([0, 0, 0]))
+        assert stats['money_supply'] == -30
+        assert 0.0 <= stats['gini'] <= 1.0
+
+    def test_empty_guild(self):
+        assert analytics.summarize(np.zeros(0), np.zeros(0))['users'] == 0
+
+class TestLoadBalances:
+    def test_chunks_cover_every_row_of_the_guild(self):
+        rows = [(1, user_id, user_id, user_id * 2) for user_id in range(1, 1001)] + [(2, 5, 99, 99)]
+        conn = _balances_db(rows)
+        wallet, bank = analytics.load_balances(conn, 1, chunk_size=64)
+        assert len(wallet) == 1000 and wallet.sum() == 500500 and bank.sum() == 1001000
+        assert len(analytics.load_balances(conn, 3)[0]) == 0
+
+    def test_large_guild_is_fast(self):
+        conn = _balances_db(fill_sql="""
+            WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 500000)
+            INSERT INTO balances SELECT 1, 100000000000000000 + x * 1009, x * 7919 % 1000003, x % 5000 FROM n
+        """)
+        started = time.perf_counter()
+        stats = analytics.compute(conn, 1)
+        assert time.perf_counter() - started < 1.0
+        assert stats['users'] == 500_000
+        assert stats['wallet_total'] == conn.execute("SELECT SUM(wallet) FROM balances").fetchone()[0]
+
+class TestSnapshots:
+    async def test_snapshot_and_trend(self):
+        assert await db.take_economy_snapshot(12345) is None
+        for user_id in range(1, 11):
+            await db.update_balance(12345, user_id, wallet_change=user_id * 100, bank_change=50, reason='work')
+        stats = await db.take_economy_snapshot(12345)
+        assert stats['users'] == 10 and stats['bank_total'] == 500
+
+        trend = await db.get_economy_snapshots(12345)
+        assert len(trend) == 1
+        assert trend[0]['money_supply'] == stats['money_supply']
+        assert trend[0]['wallet_total'] == stats['wallet_total']
+        assert trend[0]['gini'] == pytest.approx(stats['gini'])
@@ -0,0 +1,126 @@
+"""Tests para el envío de anuncios a todos los servidores (utils/fanout.py)."""
+import asyncio
+
+import discord
+
+from utils import database_manager as db
+from utils.fanout import BroadcastFanOut, ChannelResolver
+
+class FakeResponse:
+    def __init__(self, status, reason="error", headers=None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+class FakePermissions:
+    def __init__(self, send_messages):
+        self.send_messages = send_messages
+
+class FakeChannel:
+    def __init__(self, id, writable=True):
+        self.id = id
+        self.writable = writable
+        self.checks = 0
+
+    def permissions_for(self, member):
+        self.checks += 1
+        return FakePermissions(self.writable)
+
+class FakeGuild:
+    def __init__(self, id, channels=None, system_channel=None):
+        self.id = id
+        self.me = object()
+        self.text_channels = channels if channels is not None else [FakeChannel(id * 10)]
+        self.system_channel = system_channel
+
+    def get_channel(self, channel_id):
+        return next((c for c in self.text_channels if c.id == channel_id), None)
+
+class TestBroadcastFanOut:
+    async def test_delivers_to_every_guild_with_bounded_concurrency(self):
+        guilds = [FakeGuild(i) for i in range(1, 31)]
+        in_flight, peak, sent = 0, 0, []
+        async def send(channel):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+            sent.append(channel.id)
+
+        result = await BroadcastFanOut(send, resolver=ChannelResolver(), concurrency=4, rate=1000).run(guilds)
+        assert result['sent'] == 30 and result['failed'] == 0
+        assert sorted(sent) == [g.id * 10 for g in guilds]
+        assert 1 < peak <= 4
+
+    async def test_guild_without_writable_channel_is_skipped(self):
+        guilds = [FakeGuild(1), FakeGuild(2, channels=[FakeChannel(20, writable=False)])]
+        async def send(channel):
+            pass
+        result = await BroadcastFanOut(send, resolver=ChannelResolver(), rate=1000).run(guilds)
+        assert result['sent'] == 1 and result['skipped'] == 1
+
+    async def test_resume_skips_delivered_guilds(self):
+        task_id = await db.enqueue_task('broadcast', 'hola')
+        guilds = [FakeGuild(i) for i in range(1, 6)]
+        # Un primer intento que llegó a entregar dos servidores antes de caerse
+        await db.record_broadcast_deliveries(task_id, [(1, 10, 'sent', None, 0.0), (2, 20, 'sent', None, 0.0)])
+        sent = []
+        async def send(channel):
+            sent.append(channel.id)
+
+        result = await BroadcastFanOut(send, task_id=task_id, resolver=ChannelResolver(), rate=1000).run(guilds)
+        assert sorted(sent) == [30, 40, 50]
+        assert result['resumed'] == 2 and result['sent'] == 3
+
+    async def test_progress_is_persisted(self):
+        task_id = await db.enqueue_task('broadcast', 'hola')
+        guilds = [FakeGuild(1), FakeGuild(2), FakeGuild(3, channels=[])]
+        async def send(channel):
+            if channel.id == 20:
+                raise discord.HTTPException(FakeResponse(400, "Bad Request"), "embed inválido")
+
+        await BroadcastFanOut(send, task_id=task_id, resolver=ChannelResolver(), rate=1000, flush_every=2).run(guilds)
+        progress = await db.get_broadcast_progress(task_id)
+        assert progress['total'] == 3 and progress['done'] == 3
+        assert (progress['sent'], progress['skipped'], progress['failed']) == (1, 1, 1)
+        assert [b['id'] for b in await db.get_recent_broadcasts()] == [task_id]
+
+    async def test_forbidden_cached_channel_is_resolved_again(self):
+        first, second = FakeChannel(10), FakeChannel(11)
+        guild = FakeGuild(1, channels=[first, second])
+        resolver = ChannelResolver()
+        assert resolver.resolve(guild) is first
+        attempts = []
+        async def send(channel):
+            attempts.append(channel.id)
+            if channel is first:
+                # Le quitaron el permiso al bot después de cachear el canal
+                first.writable = False
+                raise discord.Forbidden(FakeResponse(403, "Forbidden"), "Missing Permissions")
+
+        result = await BroadcastFanOut(send, resolver=resolver, rate=1000).run([guild])
+        assert attempts == [10, 11] and result['sent'] == 1
+        assert resolver.resolve(guild) is second
+
+    async def test_rate_limit_pauses_and_retries(self):
+        calls = []
+        async def send(channel):
+            calls.append(asyncio.get_running_loop().time())
+            if len(calls) == 1:
+                raise discord.HTTPException(FakeResponse(429, "Too Many Requests", {'Retry-After': '0.05'}), "rate limited")
+
+        result = await BroadcastFanOut(send, resolver=ChannelResolver(), rate=1000).run([FakeGuild(1)])
+        assert result['sent'] == 1 and len(calls) == 2
+        assert calls[1] - calls[0] >= 0.04
+
+    async def test_resolver_caches_channel_per_guild(self):
+        channels = [FakeChannel(10, writable=False), FakeChannel(11, writable=False), FakeChannel(12)]
+        guild = FakeGuild(1, channels=channels)
+        resolver = ChannelResolver()
+        assert resolver.resolve(guild).id == 12
+        assert [c.checks for c in channels] == [1, 1, 1]
+        # Segunda vez: solo se revalida el canal cacheado
+        assert resolver.resolve(guild).id == 12
+        assert [c.checks for c in channels] == [1, 1, 2]
+        assert len(resolver) == 1
@@ -91,3 +91,18 @@ class TestChannelRestriction:
         )
         result = await gambling_cog.can_gamble(mock_ctx)
         assert result is True
+
+    async def test_channel_check_is_cached_and_invalidated(self, gambling_cog, mock_ctx, monkeypatch):
+        """La lista de canales se sirve de memoria y los comandos add/remove la invalidan."""
+        channel = type('C', (), {'id': mock_ctx.channel.id, 'mention': '#casino'})()
+        await gambling_cog.add_channel.callback(gambling_cog, mock_ctx, channel)
+        assert await gambling_cog.can_gamble(mock_ctx) is True
+
+        async def no_db(*args, **kwargs):
+            raise AssertionError("can_gamble no debería consultar la base de datos")
+        monkeypatch.setattr(db, "fetchall", no_db)
+        assert await gambling_cog.can_gamble(mock_ctx) is True
+        monkeypatch.undo()
+
+        await gambling_cog.remove_channel.callback(gambling_cog, mock_ctx, channel)
+        assert await db.get_active_channels('gambling', mock_ctx.guild.id) == frozenset()
@@ -4,6 +4,7 @@ from unittest.mock import AsyncMock, patch, MagicMock
 from cogs.serverconfig import ServerConfigCog
 from discord.ext import commands
 import discord
+from utils.rate_limiter import RateLimiter, RATE_LIMIT_USER_BURST
 
 # Fake Bot object to test the cooldown injection
 class DummyBot(commands.Bot):
@@ -19,66 +20,57 @@ class DummyBot(commands.Bot):
         # Esta es una versión reducida exacta del código insertado en main.py 
         # para aislar la prueba de la lógica de rate limiting.
         OWNER_ID = "11111111"
-        
+        self.rate_limiter = RateLimiter(exempt_users=[int(OWNER_ID)])
+
         async def global_interaction_cooldown(interaction: discord.Interaction):
             if interaction.type != discord.InteractionType.application_command:
                 return True
-            exempt_commands = {'work', 'rob', 'daily', 'deposit', 'withdraw', 'balance', 'rank', 'play', 'pause', 'resume', 'skip'}
-            if interaction.command and interaction.command.name in exempt_commands:
-                return True
-            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
-            user_id = interaction.user.id
-            if str(user_id) == OWNER_ID:
-                return True
-            if not hasattr(self, '_last_cmd_times'):
-                self._last_cmd_times = {}
-            last_time = self._last_cmd_times.get(user_id, 0)
-            if now - last_time < 3.0:
-                time_left = 3.0 - (now - last_time)
-                await interaction.response.send_message(f"⏳ Te estás apresurando. Por favor, espera **{time_left:.1f}** segundos.", ephemeral=True)
+            command_name = interaction.command.name if interaction.command else interaction.data.get('name')
+            retry_after = self.rate_limiter.hit(interaction.user.id, interaction.guild_id, command_name)
+            if retry_after:
+                await interaction.response.send_message(f"⏳ Te estás apresurando. Por favor, espera **{retry_after:.1f}** segundos.", ephemeral=True)
                 return False
-            self._last_cmd_times[user_id] = now
             return True
         
         self.tree.interaction_check = global_interaction_cooldown
 
         @self.check
         async def global_prefix_cooldown(ctx: commands.Context):
-            if not ctx.command: return True
-            exempt_commands = {'work', 'rob', 'daily', 'deposit', 'withdraw', 'balance', 'rank', 'play', 'pause', 'resume', 'skip'}
-            if ctx.command.name in exempt_commands: return True
-            now = datetime.datetime.now(datetime.timezone.utc).timestamp()
-            user_id = ctx.author.id
-            if str(user_id) == OWNER_ID: return True
-            if not hasattr(self, '_last_cmd_times'):
-                self._last_cmd_times = {}
-            last_time = self._last_cmd_times.get(user_id, 0)
-            if now - last_time < 3.0:
-                time_left = 3.0 - (now - last_time)
+            if not ctx.command or ctx.interaction is not None:
+                return True
+            retry_after = self.rate_limiter.hit(ctx.author.id, ctx.guild.id if ctx.guild else None, ctx.command.name)
+            if retry_after:
                 try:
-                    await ctx.send(f"⏳ Te estás apresurando. Por favor, espera **{time_left:.1f}** segundos.", delete_after=3.0)
+                    await ctx.send(f"⏳ Te estás apresurando. Por favor, espera **{retry_after:.1f}** segundos.", delete_after=3.0)
                 except discord.HTTPException:
                     pass
                 return False
-            self._last_cmd_times[user_id] = now
             return True
 
 
+def _prefix_ctx(command_name: str, user_id: int = 999999999):
+    mock_ctx = AsyncMock()
+    mock_ctx.command = MagicMock()
+    mock_ctx.command.name = command_name
+    mock_ctx.author.id = user_id
+    mock_ctx.guild = None
+    mock_ctx.interaction = None
+    return mock_ctx
+
+
 @pytest.mark.asyncio
 async def test_global_prefix_cooldown():
     bot = DummyBot()
     await bot.setup_hook()
     
     # 1. Simular un usuario normal ejecutando !!ping
-    mock_ctx = AsyncMock()
-    mock_ctx.command = MagicMock()
-    mock_ctx.command.name = "ping"
-    mock_ctx.author.id = 999999999  # No es dueño
+    mock_ctx = _prefix_ctx("ping")
     
-    # Primera petición: Debe pasar
-    assert await bot._checks[0](mock_ctx) is True
+    # La ráfaga permitida pasa
+    for _ in range(int(RATE_LIMIT_USER_BURST)):
+        assert await bot._checks[0](mock_ctx) is True
     
-    # Segunda petición inmediata: Debe fallar y enviar aviso
+    # La siguiente petición inmediata: Debe fallar y enviar aviso
     assert await bot._checks[0](mock_ctx) is False
     mock_ctx.send.assert_called_once()
     
@@ -91,26 +83,86 @@ async def test_global_prefix_cooldown_exemptions():
     bot = DummyBot()
     await bot.setup_hook()
     
-    mock_ctx = AsyncMock()
-    mock_ctx.command = MagicMock()
-    mock_ctx.author.id = 999999999
-    
     # Comandos como !!work están exentos, no deberian activar cooldown
-    mock_ctx.command.name = "work"
-    assert await bot._checks[0](mock_ctx) is True
-    assert await bot._checks[0](mock_ctx) is True # 2da vez inmediata sigue pasando
+    mock_ctx = _prefix_ctx("work")
+    for _ in range(10):
+        assert await bot._checks[0](mock_ctx) is True
+    assert bot.rate_limiter.stats()['tracked_users'] == 0
 
 @pytest.mark.asyncio
 async def test_global_owner_bypass():
     bot = DummyBot()
     await bot.setup_hook()
     
-    mock_ctx = AsyncMock()
-    mock_ctx.command = MagicMock()
-    mock_ctx.command.name = "ping"
-    mock_ctx.author.id = 11111111  # Mismo que OWNER_ID configurado
+    mock_ctx = _prefix_ctx("ping", user_id=11111111)  # Mismo que OWNER_ID configurado
     
     # El dueño puede spamear
-    assert await bot._checks[0](mock_ctx) is True
-    assert await bot._checks[0](mock_ctx) is True
-    assert await bot._checks[0](mock_ctx) is True
+    for _ in range(10):
+        assert await bot._checks[0](mock_ctx) is True
+
+@pytest.mark.asyncio
+async def test_hybrid_slash_is_not_charged_twice():
+    bot = DummyBot()
+    await bot.setup_hook()
+
+    mock_ctx = _prefix_ctx("ping")
+    mock_ctx.interaction = MagicMock()  # Invocado como slash: ya lo contó el check del árbol
+    for _ in range(10):
+        assert await bot._checks[0](mock_ctx) is True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter:
+    def test_bucket_refills_over_time(self):
+        clock = FakeClock()
+        limiter = RateLimiter(user_burst=2, user_period=3, costs={}, exempt_commands=(), clock=clock)
+        assert limiter.hit(1, None, "ping") == 0
+        assert limiter.hit(1, None, "ping") == 0
+        assert limiter.hit(1, None, "ping") == pytest.approx(3.0)
+        clock.now += 3
+        assert limiter.hit(1, None, "ping") == 0
+
+    def test_command_costs(self):
+        clock = FakeClock()
+        limiter = RateLimiter(user_burst=3, user_period=1, costs={'wanted': 2}, exempt_commands=(), clock=clock)
+        assert limiter.hit(1, None, "wanted") == 0
+        assert limiter.hit(1, None, "wanted") == pytest.approx(1.0)
+        assert limiter.hit(1, None, "ping") == 0
+
+    def test_guild_bucket_is_shared_and_rejections_are_free(self):
+        clock = FakeClock()
+        limiter = RateLimiter(user_burst=5, user_period=1, guild_burst=3, guild_period=10, costs={}, exempt_commands=(), clock=clock)
+        for user_id in (1, 2, 3):
+            assert limiter.hit(user_id, 50, "ping") == 0
+        assert limiter.hit(4, 50, "ping") == pytest.approx(10.0)
+        # El rechazo por servidor no gasta tokens del usuario
+        assert limiter.users.available(4) == 5
+        assert limiter.hit(4, 60, "ping") == 0
+
+    def test_full_buckets_expire(self):
+        clock = FakeClock()
+        limiter = RateLimiter(user_burst=3, user_period=3, guild_burst=5000, guild_period=0.001, costs={}, exempt_commands=(), clock=clock)
+        for user_id in range(1000):
+            limiter.hit(user_id, 7, "ping")
+        assert limiter.stats()['tracked_users'] == 1000
+        clock.now += 10
+        limiter.hit(5000, None, "ping")
+        assert limiter.stats()['tracked_users'] == 1
+        assert limiter.stats()['tracked_guilds'] == 1  # Sin tráfico del servidor sigue ahí hasta un sweep
+        limiter.sweep()
+        assert limiter.stats()['tracked_guilds'] == 0
+
+    def test_long_idle_period_clears_everything(self):
+        clock = FakeClock()
+        limiter = RateLimiter(user_burst=3, user_period=3, costs={}, exempt_commands=(), clock=clock)
+        limiter.hit(1, None, "ping")
+        clock.now += 10_000
+        limiter.users.sweep()
+        assert len(limiter.users) == 0
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from utils import image_service as images
+from utils.image_service import ImageService, ImageServiceBusy
+
+def _avatar_png() -> bytes:
+    buffer = BytesIO()
+    Image.new("RGBA", (64, 64), (255, 0, 0, 255)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@pytest.fixture
+async def service():
+    service = ImageService(workers=1, max_queue=4)
+    yield service
+    service.close()
+
+class TestRankCard:
+    def test_render_in_process(self):
+        png = images._render_rank_card(_avatar_png(), "Umapyoi", 12, 340, 1300, 3, 120)
+        image = Image.open(BytesIO(png))
+        assert image.format == "PNG"
+        assert image.size == images.RANK_CARD_SIZE
+
+    def test_render_without_avatar_or_rank(self):
+        png = images._render_rank_card(None, "x" * 80, 1, 0, 155, None, None)
+        assert Image.open(BytesIO(png)).size == images.RANK_CARD_SIZE
+
+class TestImageService:
+    async def test_render_through_pool(self, service):
+        png = await service.render('rank_card', _avatar_png(), "Umapyoi", 5, 10, 400, 1, 1)
+        assert Image.open(BytesIO(png)).size == images.RANK_CARD_SIZE
+        assert service.stats()['rendered'] == 1
+
+    async def test_unknown_kind(self, service):
+        with pytest.raises(ValueError):
+            await service.render('nope')
+
+    async def test_full_queue_is_rejected(self, service):
+        await service.start()
+        args = (_avatar_png(), "Umapyoi", 5, 10, 400, 1, 1)
+        results = await asyncio.gather(*(service.render('rank_card', *args) for _ in range(8)), return_exceptions=True)
+        rejected = [r for r in results if isinstance(r, ImageServiceBusy)]
+        assert len(rejected) == 4
+        assert all(isinstance(r, bytes) for r in results if r not in rejected)
+        assert service.stats()['rejected'] == 4 and service.stats()['queued'] == 0
+
+    async def test_event_loop_stays_responsive(self, service):
+        """Mientras se renderiza, el bucle de eventos (heartbeats) no se queda bloqueado."""
+        await service.start()
+        args = (_avatar_png(), "Umapyoi", 5, 10, 400, 1, 1)
+        renders = asyncio.gather(*(service.render('rank_card', *args) for _ in range(4)))
+        worst_lag = 0.0
+        while not renders.done():
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst_lag = max(worst_lag, time.perf_counter() - before - 0.01)
+        await renders
+        assert worst_lag < 0.2
@@ -8,7 +8,9 @@ from tests.conftest import MockMessage, MockUser, MockGuild, MockMember
 
 @pytest.fixture
 def level_cog(mock_bot):
-    return LevelingCog(mock_bot)
+    cog = LevelingCog(mock_bot)
+    yield cog
+    cog.ledger.close()
 
 
 def make_mock_message(guild_id=12345, user_id=999, user_name="TestUser"):
@@ -43,6 +45,7 @@ class TestProcessXP:
         db.invalidate_cache(msg.guild.id)
 
         await level_cog.process_xp(msg)
+        await level_cog.flush_xp()
         level, xp = await db.get_user_level(msg.guild.id, msg.author.id)
         assert xp > 0, "El XP debería haber aumentado después del mensaje"
 
@@ -56,10 +59,12 @@ class TestProcessXP:
 
         # Primer mensaje: debe dar XP
         await level_cog.process_xp(msg)
+        await level_cog.flush_xp()
         _, xp_after_first = await db.get_user_level(msg.guild.id, msg.author.id)
 
         # Segundo mensaje inmediato: NO debe dar XP (cooldown 60s)
         await level_cog.process_xp(msg)
+        await level_cog.flush_xp()
         _, xp_after_second = await db.get_user_level(msg.guild.id, msg.author.id)
 
         assert xp_after_second == xp_after_first, \
@@ -74,13 +79,14 @@ class TestProcessXP:
         db.invalidate_cache(msg.guild.id)
 
         await level_cog.process_xp(msg)
+        await level_cog.flush_xp()
         _, xp_after_first = await db.get_user_level(msg.guild.id, msg.author.id)
 
-        # Simular que el cooldown expiró (poner timestamp viejo)
-        old_time = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=120)
-        await db.set_cooldown(msg.guild.id, msg.author.id, 'xp_gain', old_time)
+        # Simular que el cooldown expiró (vive en memoria)
+        level_cog.ledger.reset_cooldown(msg.guild.id, msg.author.id)
 
         await level_cog.process_xp(msg)
+        await level_cog.flush_xp()
         _, xp_after_second = await db.get_user_level(msg.guild.id, msg.author.id)
 
         assert xp_after_second > xp_after_first, \
@@ -119,10 +125,62 @@ class TestLevelUp:
         db.invalidate_cache(guild_id)
 
         await level_cog.process_xp(msg)
+        await level_cog.flush_xp()
         level, _ = await db.get_user_level(guild_id, user_id)
         assert level >= 2, "Debería haber subido al nivel 2"
 
 
+class TestXPLedger:
+    async def test_messages_do_not_touch_the_database(self, level_cog, monkeypatch):
+        msg = make_mock_message()
+        await level_cog.ledger.get(msg.guild.id, msg.author.id)  # primera carga
+        await db.get_cached_server_settings(msg.guild.id)
+
+        async def fail(*args, **kwargs):
+            raise AssertionError("El camino de mensajes no debería consultar la DB")
+        monkeypatch.setattr(db, "fetchone", fail)
+        monkeypatch.setattr(db, "execute", fail)
+        for _ in range(3):
+            level_cog.ledger.reset_cooldown(msg.guild.id, msg.author.id)
+            await level_cog.process_xp(msg)
+
+    async def test_flush_writes_dirty_rows_once(self, level_cog):
+        for user_id in (1, 2, 3):
+            await level_cog.ledger.gain(12345, user_id, 20)
+        assert await level_cog.ledger.flush() == 3
+        assert await level_cog.ledger.flush() == 0
+        rows = await db.fetchall("SELECT user_id, xp FROM levels WHERE guild_id = ? ORDER BY user_id", (12345,))
+        assert [(r['user_id'], r['xp']) for r in rows] == [(1, 20), (2, 20), (3, 20)]
+
+    async def test_external_write_wins_over_memory(self, level_cog):
+        await level_cog.ledger.gain(12345, 999, 20)
+        await level_cog.ledger.flush()
+        await db.update_user_xp(12345, 999, 7, 3)
+        assert await level_cog.ledger.get(12345, 999) == (7, 3)
+
+    async def test_guild_invalidation_keeps_unflushed_xp(self, level_cog):
+        assert await level_cog.ledger.gain(1, 100, 500) == (1, 3)
+        # Otro usuario del servidor sin fila en levels (p. ej. desde la economía)
+        assert await db.get_user_level(1, 200) == (1, 0)
+        db.publish_invalidation('levels', 1)
+        assert await level_cog.ledger.get(1, 100) == (3, 125)
+        assert await level_cog.ledger.gain(1, 100, 20) is None  # el cooldown sigue ahí
+        assert await level_cog.ledger.flush() == 1
+        row = await db.fetchone("SELECT total_xp FROM levels WHERE guild_id = 1 AND user_id = 100")
+        assert row['total_xp'] == 500
+
+    async def test_external_write_merges_with_pending_xp(self, level_cog):
+        await level_cog.ledger.gain(12345, 999, 20)
+        await level_cog.ledger.flush()
+        await level_cog.ledger.add(12345, 999, 30)
+        # Un admin pone al usuario en nivel 7 antes del siguiente volcado
+        await db.update_user_xp(12345, 999, 7, 3)
+        assert await level_cog.ledger.get(12345, 999) == (7, 33)
+        await level_cog.ledger.flush()
+        row = await db.fetchone("SELECT level, xp FROM levels WHERE guild_id = 12345 AND user_id = 999")
+        assert (row['level'], row['xp']) == (7, 33)
+
+
 class TestRankCommand:
     async def test_rank_shows_embed(self, level_cog, mock_ctx):
         await level_cog.rank.callback(level_cog, mock_ctx)
@@ -146,3 +204,85 @@ class TestXPFormula:
         level = 50
         xp_needed = 5 * (level ** 2) + 50 * level + 100
         assert xp_needed == 15100
+
+
+class TestTotalXP:
+    """XP total acumulado, inversa cerrada de la curva y recálculo masivo."""
+
+    def test_closed_form_matches_iterative_curve(self):
+        from utils.leveling_math import DEFAULT_CURVE
+        level, xp, total = 1, 0, 0
+        for gained in [20] * 2000:
+            total += gained
+            xp += gained
+            while xp >= 5 * (level ** 2) + 50 * level + 100:
+                xp -= 5 * (level ** 2) + 50 * level + 100
+                level += 1
+            assert DEFAULT_CURVE.split(total) == (level, xp)
+
+    def test_vectorized_split_matches_scalar(self):
+        from utils.leveling_math import LevelCurve
+        curve = LevelCurve(3, 7, 11)
+        totals = [0, 1, 20, 21, 10**6, 10**9 + 7]
+        levels, xps = curve.split_many(totals)
+        assert list(zip(levels.tolist(), xps.tolist())) == [curve.split(t) for t in totals]
+
+    async def test_give_xp_stores_total_and_levels_up(self, level_cog, mock_ctx):
+        member = MockMember(999, "TestUser", mock_ctx.guild)
+        await level_cog.give_xp.callback(level_cog, mock_ctx, member, 10_000)
+        row = await db.fetchone("SELECT level, xp, total_xp FROM levels WHERE guild_id = ? AND user_id = ?", (mock_ctx.guild.id, 999))
+        assert row['total_xp'] == 10_000
+        assert row['level'] > 1
+
+    async def test_recompute_after_curve_change(self, level_cog):
+        from utils.leveling_math import LevelCurve
+        await level_cog.ledger.add(12345, 1, 1000)
+        await level_cog.ledger.add(12345, 2, 50)
+        await level_cog.flush_xp()
+
+        curve = LevelCurve(0, 0, 100)
+        assert await db.recompute_guild_levels(12345, curve) == 2
+        rows = await db.fetchall("SELECT user_id, level, xp, total_xp FROM levels WHERE guild_id = ? ORDER BY user_id", (12345,))
+        assert [(r['level'], r['xp'], r['total_xp']) for r in rows] == [(11, 0, 1000), (1, 50, 50)]
+        # El ledger relee lo que tenía en memoria para ese servidor
+        assert await level_cog.ledger.get(12345, 1) == (11, 0)
+
+    async def test_set_level_curve_keeps_xp_gained_during_recompute(self, level_cog, mock_ctx, monkeypatch):
+        guild_id = mock_ctx.guild.id
+        await level_cog.ledger.add(guild_id, 1, 1000)
+        recompute = db.recompute_guild_levels
+        async def recompute_with_traffic(*args):
+            # XP ganado entre el volcado y el recálculo
+            await level_cog.ledger.add(guild_id, 1, 50)
+            return await recompute(*args)
+        monkeypatch.setattr(db, "recompute_guild_levels", recompute_with_traffic)
+
+        await level_cog.set_level_curve.callback(level_cog, mock_ctx, 0, 0, 100)
+        assert await level_cog.ledger.get(guild_id, 1) == (11, 50)
+        await level_cog.ledger.flush()
+        row = await db.fetchone("SELECT level, xp, total_xp FROM levels WHERE guild_id = ? AND user_id = 1", (guild_id,))
+        assert (row['level'], row['xp'], row['total_xp']) == (11, 50, 1050)
+
+
+class TestRoleRewards:
+    async def test_multi_level_jump_grants_all_roles_at_once(self, level_cog, mock_ctx):
+        from tests.conftest import MockRole
+        guild = mock_ctx.guild
+        for level, role_id in [(2, 502), (3, 503), (10, 510)]:
+            guild._roles[role_id] = MockRole(role_id)
+            await db.execute("INSERT INTO role_rewards (guild_id, level, role_id) VALUES (?, ?, ?)", (guild.id, level, role_id))
+        member = MockMember(999, "TestUser", guild)
+
+        # 1000 XP con la curva por defecto: del nivel 1 al 4
+        await level_cog.give_xp.callback(level_cog, mock_ctx, member, 1000)
+        assert sorted(r.id for r in member.roles) == [502, 503]
+        assert member.add_roles_calls == 1
+
+    async def test_reward_index_follows_writes(self, level_cog, mock_ctx):
+        from tests.conftest import MockRole
+        guild_id = mock_ctx.guild.id
+        assert await db.get_role_rewards(guild_id) == []
+        await level_cog.set_level_role.callback(level_cog, mock_ctx, 5, MockRole(77))
+        assert await db.get_role_rewards(guild_id) == [(5, 77)]
+        await level_cog.remove_level_role.callback(level_cog, mock_ctx, 5)
+        assert await db.get_role_rewards(guild_id) == []
@@ -0,0 +1,47 @@
+import asyncio
+import gc
+import pytest
+from utils.lock_registry import LockRegistry
+
+class TestLockRegistry:
+    async def test_same_key_is_serialized(self):
+        registry = LockRegistry("test")
+        events = []
+
+        async def worker(name):
+            async with registry.hold((1, 10)):
+                events.append(f"{name}-in")
+                await asyncio.sleep(0.01)
+                events.append(f"{name}-out")
+
+        await asyncio.gather(worker("a"), worker("b"))
+        assert events == ["a-in", "a-out", "b-in", "b-out"]
+        stats = registry.stats()
+        assert stats['acquisitions'] == 2
+        assert stats['contended'] == 1
+        assert stats['max_wait_ms'] > 0
+
+    async def test_keys_are_per_guild(self):
+        registry = LockRegistry("test")
+        async with registry.hold((1, 10)):
+            # El mismo usuario en otro servidor no espera
+            async with registry.hold((2, 10)):
+                pass
+        assert registry.stats()['contended'] == 0
+
+    async def test_idle_locks_are_dropped(self):
+        registry = LockRegistry("test")
+        for user_id in range(100):
+            async with registry.hold((1, user_id)):
+                pass
+        gc.collect()
+        assert len(registry) == 0
+
+    async def test_crossed_transfers_do_not_deadlock(self):
+        registry = LockRegistry("test")
+
+        async def transfer(a, b):
+            async with registry.hold((1, a), (1, b)):
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(asyncio.gather(transfer(10, 20), transfer(20, 10)), timeout=1)
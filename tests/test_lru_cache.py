@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from utils.lru_cache import LRUCache
+from utils import database_manager as db
+
+class TestLRUCache:
+    async def test_hits_misses_and_eviction(self):
+        cache = LRUCache("test", max_size=2)
+        calls = []
+
+        async def loader(key):
+            calls.append(key)
+            return key * 10
+
+        assert await cache.get(1, loader) == 10
+        assert await cache.get(1, loader) == 10
+        await cache.get(2, loader)
+        await cache.get(1, loader)  # 1 pasa a ser la más reciente
+        await cache.get(3, loader)  # expulsa a 2
+
+        assert calls == [1, 2, 3]
+        assert 2 not in cache and 1 in cache and 3 in cache
+        stats = cache.stats()
+        assert stats['hits'] == 2
+        assert stats['misses'] == 3
+        assert stats['evictions'] == 1
+
+    async def test_concurrent_misses_share_one_load(self):
+        cache = LRUCache("test")
+        calls = []
+
+        async def loader(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return "valor"
+
+        results = await asyncio.gather(*(cache.get("k", loader) for _ in range(5)))
+        assert results == ["valor"] * 5
+        assert calls == ["k"]
+
+    async def test_stale_value_served_while_revalidating(self):
+        cache = LRUCache("test", ttl=0, stale_ttl=60)
+        version = {"n": 1}
+
+        async def loader(key):
+            return version["n"]
+
+        assert await cache.get("k", loader) == 1
+        version["n"] = 2
+        # Devuelve el valor viejo al instante y recarga en segundo plano
+        assert await cache.get("k", loader) == 1
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert cache.peek("k") == 2
+        assert cache.stats()['stale_hits'] == 1
+
+    async def test_invalidation_during_load_is_not_overwritten(self):
+        cache = LRUCache("test")
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def loader(key):
+            started.set()
+            await release.wait()
+            return "viejo"
+
+        task = asyncio.create_task(cache.get("k", loader))
+        await started.wait()
+        cache.invalidate("k")
+        release.set()
+        assert await task == "viejo"
+        assert "k" not in cache
+
+class TestSettingsCache:
+    async def test_settings_served_from_cache_until_invalidated(self):
+        await db.get_cached_server_settings(777)
+        misses = db._settings_cache.misses
+        await db.get_cached_server_settings(777)
+        assert db._settings_cache.misses == misses
+
+        await db.execute("UPDATE server_settings SET prefix = ? WHERE guild_id = ?", ("?", 777))
+        settings = await db.get_cached_server_settings(777)
+        assert settings['prefix'] == "?"
+        assert any(s['name'] == 'server_settings' for s in db.get_cache_stats())
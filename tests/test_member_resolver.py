@@ -0,0 +1,37 @@
+"""Tests de la resolución de nombres de miembros para rankings."""
+import pytest
+from utils import member_resolver
+from tests.conftest import MockGuild, MockMember
+
+
+@pytest.fixture(autouse=True)
+def clear_names():
+    member_resolver._name_cache.clear()
+    yield
+
+
+class TestMemberResolver:
+    async def test_cache_then_one_gateway_query(self, mock_bot):
+        guild = MockGuild(4242, "G")
+        guild._members[1] = MockMember(1, "Local", guild)
+        guild._gateway_members[2] = MockMember(2, "Remoto", guild)
+        guild._gateway_members[3] = MockMember(3, "Remoto2", guild)
+
+        names = await member_resolver.resolve_display_names(mock_bot, guild, [1, 2, 3, 4])
+        assert names[1] == "Local"
+        assert names[2] == "Remoto" and names[3] == "Remoto2"
+        assert names[4] == "Usuario (4)"
+        # Una sola petición al gateway para todos los que faltaban
+        assert guild.member_queries == [[2, 3, 4]]
+
+        # La segunda vez sale todo de la caché de nombres salvo el que no se encontró
+        names = await member_resolver.resolve_display_names(mock_bot, guild, [1, 2, 3])
+        assert names[2] == "Remoto"
+        assert len(guild.member_queries) == 1
+
+    async def test_chunked_guild_skips_gateway(self, mock_bot):
+        guild = MockGuild(4243, "G")
+        guild.chunked = True
+        names = await member_resolver.resolve_display_names(mock_bot, guild, [7])
+        assert names[7] == "Usuario (7)"
+        assert guild.member_queries == []
@@ -0,0 +1,142 @@
+"""Tests para el pipeline de mensajes (automod → XP → TTS → comandos)."""
+import itertools
+
+import pytest
+
+from cogs.leveling import LevelingCog
+from cogs.moderation import ModerationCog
+from utils import database_manager as db
+from utils.message_pipeline import STAGE_AUTOMOD, STAGE_COMMANDS, STAGE_LEVELING, STAGE_TTS, MessagePipeline
+from tests.conftest import MockGuild, MockMember
+
+_ids = itertools.count(700000)
+
+class PipelineMessage:
+    def __init__(self, content, guild_id=12345, user_id=999):
+        self.id = next(_ids)
+        self.guild = MockGuild(guild_id, "TestGuild")
+        self.author = MockMember(user_id, "TestUser", self.guild)
+        self.content = content
+        self.clean_content = content
+        self.deleted = False
+        self.sent = []
+        self.channel = type('Ch', (), {'id': 111, 'mention': '#general', 'send': self._send})()
+
+    async def _send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+
+    async def delete(self):
+        self.deleted = True
+
+def recorder(calls, name, stop=False):
+    async def _stage(message, context):
+        calls.append(name)
+        return stop
+    return _stage
+
+@pytest.fixture
+def level_cog(mock_bot):
+    cog = LevelingCog(mock_bot)
+    yield cog
+    cog.ledger.close()
+
+class TestPipeline:
+    async def test_stages_run_in_order_with_one_settings_lookup(self, monkeypatch):
+        lookups = []
+        real = db.get_cached_server_settings
+        async def counting(guild_id):
+            lookups.append(guild_id)
+            return await real(guild_id)
+        monkeypatch.setattr(db, "get_cached_server_settings", counting)
+
+        pipeline, calls = MessagePipeline(), []
+        # Registradas desordenadas: manda el orden, no el momento del registro
+        pipeline.register('commands', recorder(calls, 'commands'), STAGE_COMMANDS)
+        pipeline.register('tts', recorder(calls, 'tts'), STAGE_TTS)
+        pipeline.register('automod', recorder(calls, 'automod'), STAGE_AUTOMOD)
+        pipeline.register('leveling', recorder(calls, 'leveling'), STAGE_LEVELING)
+
+        context = await pipeline.run(PipelineMessage("hola"))
+        assert calls == ['automod', 'leveling', 'tts', 'commands']
+        assert lookups == [12345]
+        assert context.stopped_by is None and context.prefix == '!'
+
+    async def test_stop_short_circuits_later_stages(self):
+        pipeline, calls = MessagePipeline(), []
+        pipeline.register('automod', recorder(calls, 'automod', stop=True), STAGE_AUTOMOD)
+        pipeline.register('leveling', recorder(calls, 'leveling'), STAGE_LEVELING)
+        context = await pipeline.run(PipelineMessage("hola"))
+        assert calls == ['automod'] and context.stopped_by == 'automod'
+        stats = {s['stage']: s for s in pipeline.stats()}
+        assert stats['automod']['stops'] == 1 and stats['leveling']['calls'] == 0
+        assert stats['context']['calls'] == 1
+
+    async def test_failing_stage_does_not_stop_the_rest(self):
+        pipeline, calls = MessagePipeline(), []
+        async def broken(message, context):
+            raise RuntimeError("boom")
+        pipeline.register('broken', broken, STAGE_AUTOMOD)
+        pipeline.register('leveling', recorder(calls, 'leveling'), STAGE_LEVELING)
+        await pipeline.run(PipelineMessage("hola"))
+        assert calls == ['leveling']
+        stats = {s['stage']: s for s in pipeline.stats()}
+        assert stats['broken']['errors'] == 1 and stats['broken']['calls'] == 1
+
+    async def test_context_is_available_only_while_processing(self):
+        pipeline, seen = MessagePipeline(), []
+        message = PipelineMessage("hola")
+        async def stage(msg, context):
+            seen.append(pipeline.context_for(msg))
+        pipeline.register('commands', stage, STAGE_COMMANDS)
+        context = await pipeline.run(message)
+        assert seen == [context]
+        assert pipeline.context_for(message) is None
+
+    async def test_bots_are_ignored(self):
+        pipeline, calls = MessagePipeline(), []
+        pipeline.register('commands', recorder(calls, 'commands'), STAGE_COMMANDS)
+        message = PipelineMessage("hola")
+        message.author.bot = True
+        assert await pipeline.run(message) is None and calls == []
+
+class TestContext:
+    async def test_tts_config_follows_writes(self):
+        pipeline = MessagePipeline()
+        assert (await pipeline.run(PipelineMessage("hola"))).tts_channel_id is None
+        await db.execute("REPLACE INTO tts_active_channels (guild_id, text_channel_id) VALUES (?, ?)", (12345, 111))
+        await db.execute("REPLACE INTO tts_guild_settings (guild_id, lang) VALUES (?, ?)", (12345, 'ja'))
+        context = await pipeline.run(PipelineMessage("hola"))
+        assert context.tts_channel_id == 111 and context.tts_lang == 'ja'
+
+    async def test_tts_disabled_skips_tts_lookup(self, monkeypatch):
+        await db.execute("UPDATE server_settings SET tts_enabled = 0 WHERE guild_id = ?", (12345,))
+        async def fail(guild_id):
+            raise AssertionError("no debería consultarse")
+        monkeypatch.setattr(db, "get_tts_config", fail)
+        context = await MessagePipeline().run(PipelineMessage("hola"))
+        assert not context.tts_enabled
+
+class TestStages:
+    async def test_automod_blocks_xp(self, mock_bot, level_cog):
+        await db.execute("UPDATE server_settings SET automod_banned_words = ?, leveling_enabled = 1 WHERE guild_id = ?", ("Spoiler,", 12345))
+        pipeline = mock_bot.message_pipeline
+        pipeline.register('automod', ModerationCog(mock_bot).automod_stage, STAGE_AUTOMOD)
+        pipeline.register('leveling', level_cog.leveling_stage, STAGE_LEVELING)
+
+        message = PipelineMessage("esto es un SPOILER")
+        context = await pipeline.run(message)
+        assert message.deleted and context.stopped_by == 'automod'
+        assert message.sent[0][1].get('delete_after') == 10
+        assert await level_cog.ledger.get(12345, 999) == (1, 0)
+
+        context = await pipeline.run(PipelineMessage("mensaje normal"))
+        assert context.stopped_by is None
+        assert (await level_cog.ledger.get(12345, 999))[1] > 0
+
+    async def test_blacklisted_user_gets_no_xp(self, mock_bot, level_cog):
+        await db.execute("UPDATE server_settings SET leveling_enabled = 1 WHERE guild_id = ?", (12345,))
+        await db.add_to_blacklist(999, 'user', 'spam')
+        mock_bot.message_pipeline.register('leveling', level_cog.leveling_stage, STAGE_LEVELING)
+        context = await mock_bot.message_pipeline.run(PipelineMessage("hola"))
+        assert context.blacklisted
+        assert await level_cog.ledger.get(12345, 999) == (1, 0)
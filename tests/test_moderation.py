@@ -61,6 +61,7 @@ class TestWarnings:
 class TestModLogs:
     async def test_warn_creates_mod_log(self, mod_cog, mock_ctx, mock_target):
         await mod_cog.warn.callback(mod_cog, mock_ctx, mock_target, razon="Test log")
+        await db.flush_log_buffer()  # mod_logs se escribe de forma diferida
         logs = await db.fetchall(
             "SELECT * FROM mod_logs WHERE guild_id = ? AND user_id = ?",
             (mock_ctx.guild.id, mock_target.id)
@@ -2,7 +2,19 @@ import sqlite3
 import asyncio
 import threading
 import datetime
-from typing import Optional, Any, List, Dict
+import pathlib
+import queue
+import re
+import string
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Any, List, Dict, Callable, Tuple, Union
+
+from utils import economy_analytics, economy_ledger
+from utils.leveling_math import DEFAULT_CURVE, LevelCurve
+from utils.lru_cache import LRUCache
+from utils.query_metrics import metrics as query_metrics, normalize_sql
 
 import os
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -13,238 +25,753 @@ if os.environ.get("BOT_TEST_DB"):
 else:
     DB_FILE = os.path.join(PROJECT_ROOT, "bot_data.db")
 
-# Conexión persistente y bloqueo para evitar corrupción
-_conn = None
+# Número de conexiones de solo lectura del pool (lecturas concurrentes)
+READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", "4"))
+
+# Bloqueo de la conexión de escritura (solo compiten el hilo escritor y el código síncrono de arranque)
 _db_lock = threading.Lock()
 
+def _is_memory_db(db_file: str) -> bool:
+    return db_file == ":memory:" or "mode=memory" in db_file
+
+def _row_count(result: Any) -> int:
+    if isinstance(result, int) and not isinstance(result, bool):
+        return max(result, 0)
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 0 if result is None else 1
+
+def _timed(fn: Callable[[sqlite3.Connection], Any], conn: sqlite3.Connection, query: Optional[str], queue_wait: float, started: float) -> Any:
+    """Llama a fn(conn) (con el bloqueo ya tomado) y registra cola, espera de bloqueo y ejecución."""
+    if query is None:
+        return fn(conn)
+    acquired = time.perf_counter()
+    try:
+        result = fn(conn)
+    except Exception:
+        query_metrics.record(query, queue_wait, acquired - started, time.perf_counter() - acquired, error=True)
+        raise
+    query_metrics.record(query, queue_wait, acquired - started, time.perf_counter() - acquired, _row_count(result))
+    return result
+
+class ConnectionManager:
+    """Conexión de escritura en un hilo dedicado + pool de conexiones de solo lectura (modo WAL).
+
+    Las lecturas nunca esperan al escritor: en WAL cada lector ve la última
+    transacción confirmada. Con una base de datos en memoria (tests) no se pueden
+    abrir conexiones adicionales que compartan los datos, así que en ese caso las
+    lecturas se sirven desde la conexión de escritura.
+    """
+
+    def __init__(self, db_file: str, read_pool_size: int = READ_POOL_SIZE):
+        self.db_file = db_file
+        self.read_pool_size = 0 if _is_memory_db(db_file) else max(0, read_pool_size)
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._writer_executor: Optional[ThreadPoolExecutor] = None
+        self._reader_executor: Optional[ThreadPoolExecutor] = None
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all_readers: List[sqlite3.Connection] = []
+        self._pool_lock = threading.Lock()
+        self._watch_conn: Optional[sqlite3.Connection] = None
+        self._watch_lock = threading.Lock()
+
+    def writer(self) -> sqlite3.Connection:
+        """Devuelve (y abre si hace falta) la conexión de escritura persistente."""
+        with self._pool_lock:
+            if self._writer_conn is None:
+                conn = sqlite3.connect(self.db_file, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA busy_timeout = 5000")
+                if not _is_memory_db(self.db_file):
+                    conn.execute("PRAGMA journal_mode = WAL")
+                    conn.execute("PRAGMA synchronous = NORMAL")
+                self._writer_conn = conn
+            return self._writer_conn
+
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = pathlib.Path(self.db_file).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if len(self._all_readers) < self.read_pool_size:
+                conn = self._open_reader()
+                self._all_readers.append(conn)
+                return conn
+        return self._readers.get()
+
+    def _get_executor(self, kind: str) -> ThreadPoolExecutor:
+        with self._pool_lock:
+            if kind == "writer":
+                if self._writer_executor is None:
+                    self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+                return self._writer_executor
+            if self._reader_executor is None:
+                self._reader_executor = ThreadPoolExecutor(max_workers=self.read_pool_size, thread_name_prefix="db-reader")
+            return self._reader_executor
+
+    async def run_write(self, fn: Callable[[sqlite3.Connection], Any], query: Optional[str] = None) -> Any:
+        """Ejecuta fn(conn) en el hilo escritor, con la conexión de escritura.
+
+        Si se indica `query`, se registran sus tiempos (cola, bloqueo, ejecución) en query_metrics.
+        """
+        submitted = time.perf_counter()
+        def _job():
+            started = time.perf_counter()
+            conn = self.writer()
+            with _db_lock:
+                return _timed(fn, conn, query, started - submitted, started)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor("writer"), _job)
+
+    async def run_read(self, fn: Callable[[sqlite3.Connection], Any], query: Optional[str] = None) -> Any:
+        """Ejecuta fn(conn) en el pool de lectura con una conexión de solo lectura."""
+        if self.read_pool_size == 0:
+            return await self.run_write(fn, query)
+        # El fichero (y el modo WAL) los crea la conexión de escritura
+        self.writer()
+        submitted = time.perf_counter()
+        def _job():
+            started = time.perf_counter()
+            conn = self._acquire_reader()
+            try:
+                return _timed(fn, conn, query, started - submitted, started)
+            finally:
+                self._readers.put(conn)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor("reader"), _job)
+
+    def _sync_data_version(self) -> int:
+        with self._watch_lock:
+            if self._watch_conn is None:
+                self._watch_conn = self._open_reader()
+            return self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    async def data_version(self) -> Optional[int]:
+        """PRAGMA data_version de una conexión dedicada: cambia cuando otra conexión confirma una escritura.
+
+        Devuelve None con bases de datos en memoria, que no se comparten entre conexiones.
+        """
+        if self.read_pool_size == 0:
+            return None
+        self.writer()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor("reader"), self._sync_data_version)
+
+    def close(self):
+        """Espera a que terminen las tareas pendientes y cierra todas las conexiones."""
+        with self._pool_lock:
+            executors = [e for e in (self._reader_executor, self._writer_executor) if e]
+            self._reader_executor = self._writer_executor = None
+        for executor in executors:
+            executor.shutdown(wait=True)
+        with self._pool_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers.clear()
+            self._readers = queue.LifoQueue()
+            with self._watch_lock:
+                if self._watch_conn:
+                    self._watch_conn.close()
+                    self._watch_conn = None
+            if self._writer_conn:
+                self._writer_conn.close()
+                self._writer_conn = None
+
+_manager = ConnectionManager(DB_FILE)
+
 def get_connection():
-    """Obtiene o crea una conexión persistente a la base de datos."""
-    global _conn
-    if _conn is None:
-        _conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-        _conn.row_factory = sqlite3.Row
-    return _conn
-
-def run_migrations(conn):
-    """Añade columnas faltantes a las tablas existentes."""
+    """Obtiene la conexión de escritura persistente (la de solo lectura vive en el pool)."""
+    return _manager.writer()
+
+# --- Migraciones versionadas ---
+# Cada migración se aplica una sola vez, dentro de su propia transacción, y la
+# versión alcanzada se guarda en PRAGMA user_version. Para cambiar el esquema se
+# añade una función nueva con @migration(<siguiente versión>, "descripción").
+MIGRATIONS: List[tuple] = []
+
+def migration(version: int, description: str):
+    """Registra una función de migración para la versión indicada."""
+    def decorator(fn: Callable[[sqlite3.Connection], None]):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return decorator
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """Añade una columna si no existe (las columnas generadas deben ser VIRTUAL)."""
+    if column not in _table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _create_index(conn: sqlite3.Connection, name: str, table: str, columns: str, where: str = ""):
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}){' WHERE ' + where if where else ''}")
+
+def _rebuild_table(conn: sqlite3.Connection, table: str, create_sql: str, columns: Optional[List[str]] = None):
+    """Reconstruye una tabla con un nuevo esquema (para cambios que ALTER TABLE no permite).
+
+    create_sql debe crear la tabla con el nombre `{table}__new`; se copian las
+    columnas indicadas (por defecto, las comunes a ambos esquemas). Los índices de
+    la tabla antigua se pierden y la migración debe volver a crearlos.
+    """
+    conn.execute(f"DROP TABLE IF EXISTS {table}__new")
+    conn.execute(create_sql)
+    if columns is None:
+        new_columns = set(_table_columns(conn, f"{table}__new"))
+        columns = [c for c in _table_columns(conn, table) if c in new_columns]
+    column_list = ", ".join(columns)
+    conn.execute(f"INSERT INTO {table}__new ({column_list}) SELECT {column_list} FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {table}__new RENAME TO {table}")
+
+def run_migrations(conn: sqlite3.Connection):
+    """Aplica en orden las migraciones con versión mayor que PRAGMA user_version."""
+    current = get_schema_version(conn)
+    for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        print(f"MIGRACIÓN {version}: {description}...")
+        try:
+            conn.execute("BEGIN")
+            fn(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Error durante la migración {version} ({description}): {e}")
+            raise
+        current = version
+
+@migration(1, "esquema base")
+def _migration_base_schema(conn: sqlite3.Connection):
+    """Tablas originales más las columnas que antes se añadían comparando PRAGMA table_info en cada arranque."""
     cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS server_settings (
+        guild_id INTEGER PRIMARY KEY, welcome_channel_id INTEGER, goodbye_channel_id INTEGER, 
+        log_channel_id INTEGER, autorole_id INTEGER, welcome_message TEXT, welcome_banner_url TEXT, 
+        goodbye_message TEXT, goodbye_banner_url TEXT, automod_anti_invite INTEGER DEFAULT 1, 
+        automod_banned_words TEXT, temp_channel_creator_id INTEGER, leveling_enabled INTEGER DEFAULT 1,
+        welcome_title_color TEXT DEFAULT '#000000', welcome_subtitle_color TEXT DEFAULT '#000000',
+        goodbye_title_color TEXT DEFAULT '#000000', goodbye_subtitle_color TEXT DEFAULT '#000000',
+        welcome_top_text TEXT, goodbye_top_text TEXT,
+        prefix TEXT DEFAULT '!', language TEXT DEFAULT 'es',
+        mod_enabled INTEGER DEFAULT 1, eco_enabled INTEGER DEFAULT 1,
+        gamble_enabled INTEGER DEFAULT 1, tickets_enabled INTEGER DEFAULT 1,
+        music_enabled INTEGER DEFAULT 1, tts_enabled INTEGER DEFAULT 1,
+        ticket_category_id INTEGER, ticket_log_channel_id INTEGER,
+        confessions_channel_id INTEGER, ticket_panel_channel_id INTEGER,
+        ticket_panel_title TEXT, ticket_panel_desc TEXT,
+        ticket_welcome_title TEXT, ticket_welcome_desc TEXT,
+        confessions_panel_title TEXT, confessions_panel_desc TEXT,
+        rr_enabled INTEGER DEFAULT 1, utility_enabled INTEGER DEFAULT 1
+    )''')
     
-    # Migraciones de base de datos para añadir columnas nuevas
-    try:
-        cursor.execute("PRAGMA table_info(economy_settings)")
-        columns = [row[1] for row in cursor.fetchall()]
-        
-        expected_columns = {
-            "daily_min": "INTEGER DEFAULT 100", "daily_max": "INTEGER DEFAULT 500",
-            "work_min": "INTEGER DEFAULT 50", "work_max": "INTEGER DEFAULT 250",
-            "work_cooldown": "INTEGER DEFAULT 3600", "rob_cooldown": "INTEGER DEFAULT 21600"
-        }
-        for col, definition in expected_columns.items():
-            if col not in columns:
-                cursor.execute(f"ALTER TABLE economy_settings ADD COLUMN {col} {definition}")
-        
-        # Migración para broadcast_queue
-        cursor.execute("PRAGMA table_info(broadcast_queue)")
-        b_cols = [row[1] for row in cursor.fetchall()]
-        if 'type' not in b_cols:
-            cursor.execute("ALTER TABLE broadcast_queue ADD COLUMN type TEXT DEFAULT 'broadcast'")
-            
-        # Migración para bot_guilds (dueños e invitados)
-        cursor.execute("PRAGMA table_info(bot_guilds)")
-        bg_cols = [row[1] for row in cursor.fetchall()]
-        if 'owner_id' not in bg_cols:
-            cursor.execute("ALTER TABLE bot_guilds ADD COLUMN owner_id INTEGER")
-        if 'owner_name' not in bg_cols:
-            cursor.execute("ALTER TABLE bot_guilds ADD COLUMN owner_name TEXT")
-        if 'inviter_id' not in bg_cols:
-            cursor.execute("ALTER TABLE bot_guilds ADD COLUMN inviter_id INTEGER")
-        if 'inviter_name' not in bg_cols:
-            cursor.execute("ALTER TABLE bot_guilds ADD COLUMN inviter_name TEXT")
-        if 'inviter_avatar' not in bg_cols:
-            cursor.execute("ALTER TABLE bot_guilds ADD COLUMN inviter_avatar TEXT")
-        
-        for col_name, col_definition in expected_columns.items():
-            if col_name not in columns:
-                print(f"MIGRACIÓN: Añadiendo columna '{col_name}' a 'economy_settings'...")
-                cursor.execute(f"ALTER TABLE economy_settings ADD COLUMN {col_name} {col_definition}")
-    except sqlite3.Error as e:
-        print(f"Error durante la migración de 'economy_settings': {e}")
-
-    # --- Migración para la tabla server_settings ---
-    try:
-        cursor.execute("PRAGMA table_info(server_settings)")
-        columns = [row[1] for row in cursor.fetchall()]
-        
-        new_columns = {
-            "welcome_title_color": "TEXT DEFAULT '#000000'", "welcome_subtitle_color": "TEXT DEFAULT '#000000'",
-            "goodbye_title_color": "TEXT DEFAULT '#000000'", "goodbye_subtitle_color": "TEXT DEFAULT '#000000'",
-            "welcome_top_text": "TEXT", "goodbye_top_text": "TEXT",
-            "prefix": "TEXT DEFAULT '!'", "language": "TEXT DEFAULT 'es'",
-            "mod_enabled": "INTEGER DEFAULT 1", "eco_enabled": "INTEGER DEFAULT 1",
-            "gamble_enabled": "INTEGER DEFAULT 1", "tickets_enabled": "INTEGER DEFAULT 1",
-            "music_enabled": "INTEGER DEFAULT 1", "tts_enabled": "INTEGER DEFAULT 1",
-            "ticket_category_id": "INTEGER", "ticket_log_channel_id": "INTEGER",
-            "confessions_channel_id": "INTEGER", "ticket_panel_channel_id": "INTEGER",
-            "ticket_panel_title": "TEXT", "ticket_panel_desc": "TEXT",
-            "ticket_welcome_title": "TEXT", "ticket_welcome_desc": "TEXT",
-            "confessions_panel_title": "TEXT", "confessions_panel_desc": "TEXT",
-            "rr_enabled": "INTEGER DEFAULT 1", "utility_enabled": "INTEGER DEFAULT 1"
-        }
-        
-        for col_name, col_definition in new_columns.items():
-            if col_name not in columns:
-                print(f"MIGRACIÓN: Añadiendo columna '{col_name}' a 'server_settings'...")
-                cursor.execute(f"ALTER TABLE server_settings ADD COLUMN {col_name} {col_definition}")
-    except sqlite3.Error as e:
-        print(f"Error durante la migración de 'server_settings': {e}")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS balances (guild_id INTEGER, user_id INTEGER, wallet INTEGER DEFAULT 0, bank INTEGER DEFAULT 0, PRIMARY KEY (guild_id, user_id))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS economy_settings (guild_id INTEGER PRIMARY KEY, currency_name TEXT DEFAULT 'créditos', currency_emoji TEXT DEFAULT '🪙', start_balance INTEGER DEFAULT 100, max_balance INTEGER, log_channel_id INTEGER, daily_min INTEGER DEFAULT 100, daily_max INTEGER DEFAULT 500, work_min INTEGER DEFAULT 50, work_max INTEGER DEFAULT 250, work_cooldown INTEGER DEFAULT 3600, rob_cooldown INTEGER DEFAULT 21600)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS levels (guild_id INTEGER, user_id INTEGER, level INTEGER DEFAULT 1, xp INTEGER DEFAULT 0, PRIMARY KEY (guild_id, user_id))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS role_rewards (guild_id INTEGER, level INTEGER, role_id INTEGER, PRIMARY KEY (guild_id, level))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS warnings (warning_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, user_id INTEGER, moderator_id INTEGER, reason TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS mod_logs (log_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, user_id INTEGER, moderator_id INTEGER, action TEXT, reason TEXT, duration TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS reaction_roles (guild_id INTEGER, message_id INTEGER, emoji TEXT, role_id INTEGER, PRIMARY KEY (guild_id, message_id, emoji))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS tts_guild_settings (guild_id INTEGER PRIMARY KEY, lang TEXT NOT NULL DEFAULT 'es')''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS tts_active_channels (guild_id INTEGER PRIMARY KEY, text_channel_id INTEGER NOT NULL)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS shop_items (item_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, name TEXT COLLATE NOCASE, description TEXT, price INTEGER, type TEXT, raw_data TEXT)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS inventory (guild_id INTEGER, user_id INTEGER, item_id INTEGER, quantity INTEGER DEFAULT 1, PRIMARY KEY (guild_id, user_id, item_id))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS gacha_collection (guild_id INTEGER, user_id INTEGER, character_name TEXT, rarity TEXT, image_url TEXT)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS gambling_active_channels (guild_id INTEGER, channel_id INTEGER, PRIMARY KEY (guild_id, channel_id))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS economy_active_channels (guild_id INTEGER, channel_id INTEGER, PRIMARY KEY (guild_id, channel_id))''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS user_feedback (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT, subject TEXT, description TEXT, priority TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS global_blacklist (discord_id INTEGER PRIMARY KEY, entity_type TEXT NOT NULL, reason TEXT, date_added DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS broadcast_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL, type TEXT DEFAULT 'broadcast', status TEXT DEFAULT 'pending', date_added DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS bot_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        level TEXT NOT NULL,
+        category TEXT NOT NULL,
+        message TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS bot_guilds (
+        guild_id INTEGER PRIMARY KEY,
+        name TEXT,
+        member_count INTEGER,
+        icon_url TEXT,
+        owner_id INTEGER,
+        owner_name TEXT,
+        inviter_id INTEGER,
+        inviter_name TEXT,
+        inviter_avatar TEXT,
+        joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_active INTEGER DEFAULT 1
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS global_command_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER,
+        guild_name TEXT,
+        user_id INTEGER,
+        user_name TEXT,
+        command_name TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS admin_audit_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        user_name TEXT,
+        action TEXT,
+        target_id TEXT,
+        details TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS user_cooldowns (
+        guild_id INTEGER,
+        user_id INTEGER,
+        command_name TEXT,
+        last_use TEXT,
+        PRIMARY KEY (guild_id, user_id, command_name)
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS dashboard_users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        avatar TEXT,
+        last_login DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    # Bases de datos anteriores al sistema de versiones pueden no tener estas columnas
+    economy_columns = {
+        "daily_min": "INTEGER DEFAULT 100", "daily_max": "INTEGER DEFAULT 500",
+        "work_min": "INTEGER DEFAULT 50", "work_max": "INTEGER DEFAULT 250",
+        "work_cooldown": "INTEGER DEFAULT 3600", "rob_cooldown": "INTEGER DEFAULT 21600"
+    }
+    for col_name, col_definition in economy_columns.items():
+        _add_column(conn, "economy_settings", col_name, col_definition)
+
+    _add_column(conn, "broadcast_queue", "type", "TEXT DEFAULT 'broadcast'")
+
+    for col_name, col_definition in {"owner_id": "INTEGER", "owner_name": "TEXT", "inviter_id": "INTEGER",
+                                     "inviter_name": "TEXT", "inviter_avatar": "TEXT"}.items():
+        _add_column(conn, "bot_guilds", col_name, col_definition)
 
-    conn.commit()
+    server_columns = {
+        "welcome_title_color": "TEXT DEFAULT '#000000'", "welcome_subtitle_color": "TEXT DEFAULT '#000000'",
+        "goodbye_title_color": "TEXT DEFAULT '#000000'", "goodbye_subtitle_color": "TEXT DEFAULT '#000000'",
+        "welcome_top_text": "TEXT", "goodbye_top_text": "TEXT",
+        "prefix": "TEXT DEFAULT '!'", "language": "TEXT DEFAULT 'es'",
+        "mod_enabled": "INTEGER DEFAULT 1", "eco_enabled": "INTEGER DEFAULT 1",
+        "gamble_enabled": "INTEGER DEFAULT 1", "tickets_enabled": "INTEGER DEFAULT 1",
+        "music_enabled": "INTEGER DEFAULT 1", "tts_enabled": "INTEGER DEFAULT 1",
+        "ticket_category_id": "INTEGER", "ticket_log_channel_id": "INTEGER",
+        "confessions_channel_id": "INTEGER", "ticket_panel_channel_id": "INTEGER",
+        "ticket_panel_title": "TEXT", "ticket_panel_desc": "TEXT",
+        "ticket_welcome_title": "TEXT", "ticket_welcome_desc": "TEXT",
+        "confessions_panel_title": "TEXT", "confessions_panel_desc": "TEXT",
+        "rr_enabled": "INTEGER DEFAULT 1", "utility_enabled": "INTEGER DEFAULT 1"
+    }
+    for col_name, col_definition in server_columns.items():
+        _add_column(conn, "server_settings", col_name, col_definition)
+
+@migration(2, "índices para las consultas de cogs y dashboard")
+def _migration_query_indexes(conn: sqlite3.Connection):
+    # Logs globales ordenados por fecha (dashboard de administración)
+    _create_index(conn, "idx_global_command_logs_timestamp", "global_command_logs", "timestamp")
+    _create_index(conn, "idx_bot_logs_timestamp", "bot_logs", "timestamp")
+    _create_index(conn, "idx_admin_audit_logs_timestamp", "admin_audit_logs", "timestamp")
+    # Historial de moderación y advertencias de un usuario
+    _create_index(conn, "idx_mod_logs_guild_user", "mod_logs", "guild_id, user_id, timestamp")
+    _create_index(conn, "idx_warnings_guild_user", "warnings", "guild_id, user_id, timestamp")
+    # Colección gacha de un usuario
+    _create_index(conn, "idx_gacha_collection_guild_user", "gacha_collection", "guild_id, user_id")
+    # Servidores activos ordenados por miembros
+    _create_index(conn, "idx_bot_guilds_active", "bot_guilds", "is_active, member_count DESC")
+    _create_index(conn, "idx_global_blacklist_date", "global_blacklist", "date_added")
+    # Tienda ordenada por precio en el dashboard
+    _create_index(conn, "idx_shop_items_guild_price", "shop_items", "guild_id, price")
+    # Rankings de niveles y economía, y conteo de usuarios únicos
+    _create_index(conn, "idx_levels_guild_rank", "levels", "guild_id, level DESC, xp DESC")
+    _create_index(conn, "idx_levels_user", "levels", "user_id")
+    _create_index(conn, "idx_balances_guild_net", "balances", "guild_id, (wallet + bank) DESC")
+    # Cola de tareas del dashboard pendientes
+    _create_index(conn, "idx_broadcast_queue_status", "broadcast_queue", "status, id")
+
+@migration(3, "registro de invalidaciones de caché entre procesos")
+def _migration_cache_invalidations(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS cache_invalidations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        cache_key INTEGER,
+        origin TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    _create_index(conn, "idx_cache_invalidations_created", "cache_invalidations", "created_at")
+
+@migration(4, "agregados horarios de comandos para compactar los logs")
+def _migration_command_rollups(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS command_stats_hourly (
+        hour TEXT NOT NULL,
+        guild_id INTEGER NOT NULL,
+        command_name TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, guild_id, command_name)
+    )''')
+    # Hasta dónde (hora exclusiva) se ha agregado cada tabla de logs
+    conn.execute('''CREATE TABLE IF NOT EXISTS rollup_state (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )''')
+
+@migration(5, "XP total acumulado en levels y curva de niveles por servidor")
+def _migration_levels_total_xp(conn: sqlite3.Connection):
+    _add_column(conn, "levels", "total_xp", "INTEGER NOT NULL DEFAULT 0")
+    # Hasta ahora solo existía la curva por defecto
+    conn.create_function("_total_for_level", 1, DEFAULT_CURVE.total_for_level, deterministic=True)
+    conn.execute("UPDATE levels SET total_xp = _total_for_level(COALESCE(level, 1)) + COALESCE(xp, 0)")
+    _create_index(conn, "idx_levels_guild_total", "levels", "guild_id, total_xp DESC")
+    conn.execute("DROP INDEX IF EXISTS idx_levels_guild_rank")
+    for name, default in zip(LevelCurve._fields, DEFAULT_CURVE):
+        _add_column(conn, "server_settings", f"xp_curve_{name}", f"INTEGER DEFAULT {default}")
+
+@migration(6, "net_worth generado e índices de ranking")
+def _migration_leaderboard_indexes(conn: sqlite3.Connection):
+    # Columna generada VIRTUAL: no ocupa espacio en la fila, pero se puede indexar
+    _add_column(conn, "balances", "net_worth", "INTEGER GENERATED ALWAYS AS (wallet + bank) VIRTUAL")
+    conn.execute("DROP INDEX IF EXISTS idx_balances_guild_net")
+    conn.execute("DROP INDEX IF EXISTS idx_levels_guild_total")
+    # user_id desempata y hace que los índices cubran las consultas de ranking
+    _create_index(conn, "idx_balances_guild_net_worth", "balances", "guild_id, net_worth DESC, user_id")
+    _create_index(conn, "idx_levels_guild_total_xp", "levels", "guild_id, total_xp DESC, user_id")
+
+@migration(7, "libro mayor de movimientos de economía")
+def _migration_economy_ledger(conn: sqlite3.Connection):
+    # Solo inserciones: la suma de los movimientos de un usuario es su balance
+    conn.execute('''CREATE TABLE IF NOT EXISTS economy_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        delta_wallet INTEGER NOT NULL DEFAULT 0,
+        delta_bank INTEGER NOT NULL DEFAULT 0,
+        reason TEXT NOT NULL,
+        ref TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )''')
+    _create_index(conn, "idx_economy_ledger_guild_user", "economy_ledger", "guild_id, user_id, id")
+    # Los balances existentes entran como saldo de apertura
+    conn.execute('''INSERT INTO economy_ledger (guild_id, user_id, delta_wallet, delta_bank, reason)
+                    SELECT guild_id, user_id, wallet, bank, 'apertura' FROM balances
+                    WHERE wallet != 0 OR bank != 0''')
+
+@migration(8, "tareas periódicas de economía por servidor")
+def _migration_economy_jobs(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS economy_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        rate REAL NOT NULL,
+        threshold INTEGER NOT NULL DEFAULT 0,
+        interval_hours INTEGER NOT NULL DEFAULT 24,
+        next_run TEXT NOT NULL,
+        last_run TEXT,
+        UNIQUE (guild_id, kind)
+    )''')
+    _create_index(conn, "idx_economy_jobs_next_run", "economy_jobs", "next_run")
+
+@migration(9, "instantáneas de la economía e índice cubridor de balances")
+def _migration_economy_snapshots(conn: sqlite3.Connection):
+    # La analítica recorre los balances de un servidor sin tocar la tabla (ver utils/economy_analytics.py)
+    _create_index(conn, "idx_balances_guild_cover", "balances", "guild_id, user_id, wallet, bank")
+    conn.execute('''CREATE TABLE IF NOT EXISTS economy_snapshots (
+        guild_id INTEGER NOT NULL,
+        taken_at INTEGER NOT NULL,
+        users INTEGER NOT NULL,
+        money_supply INTEGER NOT NULL,
+        bank_total INTEGER NOT NULL,
+        top1_share REAL NOT NULL,
+        gini REAL NOT NULL,
+        PRIMARY KEY (guild_id, taken_at)
+    ) WITHOUT ROWID''')
+
+@migration(10, "leases y reintentos en broadcast_queue")
+def _migration_task_leases(conn: sqlite3.Connection):
+    # Tiempos en segundos epoch (REAL): available_at para los reintentos diferidos, lease_expires para los leases
+    for col_name, col_definition in {
+        "attempts": "INTEGER DEFAULT 0", "max_attempts": "INTEGER DEFAULT 3",
+        "available_at": "REAL DEFAULT 0", "lease_owner": "TEXT", "lease_expires": "REAL",
+        "last_error": "TEXT", "finished_at": "DATETIME",
+    }.items():
+        _add_column(conn, "broadcast_queue", col_name, col_definition)
+    # Lo que quedó en 'processing' antes de los leases no se sabe si llegó a ejecutarse: no se repite
+    conn.execute("UPDATE broadcast_queue SET status = 'failed', last_error = 'interrumpida (anterior a los leases)' WHERE status = 'processing'")
+    _create_index(conn, "idx_broadcast_queue_due", "broadcast_queue", "status, available_at")
+
+@migration(11, "entregas por servidor de los anuncios globales")
+def _migration_broadcast_deliveries(conn: sqlite3.Connection):
+    # Resultado final por servidor (sent, skipped, failed): permite reanudar un anuncio sin repetirlo
+    conn.execute('''CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        task_id INTEGER NOT NULL,
+        guild_id INTEGER NOT NULL,
+        channel_id INTEGER,
+        status TEXT NOT NULL,
+        error TEXT,
+        delivered_at REAL NOT NULL,
+        PRIMARY KEY (task_id, guild_id)
+    ) WITHOUT ROWID''')
+    _add_column(conn, "broadcast_queue", "progress_total", "INTEGER")
 
 def setup_database():
-    """Crea todas las tablas necesarias y abre la conexión inicial."""
+    """Abre la conexión inicial y aplica las migraciones pendientes."""
     conn = get_connection()
     with _db_lock:
-        cursor = conn.cursor()
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS server_settings (
-            guild_id INTEGER PRIMARY KEY, welcome_channel_id INTEGER, goodbye_channel_id INTEGER, 
-            log_channel_id INTEGER, autorole_id INTEGER, welcome_message TEXT, welcome_banner_url TEXT, 
-            goodbye_message TEXT, goodbye_banner_url TEXT, automod_anti_invite INTEGER DEFAULT 1, 
-            automod_banned_words TEXT, temp_channel_creator_id INTEGER, leveling_enabled INTEGER DEFAULT 1,
-            welcome_title_color TEXT DEFAULT '#000000', welcome_subtitle_color TEXT DEFAULT '#000000',
-            goodbye_title_color TEXT DEFAULT '#000000', goodbye_subtitle_color TEXT DEFAULT '#000000',
-            welcome_top_text TEXT, goodbye_top_text TEXT,
-            prefix TEXT DEFAULT '!', language TEXT DEFAULT 'es',
-            mod_enabled INTEGER DEFAULT 1, eco_enabled INTEGER DEFAULT 1,
-            gamble_enabled INTEGER DEFAULT 1, tickets_enabled INTEGER DEFAULT 1,
-            music_enabled INTEGER DEFAULT 1, tts_enabled INTEGER DEFAULT 1,
-            ticket_category_id INTEGER, ticket_log_channel_id INTEGER,
-            confessions_channel_id INTEGER, ticket_panel_channel_id INTEGER,
-            ticket_panel_title TEXT, ticket_panel_desc TEXT,
-            ticket_welcome_title TEXT, ticket_welcome_desc TEXT,
-            confessions_panel_title TEXT, confessions_panel_desc TEXT,
-            rr_enabled INTEGER DEFAULT 1, utility_enabled INTEGER DEFAULT 1
-        )''')
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS balances (guild_id INTEGER, user_id INTEGER, wallet INTEGER DEFAULT 0, bank INTEGER DEFAULT 0, PRIMARY KEY (guild_id, user_id))''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS economy_settings (guild_id INTEGER PRIMARY KEY, currency_name TEXT DEFAULT 'créditos', currency_emoji TEXT DEFAULT '🪙', start_balance INTEGER DEFAULT 100, max_balance INTEGER, log_channel_id INTEGER, daily_min INTEGER DEFAULT 100, daily_max INTEGER DEFAULT 500, work_min INTEGER DEFAULT 50, work_max INTEGER DEFAULT 250, work_cooldown INTEGER DEFAULT 3600, rob_cooldown INTEGER DEFAULT 21600)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS levels (guild_id INTEGER, user_id INTEGER, level INTEGER DEFAULT 1, xp INTEGER DEFAULT 0, PRIMARY KEY (guild_id, user_id))''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS role_rewards (guild_id INTEGER, level INTEGER, role_id INTEGER, PRIMARY KEY (guild_id, level))''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS warnings (warning_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, user_id INTEGER, moderator_id INTEGER, reason TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS mod_logs (log_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, user_id INTEGER, moderator_id INTEGER, action TEXT, reason TEXT, duration TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS reaction_roles (guild_id INTEGER, message_id INTEGER, emoji TEXT, role_id INTEGER, PRIMARY KEY (guild_id, message_id, emoji))''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS tts_guild_settings (guild_id INTEGER PRIMARY KEY, lang TEXT NOT NULL DEFAULT 'es')''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS tts_active_channels (guild_id INTEGER PRIMARY KEY, text_channel_id INTEGER NOT NULL)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS shop_items (item_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, name TEXT COLLATE NOCASE, description TEXT, price INTEGER, type TEXT, raw_data TEXT)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS inventory (guild_id INTEGER, user_id INTEGER, item_id INTEGER, quantity INTEGER DEFAULT 1, PRIMARY KEY (guild_id, user_id, item_id))''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS gacha_collection (guild_id INTEGER, user_id INTEGER, character_name TEXT, rarity TEXT, image_url TEXT)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS gambling_active_channels (guild_id INTEGER, channel_id INTEGER, PRIMARY KEY (guild_id, channel_id))''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS economy_active_channels (guild_id INTEGER, channel_id INTEGER, PRIMARY KEY (guild_id, channel_id))''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS user_feedback (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT, subject TEXT, description TEXT, priority TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS global_blacklist (discord_id INTEGER PRIMARY KEY, entity_type TEXT NOT NULL, reason TEXT, date_added DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS broadcast_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL, type TEXT DEFAULT 'broadcast', status TEXT DEFAULT 'pending', date_added DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS bot_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            level TEXT NOT NULL,
-            category TEXT NOT NULL,
-            message TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS bot_guilds (
-            guild_id INTEGER PRIMARY KEY,
-            name TEXT,
-            member_count INTEGER,
-            icon_url TEXT,
-            owner_id INTEGER,
-            owner_name TEXT,
-            inviter_id INTEGER,
-            inviter_name TEXT,
-            inviter_avatar TEXT,
-            joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            is_active INTEGER DEFAULT 1
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS global_command_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            guild_id INTEGER,
-            guild_name TEXT,
-            user_id INTEGER,
-            user_name TEXT,
-            command_name TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS admin_audit_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            user_name TEXT,
-            action TEXT,
-            target_id TEXT,
-            details TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS user_cooldowns (
-            guild_id INTEGER,
-            user_id INTEGER,
-            command_name TEXT,
-            last_use TEXT,
-            PRIMARY KEY (guild_id, user_id, command_name)
-        )''')
-        cursor.execute('''CREATE TABLE IF NOT EXISTS dashboard_users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            avatar TEXT,
-            last_login DATETIME DEFAULT CURRENT_TIMESTAMP
-        )''')
-
         run_migrations(conn)
-        conn.commit()
     print("Base de datos verificada y conexión persistente establecida.")
 
 def close_database():
-    """Cierra la conexión persistente."""
-    global _conn
-    if _conn:
-        _conn.close()
-        _conn = None
+    """Vuelca los logs pendientes y cierra la conexión de escritura y el pool de lectura."""
+    stop_change_watcher()
+    _log_buffer.drain_sync()
+    _manager.close()
 
-# Sistema de caché para configuraciones de servidores
-_settings_cache = {}
+# --- Bus de invalidación de cachés ---
+# Cada escritura publica la tabla y la clave (guild_id) que toca, declaradas con
+# `invalidates=` o deducidas de la propia sentencia, y las cachés se suscriben por
+# tabla para descartar solo esa clave (None = toda la tabla). Las escrituras sobre
+# tablas cacheadas se anotan además en cache_invalidations, en la misma transacción,
+# para que otros procesos que comparten la base de datos (bot y dashboard) se enteren.
+CACHED_TABLES = {'server_settings', 'economy_settings', 'bot_guilds', 'role_rewards'}
+INVALIDATION_POLL_INTERVAL = float(os.environ.get("DB_INVALIDATION_POLL_INTERVAL", "0.5"))
+
+_PROCESS_ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_invalidation_subscribers: Dict[str, List[Callable[[Optional[int]], None]]] = {}
+
+InvalidationTarget = Tuple[str, Optional[int]]
+
+def subscribe_invalidation(table: str, callback: Callable[[Optional[int]], None]):
+    """Registra callback(key) para las escrituras sobre `table`."""
+    CACHED_TABLES.add(table)
+    _invalidation_subscribers.setdefault(table, []).append(callback)
+
+def unsubscribe_invalidation(table: str, callback: Callable[[Optional[int]], None]):
+    callbacks = _invalidation_subscribers.get(table, [])
+    if callback in callbacks:
+        callbacks.remove(callback)
+
+def publish_invalidation(table: str, key: Optional[int] = None):
+    """Avisa a los suscriptores locales de que `key` (o toda la tabla si es None) cambió."""
+    for callback in list(_invalidation_subscribers.get(table, ())):
+        try:
+            callback(key)
+        except Exception as e:
+            print(f"Error en un suscriptor de invalidación de '{table}': {e}")
+
+def invalidate_all():
+    """Vacía todas las cachés suscritas (p. ej. tras modificar la base de datos a mano)."""
+    for table in list(_invalidation_subscribers):
+        publish_invalidation(table, None)
+
+_WRITE_TARGET_RE = re.compile(r"\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+([A-Za-z_]\w*)", re.IGNORECASE)
+_INSERT_VALUES_RE = re.compile(r"\s*\(([^()]*)\)\s*VALUES\s*\(([^()]*)\)", re.IGNORECASE)
+_WHERE_RE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_WHERE_GUILD_RE = re.compile(r"\bguild_id\s*=\s*(\?|:\w+|-?\d+)", re.IGNORECASE)
+_OR_RE = re.compile(r"\bOR\b", re.IGNORECASE)
+
+def _normalize_key(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _bound_value(token: str, placeholder_index: int, params) -> Any:
+    if token == '?':
+        if isinstance(params, (list, tuple)) and placeholder_index < len(params):
+            return params[placeholder_index]
+        return None
+    if token.startswith(':'):
+        return params.get(token[1:]) if isinstance(params, dict) else None
+    return token
+
+def parse_write_target(query: str, params=()) -> Optional[InvalidationTarget]:
+    """Deduce de una sentencia INSERT/REPLACE/UPDATE/DELETE la tabla escrita y el guild_id afectado.
+
+    La clave sale de la posición de guild_id en la lista de columnas de un INSERT,
+    o de un `guild_id = ?` en el WHERE de un UPDATE/DELETE. Si no se puede acotar
+    (INSERT ... SELECT, WHERE con OR, sin WHERE...) la clave es None: toda la tabla.
+    """
+    match = _WRITE_TARGET_RE.match(query)
+    if not match:
+        return None
+    table = match.group(1).lower()
+    key = None
+    if query.lstrip()[:1].upper() in ('I', 'R'):
+        values = _INSERT_VALUES_RE.match(query, match.end())
+        if values:
+            columns = [c.strip().lower() for c in values.group(1).split(',')]
+            tokens = [v.strip() for v in values.group(2).split(',')]
+            if 'guild_id' in columns and len(columns) == len(tokens):
+                index = columns.index('guild_id')
+                placeholder_index = query[:values.start(2)].count('?') + sum(t.count('?') for t in tokens[:index])
+                key = _normalize_key(_bound_value(tokens[index], placeholder_index, params))
+    else:
+        where = _WHERE_RE.search(query, match.end())
+        if where and not _OR_RE.search(query, where.end()):
+            guild = _WHERE_GUILD_RE.search(query, where.end())
+            if guild:
+                key = _normalize_key(_bound_value(guild.group(1), query[:guild.start(1)].count('?'), params))
+    return table, key
+
+def _resolve_targets(query: str, params, invalidates) -> List[InvalidationTarget]:
+    if invalidates is None:
+        target = parse_write_target(query, params)
+        return [target] if target else []
+    if isinstance(invalidates, tuple):
+        invalidates = [invalidates]
+    return [(table, _normalize_key(key)) for table, key in invalidates]
+
+def _record_invalidations(conn: sqlite3.Connection, targets: List[InvalidationTarget]):
+    """Anota las invalidaciones de tablas cacheadas para los demás procesos (misma transacción)."""
+    rows = [(table, key, _PROCESS_ORIGIN) for table, key in targets if table in CACHED_TABLES]
+    if rows:
+        conn.executemany("INSERT INTO cache_invalidations (table_name, cache_key, origin) VALUES (?, ?, ?)", rows)
+
+def _publish_targets(targets: List[InvalidationTarget]):
+    for table, key in targets:
+        publish_invalidation(table, key)
+
+# Vigilancia de cambios hechos por otros procesos: se consulta PRAGMA data_version
+# (sin coste si nada cambió) y, al cambiar, se avisa a los observadores registrados.
+_change_watchers: List[Callable[[], Any]] = []
+_change_watch_task: Optional[asyncio.Task] = None
+
+def add_change_watcher(callback: Callable[[], Any]):
+    """Registra una corrutina que se ejecuta cuando otra conexión confirma cambios."""
+    _change_watchers.append(callback)
+
+def remove_change_watcher(callback: Callable[[], Any]):
+    if callback in _change_watchers:
+        _change_watchers.remove(callback)
+
+async def _change_watch_loop(interval: float):
+    # Punto de partida antes de la primera lectura de data_version: así la escritura
+    # que provoque el primer cambio ya cae después de él y se aplica
+    await _seed_remote_invalidations()
+    last_version = await _manager.data_version()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            version = await _manager.data_version()
+            if version == last_version:
+                continue
+            last_version = version
+            for callback in list(_change_watchers):
+                await callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error vigilando cambios de la base de datos: {e}")
+
+def start_change_watcher(interval: float = INVALIDATION_POLL_INTERVAL):
+    """Arranca (una sola vez) la vigilancia de cambios de otros procesos."""
+    global _change_watch_task
+    if _manager.read_pool_size == 0:
+        return  # Base de datos en memoria: no hay otros procesos
+    if _change_watch_task is not None and not _change_watch_task.done():
+        return
+    _change_watch_task = asyncio.get_running_loop().create_task(_change_watch_loop(interval))
+
+def stop_change_watcher():
+    global _change_watch_task
+    if _change_watch_task is not None:
+        _change_watch_task.cancel()
+        _change_watch_task = None
+
+_last_invalidation_id: Optional[int] = None
+_last_invalidation_prune = 0.0
+
+async def _seed_remote_invalidations():
+    """Fija el punto de partida: lo anotado antes de arrancar no afecta a cachés que aún están vacías."""
+    global _last_invalidation_id
+    row = await fetchone("SELECT COALESCE(MAX(id), 0) AS id FROM cache_invalidations")
+    _last_invalidation_id = row['id']
+
+async def _consume_remote_invalidations():
+    """Aplica las invalidaciones anotadas por otros procesos desde la última vez."""
+    global _last_invalidation_id, _last_invalidation_prune
+    if _last_invalidation_id is None:
+        await _seed_remote_invalidations()
+        return
+    rows = await fetchall("SELECT id, table_name, cache_key, origin FROM cache_invalidations WHERE id > ? ORDER BY id",
+                          (_last_invalidation_id,))
+    for row in rows:
+        _last_invalidation_id = row['id']
+        if row['origin'] != _PROCESS_ORIGIN:
+            publish_invalidation(row['table_name'], row['cache_key'])
+    # Las entradas solo sirven unos segundos; se purgan cada 10 minutos
+    if time.time() - _last_invalidation_prune > 600:
+        _last_invalidation_prune = time.time()
+        await execute("DELETE FROM cache_invalidations WHERE created_at < datetime('now', '-1 hour')")
+
+add_change_watcher(_consume_remote_invalidations)
+
+# Sistema de caché para configuraciones de servidores: LRU acotada, TTL largo
+# (la frescura la garantiza el bus de invalidación) y stale-while-revalidate, de
+# modo que con carga estable leer la configuración no cuesta ningún salto a la DB.
+SETTINGS_CACHE_SIZE = int(os.environ.get("SETTINGS_CACHE_SIZE", "2048"))
+SETTINGS_CACHE_TTL = float(os.environ.get("SETTINGS_CACHE_TTL", "600"))
+SETTINGS_CACHE_STALE_TTL = float(os.environ.get("SETTINGS_CACHE_STALE_TTL", "3600"))
+
+_settings_cache = LRUCache("server_settings", SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SETTINGS_CACHE_STALE_TTL)
+_economy_settings_cache = LRUCache("economy_settings", SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SETTINGS_CACHE_STALE_TTL)
+_caches: List[LRUCache] = [_settings_cache, _economy_settings_cache]
+
+def register_cache(cache: LRUCache) -> LRUCache:
+    """Añade una caché a las estadísticas de get_cache_stats()."""
+    _caches.append(cache)
+    return cache
+
+def get_cache_stats() -> List[Dict[str, Any]]:
+    """Aciertos, fallos y expulsiones de cada caché registrada."""
+    return [cache.stats() for cache in _caches]
 
 def invalidate_cache(guild_id: int):
-    if guild_id in _settings_cache:
-        del _settings_cache[guild_id]
+    _settings_cache.invalidate(guild_id)
+    _economy_settings_cache.invalidate(guild_id)
 
-async def get_cached_server_settings(guild_id: int) -> Dict[str, Any]:
-    """Obtiene configuraciones del servidor desde la caché o la DB, asegurando que siempre haya un resultado."""
-    import time
-    now = time.time()
-    if guild_id in _settings_cache and 'server' in _settings_cache[guild_id]:
-        cached = _settings_cache[guild_id]
-        if now - cached.get('last_update', 0) < 5: # 5 segundos de cache
-            return cached['server']
-            
+def _cache_invalidator(cache: LRUCache) -> Callable[[Optional[int]], None]:
+    """Suscriptor del bus: descarta la clave indicada o toda la caché si es None."""
+    def _invalidate(key: Optional[int]):
+        if key is None:
+            cache.clear()
+        else:
+            cache.invalidate(key)
+    return _invalidate
+
+subscribe_invalidation('server_settings', _cache_invalidator(_settings_cache))
+subscribe_invalidation('economy_settings', _cache_invalidator(_economy_settings_cache))
+
+async def _load_server_settings(guild_id: int) -> Dict[str, Any]:
     settings = await fetchone("SELECT * FROM server_settings WHERE guild_id = ?", (guild_id,))
     if not settings:
         # Auto-inicializar si no existe
-        await execute("INSERT OR IGNORE INTO server_settings (guild_id) VALUES (?)", (guild_id,))
+        # Crear la fila con valores por defecto no invalida nada que esté en caché
+        await execute("INSERT OR IGNORE INTO server_settings (guild_id) VALUES (?)", (guild_id,), invalidates=[])
         settings = await fetchone("SELECT * FROM server_settings WHERE guild_id = ?", (guild_id,))
         
     # Si por alguna razón crítica sigue siendo None, devolvemos valores por defecto
     if not settings:
         settings = {'prefix': '!', 'language': 'es', 'mod_enabled': 1, 'eco_enabled': 1}
-
-    _settings_cache.setdefault(guild_id, {})['server'] = settings
-    _settings_cache[guild_id]['last_update'] = now
     return settings
 
-async def get_cached_economy_settings(guild_id: int) -> Dict[str, Any]:
-    """Obtiene configuraciones de economía desde la caché o la DB, asegurando que siempre haya un resultado."""
-    import time
-    now = time.time()
-    if guild_id in _settings_cache and 'economy' in _settings_cache[guild_id]:
-        cached = _settings_cache[guild_id]
-        if now - cached.get('last_update_eco', 0) < 5: # 5 segundos de cache
-            return cached['economy']
+async def get_cached_server_settings(guild_id: int) -> Dict[str, Any]:
+    """Obtiene configuraciones del servidor desde la caché o la DB, asegurando que siempre haya un resultado."""
+    return await _settings_cache.get(guild_id, _load_server_settings)
 
+async def _load_economy_settings(guild_id: int) -> Dict[str, Any]:
     settings = await get_guild_economy_settings(guild_id)
     if not settings:
         # Fallback de seguridad extrema
@@ -252,60 +779,423 @@ async def get_cached_economy_settings(guild_id: int) -> Dict[str, Any]:
             'currency_name': 'créditos', 'currency_emoji': '🪙', 
             'start_balance': 100, 'work_cooldown': 3600, 'rob_cooldown': 21600
         }
-    
-    _settings_cache.setdefault(guild_id, {})['economy'] = settings
-    _settings_cache[guild_id]['last_update_eco'] = now
     return settings
 
+async def get_cached_economy_settings(guild_id: int) -> Dict[str, Any]:
+    """Obtiene configuraciones de economía desde la caché o la DB, asegurando que siempre haya un resultado."""
+    return await _economy_settings_cache.get(guild_id, _load_economy_settings)
+
+# Recompensas de rol por nivel: lista ordenada [(level, role_id), ...] por servidor
+_role_rewards_cache = register_cache(LRUCache("role_rewards", SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SETTINGS_CACHE_STALE_TTL))
+subscribe_invalidation('role_rewards', _cache_invalidator(_role_rewards_cache))
+
+async def _load_role_rewards(guild_id: int) -> List[Tuple[int, int]]:
+    rows = await fetchall("SELECT level, role_id FROM role_rewards WHERE guild_id = ? ORDER BY level ASC", (guild_id,))
+    return [(row['level'], row['role_id']) for row in rows]
+
+async def get_role_rewards(guild_id: int) -> List[Tuple[int, int]]:
+    """Recompensas del servidor ordenadas por nivel, desde la caché (se invalida al escribir role_rewards)."""
+    return await _role_rewards_cache.get(guild_id, _load_role_rewards)
+
+# Catálogo de la tienda por servidor, con índices por item_id y por nombre
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def nocase(text: str) -> str:
+    """Igual que COLLATE NOCASE de SQLite: solo pliega las mayúsculas ASCII."""
+    return text.translate(_NOCASE)
+
+class ShopCatalog:
+    """Artículos de la tienda de un servidor (ordenados por precio) con búsqueda O(1) por ID o nombre."""
+    __slots__ = ('items', 'by_id', 'by_name')
+
+    def __init__(self, items: List[Dict[str, Any]]):
+        self.items = items
+        self.by_id = {item['item_id']: item for item in items}
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        for item in items:
+            # Con nombres repetidos gana el más antiguo, como un SELECT ... ORDER BY item_id LIMIT 1
+            key = nocase(item['name'] or '')
+            if key not in self.by_name or item['item_id'] < self.by_name[key]['item_id']:
+                self.by_name[key] = item
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def get(self, item_id: int) -> Optional[Dict[str, Any]]:
+        return self.by_id.get(item_id)
+
+    def find(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.by_name.get(nocase(name.strip()))
+
+    def lookup(self, text: str) -> Optional[Dict[str, Any]]:
+        """Artículo por ID (si `text` es un número) o por nombre."""
+        text = text.strip()
+        item = self.get(int(text)) if text.isdigit() else None
+        return item or self.find(text)
+
+    def ids_matching(self, item_type: str, name_contains: str) -> frozenset:
+        needle = name_contains.lower()
+        return frozenset(item['item_id'] for item in self.items if item['type'] == item_type and needle in (item['name'] or '').lower())
+
+_shop_cache = register_cache(LRUCache("shop_items", SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SETTINGS_CACHE_STALE_TTL))
+subscribe_invalidation('shop_items', _cache_invalidator(_shop_cache))
+
+async def _load_shop_catalog(guild_id: int) -> ShopCatalog:
+    return ShopCatalog(await fetchall("SELECT * FROM shop_items WHERE guild_id = ? ORDER BY price ASC, item_id ASC", (guild_id,)))
+
+async def get_shop_catalog(guild_id: int) -> ShopCatalog:
+    """Catálogo de la tienda desde la caché (se invalida al escribir shop_items, también desde el dashboard)."""
+    return await _shop_cache.get(guild_id, _load_shop_catalog)
+
+async def get_inventory(guild_id: int, user_id: int) -> List[Dict[str, Any]]:
+    """Inventario del usuario: una lectura por clave primaria y los datos del artículo desde el catálogo.
+
+    Los objetos cuyo artículo ya no existe en la tienda se omiten (como hacía el JOIN).
+    """
+    catalog = await get_shop_catalog(guild_id)
+    rows = await fetchall("SELECT item_id, quantity FROM inventory WHERE guild_id = ? AND user_id = ? AND quantity > 0", (guild_id, user_id))
+    return [{**item, 'quantity': row['quantity']} for row in rows if (item := catalog.get(row['item_id'])) is not None]
+
+# Canales permitidos por módulo: frozenset de channel_id por servidor (vacío = sin restricción)
+CHANNEL_ALLOWLISTS = {'economy': 'economy_active_channels', 'gambling': 'gambling_active_channels'}
+_channel_allowlists: Dict[str, Tuple[LRUCache, Callable[[int], Any]]] = {}
+
+def _channel_allowlist_loader(table: str):
+    async def _load(guild_id: int) -> frozenset:
+        rows = await fetchall(f"SELECT channel_id FROM {table} WHERE guild_id = ?", (guild_id,))
+        return frozenset(int(row['channel_id']) for row in rows)
+    return _load
+
+for _module, _table in CHANNEL_ALLOWLISTS.items():
+    _cache = register_cache(LRUCache(_table, SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SETTINGS_CACHE_STALE_TTL))
+    subscribe_invalidation(_table, _cache_invalidator(_cache))
+    _channel_allowlists[_module] = (_cache, _channel_allowlist_loader(_table))
+
+async def get_active_channels(module: str, guild_id: int) -> frozenset:
+    """Canales donde se permite `module` ('economy' o 'gambling'), desde la caché.
+
+    Se invalida con cualquier escritura en la tabla correspondiente (comandos y dashboard).
+    """
+    cache, loader = _channel_allowlists[module]
+    return await cache.get(guild_id, loader)
+
+# Configuración de TTS por servidor (canal leído e idioma), en sus tablas propias
+_tts_cache = register_cache(LRUCache("tts_config", SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SETTINGS_CACHE_STALE_TTL))
+subscribe_invalidation('tts_active_channels', _cache_invalidator(_tts_cache))
+subscribe_invalidation('tts_guild_settings', _cache_invalidator(_tts_cache))
+
+async def _load_tts_config(guild_id: int) -> Dict[str, Any]:
+    row = await fetchone("""
+        SELECT (SELECT text_channel_id FROM tts_active_channels WHERE guild_id = ?) AS channel_id,
+               (SELECT lang FROM tts_guild_settings WHERE guild_id = ?) AS lang
+    """, (guild_id, guild_id))
+    return {'channel_id': row['channel_id'], 'lang': row['lang'] or 'es'}
+
+async def get_tts_config(guild_id: int) -> Dict[str, Any]:
+    """{'channel_id', 'lang'} del TTS del servidor desde la caché (se invalida al escribir cualquiera de las dos tablas)."""
+    return await _tts_cache.get(guild_id, _load_tts_config)
+
 # Funciones asíncronas para consultas y ejecución
 
 async def fetchone(query: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
-    def _sync_fetchone():
-        with _db_lock:
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            row = cursor.fetchone()
-            return dict(row) if row else None
-    return await asyncio.to_thread(_sync_fetchone)
+    def _sync_fetchone(conn):
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    return await _manager.run_read(_sync_fetchone, query)
 
 async def fetchall(query: str, params: tuple = ()) -> List[Dict[str, Any]]:
-    def _sync_fetchall():
-        with _db_lock:
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
-    return await asyncio.to_thread(_sync_fetchall)
-
-async def execute(query: str, params: tuple = ()):
-    # Invalidación de caché
-    query_lower = query.lower()
-    if any(k in query_lower for k in ["update", "replace", "delete", "insert"]):
-        if "server_settings" in query_lower or "economy_settings" in query_lower:
-            for p in params:
-                if isinstance(p, int) and p > 1000000:
-                    invalidate_cache(p)
-                    # No hacemos break porque podría haber otros IDs (aunque lo normal es uno por query)
-                    # Pero sobre todo para no confundir un channel_id con el guild_id.
-                    # Al invalidar ambos si son > 1M no pasa nada malo (solo un poco más de carga),
-                    # asegurando que el guild_id sea procesado.
-
-    def _sync_execute():
+    def _sync_fetchall(conn):
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    return await _manager.run_read(_sync_fetchall, query)
+
+async def execute(query: str, params: tuple = (), invalidates: Union[InvalidationTarget, List[InvalidationTarget], None] = None):
+    """Ejecuta una escritura y avisa al bus de invalidación tras el COMMIT.
+
+    `invalidates` declara (tabla, guild_id) afectados; si se omite se deducen de la sentencia.
+    Devuelve el número de filas afectadas.
+    """
+    targets = _resolve_targets(query, params, invalidates)
+
+    def _sync_execute(conn):
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        _record_invalidations(conn, targets)
+        conn.commit()
+        return cursor.rowcount
+    rowcount = await _manager.run_write(_sync_execute, query)
+    _publish_targets(targets)
+    return rowcount
+
+def get_query_metrics(limit: int = 20, sort: str = 'total_ms') -> Dict[str, Any]:
+    """Sentencias más costosas y últimas consultas lentas de este proceso."""
+    return {
+        'slow_query_ms': query_metrics.slow_query_ms,
+        'statements': query_metrics.top(limit, sort),
+        'slow_queries': query_metrics.slow_queries(limit),
+    }
+
+class InsufficientFunds(Exception):
+    """Un cargo con require_funds=True dejaría la cartera o el banco en negativo."""
+
+# Alta-o-actualización del balance en una sola sentencia: crea la fila con el
+# start_balance del servidor si no existe, aplica el cambio y el tope max_balance,
+# y devuelve el resultado. Con require_funds no toca la fila si quedaría en negativo.
+_BALANCE_UPSERT = """
+    INSERT INTO balances (guild_id, user_id, wallet, bank)
+    SELECT :guild_id, :user_id,
+           MIN(COALESCE(s.start_balance, 100) + :wallet_change,
+               COALESCE(s.max_balance, COALESCE(s.start_balance, 100) + :wallet_change)),
+           :bank_change
+    FROM (SELECT 1) LEFT JOIN economy_settings s ON s.guild_id = :guild_id
+    WHERE :require_funds = 0 OR (COALESCE(s.start_balance, 100) + :wallet_change >= 0 AND :bank_change >= 0)
+       OR EXISTS (SELECT 1 FROM balances WHERE guild_id = :guild_id AND user_id = :user_id)
+    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+        wallet = MIN(wallet + :wallet_change,
+                     COALESCE((SELECT max_balance FROM economy_settings WHERE guild_id = :guild_id), wallet + :wallet_change)),
+        bank = bank + :bank_change
+    WHERE :require_funds = 0 OR (wallet + :wallet_change >= 0 AND bank + :bank_change >= 0)
+    RETURNING wallet, bank
+"""
+
+_LEDGER_INSERT = ("INSERT INTO economy_ledger (guild_id, user_id, delta_wallet, delta_bank, reason, ref) "
+                  "VALUES (?, ?, ?, ?, ?, ?)")
+
+def _apply_balance_change(conn: sqlite3.Connection, params: Dict[str, Any], reason: str, ref: Optional[str]) -> List[Dict[str, Any]]:
+    """Aplica _BALANCE_UPSERT y anota en economy_ledger lo que cambió de verdad (tras el tope)."""
+    guild_id, user_id = params['guild_id'], params['user_id']
+    old = conn.execute("SELECT wallet, bank FROM balances WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)).fetchone()
+    rows = [dict(row) for row in conn.execute(_BALANCE_UPSERT, params).fetchall()]
+    if not rows:
+        return rows
+    wallet, bank = rows[0]['wallet'], rows[0]['bank']
+    entries = []
+    if old is None:
+        # Fila nueva (antes no había nada): apertura con el start_balance del servidor,
+        # el cambio pedido y, si max_balance lo recortó, el recorte como ajuste aparte
+        setting = conn.execute("SELECT start_balance FROM economy_settings WHERE guild_id = ?", (guild_id,)).fetchone()
+        start = 100 if setting is None or setting['start_balance'] is None else setting['start_balance']
+        if start:
+            entries.append((guild_id, user_id, start, 0, 'apertura', None))
+        if params['wallet_change'] or params['bank_change']:
+            entries.append((guild_id, user_id, params['wallet_change'], params['bank_change'], reason, ref))
+        clamp = wallet - (start + params['wallet_change'])
+        if clamp:
+            entries.append((guild_id, user_id, clamp, 0, 'tope', None))
+    else:
+        delta_wallet, delta_bank = wallet - old[0], bank - old[1]
+        if delta_wallet or delta_bank:
+            entries.append((guild_id, user_id, delta_wallet, delta_bank, reason, ref))
+    if entries:
+        conn.executemany(_LEDGER_INSERT, entries)
+    return rows
+
+class Transaction:
+    """Agrupa varias sentencias para ejecutarlas en una única transacción y un único salto al hilo escritor.
+
+    Las sentencias se encolan dentro del bloque `async with db.transaction() as tx:`
+    y se ejecutan al salir. Cada llamada devuelve un Future que se resuelve tras el
+    COMMIT; si cualquier sentencia falla se deshacen todas.
+    """
+
+    def __init__(self):
+        self._statements: List[tuple] = []
+        self._targets: List[InvalidationTarget] = []
+
+    def _queue(self, query: str, params, convert: Optional[Callable] = None, invalidates=None,
+               runner: Optional[Callable] = None) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._statements.append((query, params, convert, future, runner))
+        self._targets.extend(_resolve_targets(query, params, invalidates))
+        return future
+
+    def execute(self, query: str, params: tuple = (), invalidates=None) -> asyncio.Future:
+        """Encola una sentencia; el Future devuelve sus filas (útil con RETURNING)."""
+        return self._queue(query, params, invalidates=invalidates)
+
+    def update_balance(self, guild_id: int, user_id: int, wallet_change: int = 0, bank_change: int = 0, require_funds: bool = False,
+                       reason: str = 'ajuste', ref: Optional[Any] = None) -> asyncio.Future:
+        """Encola un cambio de balance; el Future devuelve (wallet, bank) ya aplicado el tope.
+
+        El movimiento se anota en economy_ledger con `reason` y `ref` en la misma transacción.
+        """
+        params = {'guild_id': guild_id, 'user_id': user_id, 'wallet_change': wallet_change,
+                  'bank_change': bank_change, 'require_funds': int(require_funds)}
+        ref = None if ref is None else str(ref)
+        def _convert(rows):
+            if not rows:
+                raise InsufficientFunds(f"Fondos insuficientes para {user_id} en {guild_id}")
+            return rows[0]['wallet'], rows[0]['bank']
+        return self._queue(_BALANCE_UPSERT, params, _convert, invalidates=('balances', guild_id),
+                           runner=lambda conn: _apply_balance_change(conn, params, reason, ref))
+
+    def set_cooldown(self, guild_id: int, user_id: int, command: str, timestamp: datetime.datetime) -> asyncio.Future:
+        return self._queue("INSERT OR REPLACE INTO user_cooldowns (guild_id, user_id, command_name, last_use) VALUES (?, ?, ?, ?)",
+                           (guild_id, user_id, command, timestamp.isoformat()), invalidates=('user_cooldowns', guild_id))
+
+    def _label(self) -> str:
+        # En las métricas la transacción cuenta como una sola unidad con la forma de sus sentencias
+        return "TRANSACTION: " + "; ".join(normalize_sql(q) for q, _, _, _, _ in self._statements)
+
+    def _run(self, conn: sqlite3.Connection) -> List[Any]:
+        results = []
+        with conn:
+            for query, params, convert, _, runner in self._statements:
+                rows = runner(conn) if runner else [dict(row) for row in conn.execute(query, params).fetchall()]
+                results.append(convert(rows) if convert else rows)
+            _record_invalidations(conn, self._targets)
+        return results
+
+    async def commit(self):
+        """Ejecuta todo lo encolado en un solo salto al hilo escritor."""
+        if not self._statements:
+            return
+        try:
+            results = await _manager.run_write(self._run, self._label())
+        except BaseException:
+            self.rollback()
+            raise
+        for (_, _, _, future, _), result in zip(self._statements, results):
+            future.set_result(result)
+        targets, self._statements, self._targets = self._targets, [], []
+        _publish_targets(targets)
+
+    def rollback(self):
+        """Descarta lo encolado (nada se ha escrito todavía)."""
+        for _, _, _, future, _ in self._statements:
+            future.cancel()
+        self._statements = []
+        self._targets = []
+
+    async def __aenter__(self) -> "Transaction":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.rollback()
+            return False
+        await self.commit()
+        return False
+
+def transaction() -> Transaction:
+    """Uso: `async with db.transaction() as tx:`; las sentencias se confirman juntas al salir."""
+    return Transaction()
+
+# Buffer de escritura diferida (write-behind) para las tablas de logs de solo inserción.
+# Agrupa las filas y las escribe con executemany en una sola transacción al llegar
+# a LOG_FLUSH_SIZE filas o tras LOG_FLUSH_INTERVAL segundos, en vez de un commit por fila.
+LOG_FLUSH_SIZE = int(os.environ.get("DB_LOG_FLUSH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.environ.get("DB_LOG_FLUSH_INTERVAL", "2.0"))
+
+_LOG_INSERTS = {
+    'global_command_logs': "INSERT INTO global_command_logs (guild_id, guild_name, user_id, user_name, command_name, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+    'bot_logs': "INSERT INTO bot_logs (level, category, message, timestamp) VALUES (?, ?, ?, ?)",
+    'admin_audit_logs': "INSERT INTO admin_audit_logs (user_id, user_name, action, target_id, details, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+    'mod_logs': "INSERT INTO mod_logs (guild_id, user_id, moderator_id, action, reason, duration, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+}
+
+def _utc_timestamp() -> str:
+    """Marca de tiempo con el mismo formato que CURRENT_TIMESTAMP de SQLite."""
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+class WriteBehindBuffer:
+    """Acumula inserciones de logs y las vuelca por lotes en el hilo escritor."""
+
+    def __init__(self, statements: Dict[str, str], flush_size: int, flush_interval: float):
+        self.statements = statements
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, List[tuple]] = {}
+        self._count = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks = set()
+
+    def __len__(self):
+        return self._count
+
+    def add(self, table: str, row: tuple):
+        """Encola una fila; programa el volcado por tamaño o por tiempo."""
+        self._pending.setdefault(table, []).append(row)
+        self._count += 1
+        loop = asyncio.get_running_loop()
+        if self._count >= self.flush_size:
+            task = loop.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif self._timer is None or self._timer_loop is not loop:
+            self._timer_loop = loop
+            self._timer = loop.call_later(self.flush_interval, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take(self) -> Dict[str, List[tuple]]:
+        pending, self._pending, self._count = self._pending, {}, 0
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return pending
+
+    def _write_batch(self, conn: sqlite3.Connection, pending: Dict[str, List[tuple]]):
+        with conn:
+            for table, rows in pending.items():
+                conn.executemany(self.statements[table], rows)
+        return sum(len(rows) for rows in pending.values())
+
+    def _requeue(self, pending: Dict[str, List[tuple]]):
+        for table, rows in pending.items():
+            self._pending[table] = rows + self._pending.get(table, [])
+            self._count += len(rows)
+
+    async def flush(self):
+        """Vuelca todas las filas pendientes en una única transacción."""
+        pending = self._take()
+        if not pending:
+            return
+        try:
+            await _manager.run_write(lambda conn: self._write_batch(conn, pending), "WRITE-BEHIND FLUSH: " + ", ".join(sorted(pending)))
+        except sqlite3.OperationalError as e:
+            # Base de datos bloqueada u ocupada: se reintenta en el siguiente volcado
+            print(f"Error volcando logs diferidos (se reintentará): {e}")
+            self._requeue(pending)
+        except sqlite3.Error as e:
+            print(f"Error volcando logs diferidos, se descartan {sum(len(r) for r in pending.values())} filas: {e}")
+
+    def drain_sync(self):
+        """Vuelca lo pendiente de forma síncrona (cierre sin bucle de eventos)."""
+        pending = self._take()
+        if not pending:
+            return
+        conn = _manager.writer()
         with _db_lock:
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            conn.commit()
-    return await asyncio.to_thread(_sync_execute)
+            try:
+                self._write_batch(conn, pending)
+            except sqlite3.Error as e:
+                print(f"Error volcando logs diferidos al cerrar: {e}")
+
+_log_buffer = WriteBehindBuffer(_LOG_INSERTS, LOG_FLUSH_SIZE, LOG_FLUSH_INTERVAL)
+
+async def flush_log_buffer():
+    """Fuerza el volcado de los logs diferidos (antes de leerlos o al apagar)."""
+    await _log_buffer.flush()
 
 # Consultas específicas de economía, niveles y logs
 
 async def get_guild_economy_settings(guild_id: int) -> Optional[Dict[str, Any]]:
     settings = await fetchone("SELECT * FROM economy_settings WHERE guild_id = ?", (guild_id,))
     if not settings:
-        await execute("INSERT OR IGNORE INTO economy_settings (guild_id) VALUES (?)", (guild_id,))
+        await execute("INSERT OR IGNORE INTO economy_settings (guild_id) VALUES (?)", (guild_id,), invalidates=[])
         settings = await fetchone("SELECT * FROM economy_settings WHERE guild_id = ?", (guild_id,))
     return settings
 
@@ -335,42 +1225,434 @@ async def set_last_daily(guild_id: int, user_id: int, timestamp: datetime.dateti
 async def get_balance(guild_id: int, user_id: int) -> tuple[int, int]:
     res = await fetchone("SELECT wallet, bank FROM balances WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
     if res: return res['wallet'], res['bank']
-    settings = await get_guild_economy_settings(guild_id)
-    start = settings.get('start_balance', 100) if settings else 100
-    await execute("INSERT OR IGNORE INTO balances (guild_id, user_id, wallet, bank) VALUES (?, ?, ?, 0)", (guild_id, user_id, start))
-    return start, 0
+    # Crea la fila con el start_balance del servidor en el mismo salto
+    return await update_balance(guild_id, user_id, reason='apertura')
 
-async def update_balance(guild_id: int, user_id: int, wallet_change: int = 0, bank_change: int = 0) -> tuple[int, int]:
-    await get_balance(guild_id, user_id)
-    settings = await get_guild_economy_settings(guild_id)
-    max_bal = settings.get('max_balance') if settings else None
-    await execute("UPDATE balances SET wallet = wallet + ?, bank = bank + ? WHERE guild_id = ? AND user_id = ?", (wallet_change, bank_change, guild_id, user_id))
-    if max_bal is not None:
-        await execute("UPDATE balances SET wallet = ? WHERE guild_id = ? AND user_id = ? AND wallet > ?", (max_bal, guild_id, user_id, max_bal))
-    return await get_balance(guild_id, user_id)
+async def update_balance(guild_id: int, user_id: int, wallet_change: int = 0, bank_change: int = 0,
+                         reason: str = 'ajuste', ref: Optional[Any] = None) -> tuple[int, int]:
+    """Cambia el balance y anota el movimiento en economy_ledger (`reason`: qué lo causó, `ref`: id relacionado)."""
+    async with transaction() as tx:
+        result = tx.update_balance(guild_id, user_id, wallet_change, bank_change, reason=reason, ref=ref)
+    return result.result()
+
+async def get_economy_ledger(guild_id: int, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    """Últimos movimientos de un usuario, del más reciente al más antiguo."""
+    return await fetchall("SELECT delta_wallet, delta_bank, reason, ref, created_at FROM economy_ledger "
+                          "WHERE guild_id = ? AND user_id = ? ORDER BY id DESC LIMIT ?", (guild_id, user_id, limit))
+
+async def check_economy_ledger(guild_id: Optional[int] = None, sample: int = 20) -> Dict[str, Any]:
+    """Compara balances con la suma del ledger recorriendo ambos en streaming (ver utils/economy_ledger.py)."""
+    return await _manager.run_read(lambda conn: economy_ledger.check(conn, guild_id, sample), "ECONOMY LEDGER CHECK")
+
+async def get_economy_stats(guild_id: int) -> Dict[str, Any]:
+    """Masa monetaria, reparto cartera/banco, cuota del 1% más rico y Gini del servidor."""
+    return await _manager.run_read(lambda conn: economy_analytics.compute(conn, guild_id), "ECONOMY STATS")
+
+async def take_economy_snapshot(guild_id: int) -> Optional[Dict[str, Any]]:
+    """Calcula los indicadores y los guarda en economy_snapshots (nada si el servidor no tiene balances)."""
+    stats = await get_economy_stats(guild_id)
+    if not stats['users']:
+        return None
+    await execute("INSERT OR REPLACE INTO economy_snapshots (guild_id, taken_at, users, money_supply, bank_total, top1_share, gini) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?)", economy_analytics.snapshot_row(stats), invalidates=[])
+    return stats
+
+async def get_economy_snapshots(guild_id: int, days: int = 30) -> List[Dict[str, Any]]:
+    """Serie temporal de los últimos `days` días, de la más antigua a la más reciente."""
+    since = int(time.time()) - days * 86400
+    rows = await fetchall("SELECT taken_at, users, money_supply, bank_total, money_supply - bank_total AS wallet_total, top1_share, gini "
+                          "FROM economy_snapshots WHERE guild_id = ? AND taken_at >= ? ORDER BY taken_at", (guild_id, since))
+    for row in rows:
+        row['taken_at'] = datetime.datetime.fromtimestamp(row['taken_at'], datetime.timezone.utc).strftime('%Y-%m-%d %H:%M')
+    return rows
 
 async def get_user_level(guild_id: int, user_id: int) -> tuple[int, int]:
     res = await fetchone("SELECT level, xp FROM levels WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
     if res: return res['level'], res['xp']
-    await execute("INSERT OR IGNORE INTO levels (guild_id, user_id) VALUES (?, ?)", (guild_id, user_id))
+    # Solo crea la fila por defecto: no cambia nada que haya en caché (p. ej. el XP sin volcar del ledger)
+    await execute("INSERT OR IGNORE INTO levels (guild_id, user_id) VALUES (?, ?)", (guild_id, user_id), invalidates=[])
     return 1, 0
 
 async def update_user_xp(guild_id: int, user_id: int, level: int, xp: int):
-    await execute("UPDATE levels SET level = ?, xp = ? WHERE guild_id = ? AND user_id = ?", (level, xp, guild_id, user_id))
+    curve = LevelCurve.from_settings(await get_cached_server_settings(guild_id))
+    await execute("UPDATE levels SET level = ?, xp = ?, total_xp = ? WHERE guild_id = ? AND user_id = ?",
+                  (level, xp, curve.total_for_level(level) + xp, guild_id, user_id))
+
+_LEVELS_UPSERT = ("INSERT INTO levels (guild_id, user_id, level, xp, total_xp) VALUES (?, ?, ?, ?, ?) "
+                  "ON CONFLICT(guild_id, user_id) DO UPDATE SET level = excluded.level, xp = excluded.xp, total_xp = excluded.total_xp")
+
+async def save_user_levels(rows: List[tuple]):
+    """Guarda muchas filas (guild_id, user_id, level, xp, total_xp) con executemany en una sola transacción."""
+    def _sync_save(conn):
+        with conn:
+            conn.executemany(_LEVELS_UPSERT, rows)
+        return len(rows)
+    await _manager.run_write(_sync_save, _LEVELS_UPSERT)
+
+async def recompute_guild_levels(guild_id: int, curve: LevelCurve) -> int:
+    """Recalcula nivel y XP dentro del nivel de todo un servidor a partir de total_xp (vectorizado con NumPy)."""
+    targets = [('levels', guild_id)]
+    def _sync_recompute(conn):
+        rows = conn.execute("SELECT user_id, total_xp FROM levels WHERE guild_id = ?", (guild_id,)).fetchall()
+        if not rows:
+            return 0
+        levels, xps = curve.split_many([row['total_xp'] for row in rows])
+        with conn:
+            conn.executemany("UPDATE levels SET level = ?, xp = ? WHERE guild_id = ? AND user_id = ?",
+                             zip(levels.tolist(), xps.tolist(), [guild_id] * len(rows), [row['user_id'] for row in rows]))
+            _record_invalidations(conn, targets)
+        return len(rows)
+    updated = await _manager.run_write(_sync_recompute, "RECOMPUTE LEVELS")
+    _publish_targets(targets)
+    return updated
+
+# --- Operaciones masivas de economía ---
+# Cada operación cambia todos los balances de un servidor con una sentencia por
+# tabla: una inserción en economy_ledger con los deltas y un UPDATE ... FROM sobre
+# balances, ambos a partir de la misma consulta de destino y en una transacción.
+BANK_LIMIT_BASE = 5000
+BANK_LIMIT_PER_LEVEL = 5000
+
+def max_bank_for_level(level: int) -> int:
+    """Límite del banco según el nivel de XP (nivel 1 = 10,000, nivel 10 = 55,000)."""
+    return BANK_LIMIT_BASE + level * BANK_LIMIT_PER_LEVEL
+
+_BULK_TARGETS = """
+    SELECT b.guild_id, b.user_id, b.wallet, b.bank, {wallet} AS new_wallet, {bank} AS new_bank
+    FROM balances b
+    LEFT JOIN levels l ON l.guild_id = b.guild_id AND l.user_id = b.user_id
+    LEFT JOIN economy_settings s ON s.guild_id = b.guild_id
+    WHERE b.guild_id = :guild_id
+"""
+_WEALTH_TAX = "MAX(0, CAST((b.wallet + b.bank - :threshold) * :rate AS INTEGER))"
+# Expresiones (nueva cartera, nuevo banco) de cada operación sobre b (balances), l (levels) y s (economy_settings)
+BULK_BALANCE_OPS: Dict[str, Tuple[str, str]] = {
+    # Intereses sobre el banco, sin pasar del límite por nivel (ni recortar a quien ya lo supera)
+    'interest': ("b.wallet",
+                 "MAX(b.bank, MIN(b.bank + CAST(b.bank * :rate AS INTEGER), "
+                 f"{BANK_LIMIT_BASE} + COALESCE(l.level, 1) * {BANK_LIMIT_PER_LEVEL}))"),
+    # Impuesto sobre el patrimonio por encima del umbral: primero del banco y luego de la cartera
+    'wealth_tax': (f"b.wallet - ({_WEALTH_TAX} - MIN(b.bank, {_WEALTH_TAX}))",
+                   f"b.bank - MIN(b.bank, {_WEALTH_TAX})"),
+    'reset': ("COALESCE(s.start_balance, 100)", "0"),
+}
+
+def _queue_bulk_balance_op(tx: Transaction, op: str, guild_id: int, params: Dict[str, Any], ref: Optional[Any] = None) -> asyncio.Future:
+    """Encola en `tx` la operación masiva; el Future devuelve las filas de balances cambiadas."""
+    wallet, bank = BULK_BALANCE_OPS[op]
+    targets = _BULK_TARGETS.format(wallet=wallet, bank=bank)
+    params = {'rate': 0, 'threshold': 0, **params, 'guild_id': guild_id, 'reason': op,
+              'ref': None if ref is None else str(ref)}
+    tx.execute(f"""
+        INSERT INTO economy_ledger (guild_id, user_id, delta_wallet, delta_bank, reason, ref)
+        SELECT guild_id, user_id, new_wallet - wallet, new_bank - bank, :reason, :ref
+        FROM ({targets}) WHERE new_wallet != wallet OR new_bank != bank
+    """, params, invalidates=[])
+    return tx.execute(f"""
+        UPDATE balances SET wallet = t.new_wallet, bank = t.new_bank
+        FROM ({targets}) AS t
+        WHERE balances.guild_id = t.guild_id AND balances.user_id = t.user_id
+          AND (t.new_wallet != t.wallet OR t.new_bank != t.bank)
+        RETURNING balances.user_id
+    """, params, invalidates=('balances', guild_id))
+
+async def bulk_balance_op(op: str, guild_id: int, rate: float = 0.0, threshold: int = 0, ref: Optional[Any] = None) -> int:
+    """Aplica una operación de BULK_BALANCE_OPS a todo el servidor. Devuelve cuántos balances cambiaron."""
+    async with transaction() as tx:
+        changed = _queue_bulk_balance_op(tx, op, guild_id, {'rate': rate, 'threshold': threshold}, ref)
+    return len(changed.result())
+
+async def apply_bank_interest(guild_id: int, rate: float, ref: Optional[Any] = None) -> int:
+    return await bulk_balance_op('interest', guild_id, rate=rate, ref=ref)
+
+async def apply_wealth_tax(guild_id: int, rate: float, threshold: int, ref: Optional[Any] = None) -> int:
+    return await bulk_balance_op('wealth_tax', guild_id, rate=rate, threshold=threshold, ref=ref)
+
+async def reset_guild_economy(guild_id: int, ref: Optional[Any] = None) -> int:
+    """Devuelve a todos los usuarios del servidor al start_balance, con el banco vacío."""
+    return await bulk_balance_op('reset', guild_id, ref=ref)
+
+# Tareas periódicas (intereses, impuestos...) configuradas por servidor en economy_jobs.
+# run_due_economy_jobs() las ejecuta con una transacción por servidor que incluye
+# la reprogramación, así que una tarea nunca se aplica dos veces por un reinicio.
+ECONOMY_JOB_KINDS = ('interest', 'wealth_tax')
+
+def _job_time(moment: datetime.datetime) -> str:
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+async def set_economy_job(guild_id: int, kind: str, rate: float, threshold: int = 0, interval_hours: int = 24):
+    """Crea o reemplaza la tarea `kind` del servidor; la primera ejecución es dentro de un intervalo."""
+    if kind not in ECONOMY_JOB_KINDS:
+        raise ValueError(f"Tarea de economía desconocida: {kind}")
+    next_run = _job_time(datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=interval_hours))
+    await execute("""
+        INSERT INTO economy_jobs (guild_id, kind, rate, threshold, interval_hours, next_run) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(guild_id, kind) DO UPDATE SET rate = excluded.rate, threshold = excluded.threshold,
+            interval_hours = excluded.interval_hours, next_run = excluded.next_run
+    """, (guild_id, kind, rate, threshold, interval_hours, next_run))
+
+async def delete_economy_job(guild_id: int, kind: str) -> bool:
+    return await execute("DELETE FROM economy_jobs WHERE guild_id = ? AND kind = ?", (guild_id, kind)) > 0
+
+async def get_economy_jobs(guild_id: int) -> List[Dict[str, Any]]:
+    return await fetchall("SELECT * FROM economy_jobs WHERE guild_id = ? ORDER BY kind", (guild_id,))
+
+async def run_due_economy_jobs(now: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
+    """Ejecuta las tareas vencidas: una sentencia por tabla y servidor, y las reprograma."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    due = await fetchall("SELECT * FROM economy_jobs WHERE next_run <= ? ORDER BY next_run", (_job_time(now),))
+    results = []
+    for job in due:
+        next_run = _job_time(now + datetime.timedelta(hours=max(job['interval_hours'], 1)))
+        try:
+            async with transaction() as tx:
+                changed = _queue_bulk_balance_op(tx, job['kind'], job['guild_id'],
+                                                 {'rate': job['rate'], 'threshold': job['threshold']}, ref=f"job:{job['id']}")
+                tx.execute("UPDATE economy_jobs SET next_run = ?, last_run = ? WHERE id = ?",
+                           (next_run, _job_time(now), job['id']))
+        except Exception as e:
+            print(f"Error ejecutando la tarea de economía {job['kind']} del servidor {job['guild_id']}: {e}")
+            continue
+        results.append({'guild_id': job['guild_id'], 'kind': job['kind'], 'affected': len(changed.result())})
+    return results
+
+# --- Cola de tareas administrativas (broadcast_queue) ---
+# El dashboard encola y el bot las ejecuta (ver utils/task_queue.py). Cada tarea
+# se reclama con un lease: si el proceso muere a medias, el lease caduca y otra
+# pasada la vuelve a intentar hasta agotar max_attempts.
+TASK_MAX_ATTEMPTS = int(os.environ.get("TASK_MAX_ATTEMPTS", "3"))
+
+_task_listeners: List[Callable[[], None]] = []
+
+def add_task_listener(callback: Callable[[], None]):
+    """Aviso en el mismo proceso al encolar (bot y dashboard juntos en run.py)."""
+    _task_listeners.append(callback)
+
+def remove_task_listener(callback: Callable[[], None]):
+    if callback in _task_listeners:
+        _task_listeners.remove(callback)
+
+async def enqueue_task(task_type: str, payload: str = '', max_attempts: Optional[int] = None, delay: float = 0.0) -> int:
+    """Encola una tarea y despierta al consumidor si está en este proceso. Devuelve su id."""
+    async with transaction() as tx:
+        rows = tx.execute(
+            "INSERT INTO broadcast_queue (message, type, status, max_attempts, available_at) VALUES (?, ?, 'pending', ?, ?) RETURNING id",
+            (payload, task_type, max_attempts or TASK_MAX_ATTEMPTS, time.time() + delay))
+    for callback in list(_task_listeners):
+        callback()
+    return rows.result()[0]['id']
+
+def _task_types_clause(task_types: List[str]) -> Tuple[str, Dict[str, str]]:
+    params = {f"type{i}": task_type for i, task_type in enumerate(task_types)}
+    return "type IN (" + ", ".join(f":{name}" for name in params) + ")", params
+
+async def next_task_due(task_types: List[str]) -> Optional[float]:
+    """Instante (epoch) de la próxima tarea de esos tipos: pendiente disponible o lease caducado. None si no hay."""
+    if not task_types:
+        return None
+    types_sql, params = _task_types_clause(task_types)
+    row = await fetchone(f"""
+        SELECT MIN(due) AS due FROM (
+            SELECT MIN(available_at) AS due FROM broadcast_queue WHERE status = 'pending' AND {types_sql}
+            UNION ALL
+            SELECT MIN(lease_expires) FROM broadcast_queue WHERE status = 'processing' AND {types_sql}
+        )
+    """, params)
+    return row['due'] if row else None
+
+async def claim_task(task_types: List[str], owner: str, lease_seconds: float, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Reclama la tarea más antigua disponible (o con el lease caducado) y le pone un lease a nombre de `owner`."""
+    if not task_types:
+        return None
+    now = time.time() if now is None else now
+    types_sql, params = _task_types_clause(task_types)
+    params.update(now=now, owner=owner, lease=lease_seconds)
+    async with transaction() as tx:
+        # Lease caducado en el último intento: se da por fallida en vez de repetirla
+        tx.execute(f"""
+            UPDATE broadcast_queue SET status = 'failed', last_error = 'lease caducado en el último intento',
+                lease_owner = NULL, lease_expires = NULL, finished_at = CURRENT_TIMESTAMP
+            WHERE status = 'processing' AND lease_expires <= :now AND attempts >= max_attempts AND {types_sql}
+        """, params)
+        claimed = tx.execute(f"""
+            UPDATE broadcast_queue SET status = 'processing', attempts = attempts + 1,
+                lease_owner = :owner, lease_expires = :now + :lease
+            WHERE id = (
+                SELECT id FROM broadcast_queue
+                WHERE {types_sql} AND ((status = 'pending' AND available_at <= :now)
+                                       OR (status = 'processing' AND lease_expires <= :now))
+                ORDER BY id LIMIT 1
+            )
+            RETURNING *
+        """, params)
+    rows = claimed.result()
+    return rows[0] if rows else None
+
+async def extend_task_lease(task_id: int, owner: str, lease_seconds: float) -> bool:
+    """Renueva el lease de una tarea larga. False si ya no es nuestra."""
+    return await execute("UPDATE broadcast_queue SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'processing'",
+                         (time.time() + lease_seconds, task_id, owner)) > 0
+
+async def complete_task(task_id: int, owner: str) -> bool:
+    """Marca la tarea como completada. False si el lease caducó y la reclamó otro."""
+    return await execute("""
+        UPDATE broadcast_queue SET status = 'completed', lease_owner = NULL, lease_expires = NULL, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND lease_owner = ? AND status = 'processing'
+    """, (task_id, owner)) > 0
+
+async def fail_task(task_id: int, owner: str, error: str, retry_delay: float) -> Optional[str]:
+    """Devuelve la tarea a 'pending' dentro de `retry_delay` s, o la marca 'failed' si no quedan intentos.
+
+    Devuelve el nuevo estado, o None si el lease ya no era nuestro.
+    """
+    async with transaction() as tx:
+        rows = tx.execute("""
+            UPDATE broadcast_queue SET
+                status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END,
+                finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE CURRENT_TIMESTAMP END,
+                available_at = ?, last_error = ?, lease_owner = NULL, lease_expires = NULL
+            WHERE id = ? AND lease_owner = ? AND status = 'processing'
+            RETURNING status
+        """, (time.time() + retry_delay, error, task_id, owner))
+    rows = rows.result()
+    return rows[0]['status'] if rows else None
+
+# --- Entregas de anuncios globales (ver utils/fanout.py) ---
+
+async def get_broadcast_delivered(task_id: int) -> set:
+    """Servidores que ya tienen resultado final para el anuncio (se saltan al reanudar)."""
+    rows = await fetchall("SELECT guild_id FROM broadcast_deliveries WHERE task_id = ?", (task_id,))
+    return {row['guild_id'] for row in rows}
+
+async def set_broadcast_total(task_id: int, total: int):
+    await execute("UPDATE broadcast_queue SET progress_total = ? WHERE id = ?", (total, task_id))
+
+_DELIVERY_UPSERT = ("INSERT OR REPLACE INTO broadcast_deliveries (task_id, guild_id, channel_id, status, error, delivered_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)")
+
+async def record_broadcast_deliveries(task_id: int, rows: List[tuple]):
+    """Guarda un lote de resultados (guild_id, channel_id, status, error, delivered_at) en una sola transacción."""
+    if not rows:
+        return
+    def _sync_record(conn):
+        with conn:
+            conn.executemany(_DELIVERY_UPSERT, [(task_id, *row) for row in rows])
+    await _manager.run_write(_sync_record, _DELIVERY_UPSERT)
+
+_BROADCAST_PROGRESS = """
+    SELECT q.id, q.message, q.status, q.attempts, q.max_attempts, q.last_error, q.date_added, q.finished_at,
+           COALESCE(q.progress_total, 0) AS total,
+           COUNT(d.guild_id) AS done,
+           COALESCE(SUM(d.status = 'sent'), 0) AS sent,
+           COALESCE(SUM(d.status = 'skipped'), 0) AS skipped,
+           COALESCE(SUM(d.status = 'failed'), 0) AS failed
+    FROM {source} q LEFT JOIN broadcast_deliveries d ON d.task_id = q.id
+    GROUP BY q.id ORDER BY q.id DESC
+"""
+
+async def get_broadcast_progress(task_id: int) -> Optional[Dict[str, Any]]:
+    return await fetchone(_BROADCAST_PROGRESS.format(source="(SELECT * FROM broadcast_queue WHERE id = ?)"), (task_id,))
+
+async def get_recent_broadcasts(limit: int = 5) -> List[Dict[str, Any]]:
+    """Últimos anuncios globales con su progreso (para el panel de administración)."""
+    # El LIMIT va antes del JOIN: solo se agregan las entregas de esos anuncios
+    source = "(SELECT * FROM broadcast_queue WHERE type = 'broadcast' ORDER BY id DESC LIMIT ?)"
+    return await fetchall(_BROADCAST_PROGRESS.format(source=source), (limit,))
+
+# --- Rankings ---
+# Orden: puntuación descendente y, a igualdad, user_id ascendente. El puesto de un
+# usuario es 1 + las filas que van por delante, contadas sobre el índice de ranking
+# (solo se recorren entradas del índice, nunca la tabla ni un ordenamiento).
+LEADERBOARDS = {
+    'economy': ('balances', 'net_worth'),
+    'levels': ('levels', 'total_xp'),
+}
+
+def _leaderboard(board: str) -> Tuple[str, str]:
+    if board not in LEADERBOARDS:
+        raise ValueError(f"Ranking desconocido: {board}")
+    return LEADERBOARDS[board]
+
+async def get_user_rank(board: str, guild_id: int, user_id: int) -> Optional[Dict[str, int]]:
+    """{'rank', 'total', 'score'} del usuario en el ranking del servidor, o None si no aparece."""
+    table, score = _leaderboard(board)
+    return await fetchone(f"""
+        SELECT me.{score} AS score,
+               (SELECT COUNT(*) FROM {table} o WHERE o.guild_id = me.guild_id
+                  AND (o.{score} > me.{score} OR (o.{score} = me.{score} AND o.user_id < me.user_id))) + 1 AS rank,
+               (SELECT COUNT(*) FROM {table} t WHERE t.guild_id = me.guild_id) AS total
+        FROM {table} me WHERE me.guild_id = ? AND me.user_id = ?
+    """, (guild_id, user_id))
+
+async def get_leaderboard_page(board: str, guild_id: int, page: int = 1, per_page: int = 10) -> List[Dict[str, Any]]:
+    """Una página del ranking (la 1 es el top), con el puesto de cada fila."""
+    table, score = _leaderboard(board)
+    offset = (max(page, 1) - 1) * per_page
+    rows = await fetchall(f"SELECT * FROM {table} WHERE guild_id = ? ORDER BY {score} DESC, user_id ASC LIMIT ? OFFSET ?",
+                          (guild_id, per_page, offset))
+    for i, row in enumerate(rows):
+        row['rank'] = offset + i + 1
+    return rows
+
+async def get_leaderboard_around(board: str, guild_id: int, user_id: int, radius: int = 4) -> List[Dict[str, Any]]:
+    """El usuario con hasta `radius` filas por encima y por debajo (paginación por clave, sin OFFSET)."""
+    table, score = _leaderboard(board)
+    me = await get_user_rank(board, guild_id, user_id)
+    if not me:
+        return []
+    value = me['score']
+    above = await fetchall(f"""
+        SELECT * FROM {table} WHERE guild_id = ? AND ({score} > ? OR ({score} = ? AND user_id < ?))
+        ORDER BY {score} ASC, user_id DESC LIMIT ?""", (guild_id, value, value, user_id, radius))
+    below = await fetchall(f"""
+        SELECT * FROM {table} WHERE guild_id = ? AND ({score} < ? OR ({score} = ? AND user_id > ?))
+        ORDER BY {score} DESC, user_id ASC LIMIT ?""", (guild_id, value, value, user_id, radius))
+    current = await fetchone(f"SELECT * FROM {table} WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+    rows = above[::-1] + ([current] if current else []) + below
+    first_rank = me['rank'] - len(above)
+    for i, row in enumerate(rows):
+        row['rank'] = first_rank + i
+    return rows
 
 async def add_mod_log(guild_id: int, user_id: int, mod_id: int, action: str, reason: str, duration: Optional[str] = None):
-    await execute("INSERT INTO mod_logs (guild_id, user_id, moderator_id, action, reason, duration) VALUES (?, ?, ?, ?, ?, ?)", (guild_id, user_id, mod_id, action, reason, duration))
+    _log_buffer.add('mod_logs', (guild_id, user_id, mod_id, action, reason, duration, _utc_timestamp()))
 
 # Sistema de lista negra global (Blacklist)
+# Todos los IDs se mantienen en memoria: comprobar un mensaje o una interacción es
+# buscar en un frozenset. Cualquier escritura en global_blacklist (de este proceso
+# o del dashboard, vía el bus) marca el índice como desactualizado y la siguiente
+# comprobación lo recarga con una sola consulta.
+_blacklist: frozenset = frozenset()
+_blacklist_version = 0
+_blacklist_loaded_version = -1
+
+def _invalidate_blacklist(key: Optional[int] = None):
+    global _blacklist_version
+    _blacklist_version += 1
+
+subscribe_invalidation('global_blacklist', _invalidate_blacklist)
+
+async def load_blacklist() -> frozenset:
+    """IDs de la lista negra; solo toca la base de datos si hubo cambios desde la última carga."""
+    global _blacklist, _blacklist_loaded_version
+    while _blacklist_loaded_version != _blacklist_version:
+        version = _blacklist_version
+        rows = await fetchall("SELECT discord_id FROM global_blacklist")
+        _blacklist = frozenset(row['discord_id'] for row in rows)
+        _blacklist_loaded_version = version
+    return _blacklist
+
 async def add_to_blacklist(discord_id: int, entity_type: str, reason: str = ""):
-    await execute("INSERT OR REPLACE INTO global_blacklist (discord_id, entity_type, reason) VALUES (?, ?, ?)", (discord_id, entity_type, reason))
+    await execute("INSERT OR REPLACE INTO global_blacklist (discord_id, entity_type, reason) VALUES (?, ?, ?)", (discord_id, entity_type, reason),
+                  invalidates=('global_blacklist', discord_id))
 
 async def remove_from_blacklist(discord_id: int):
-    await execute("DELETE FROM global_blacklist WHERE discord_id = ?", (discord_id,))
+    await execute("DELETE FROM global_blacklist WHERE discord_id = ?", (discord_id,), invalidates=('global_blacklist', discord_id))
 
-async def is_blacklisted(discord_id: int) -> bool:
-    result = await fetchone("SELECT discord_id FROM global_blacklist WHERE discord_id = ?", (discord_id,))
-    return result is not None
+async def is_blacklisted(*discord_ids: Optional[int]) -> bool:
+    """True si alguno de los IDs (usuario, servidor...) está en la lista negra. Se ignoran los None."""
+    blacklist = _blacklist if _blacklist_loaded_version == _blacklist_version else await load_blacklist()
+    return any(discord_id in blacklist for discord_id in discord_ids if discord_id is not None)
 
 async def get_all_blacklisted():
     return await fetchall("SELECT discord_id, entity_type, reason, date_added FROM global_blacklist ORDER BY date_added DESC")
@@ -416,27 +1698,108 @@ async def get_bot_guilds():
 async def log_global_command(guild_id: int, guild_name: str, user_id: int, user_name: str, command_name: str):
     # Asegurar que el nombre del servidor no sea None o vacío para el dashboard
     safe_guild_name = guild_name if (guild_name and guild_name.strip()) else f"ID: {guild_id}"
-    await execute("INSERT INTO global_command_logs (guild_id, guild_name, user_id, user_name, command_name) VALUES (?, ?, ?, ?, ?)",
-                 (guild_id, safe_guild_name, user_id, user_name, command_name))
+    _log_buffer.add('global_command_logs', (guild_id, safe_guild_name, user_id, user_name, command_name, _utc_timestamp()))
 
 async def get_recent_global_logs(limit: int = 50):
+    await flush_log_buffer()
     return await fetchall("SELECT * FROM global_command_logs ORDER BY timestamp DESC LIMIT ?", (limit,))
 
 # Registro de eventos del bot
 async def log_system_event(level: str, category: str, message: str):
-    await execute("INSERT INTO bot_logs (level, category, message) VALUES (?, ?, ?)", (level, category, message))
+    _log_buffer.add('bot_logs', (level, category, message, _utc_timestamp()))
 
 async def get_recent_system_logs(limit: int = 50):
+    await flush_log_buffer()
     return await fetchall("SELECT * FROM bot_logs ORDER BY timestamp DESC LIMIT ?", (limit,))
 
 # Auditoría de acciones administrativas en el dashboard
 async def log_admin_action(user_id: int, user_name: str, action: str, target_id: str = None, details: str = None):
-    await execute("INSERT INTO admin_audit_logs (user_id, user_name, action, target_id, details) VALUES (?, ?, ?, ?, ?)",
-                 (user_id, user_name, action, target_id, details))
+    _log_buffer.add('admin_audit_logs', (user_id, user_name, action, target_id, details, _utc_timestamp()))
 
 async def get_recent_admin_audit_logs(limit: int = 50):
+    await flush_log_buffer()
     return await fetchall("SELECT * FROM admin_audit_logs ORDER BY timestamp DESC LIMIT ?", (limit,))
 
+# --- Compactación de logs ---
+# Los comandos se agregan por hora en command_stats_hourly (guild_id, command_name, count)
+# y las filas crudas de global_command_logs y bot_logs se borran pasada la retención.
+# Solo se agregan horas ya cerradas (con un margen para los logs que aún estén en el
+# buffer de otro proceso) y nunca se borran filas crudas que no estén agregadas.
+LOG_RETENTION_DAYS = float(os.environ.get("LOG_RETENTION_DAYS", "30"))
+SYSTEM_LOG_RETENTION_DAYS = float(os.environ.get("SYSTEM_LOG_RETENTION_DAYS", str(LOG_RETENTION_DAYS)))
+ROLLUP_GRACE_SECONDS = 300
+PRUNE_BATCH_SIZE = 5000
+
+_COMMAND_ROLLUP = """
+    INSERT INTO command_stats_hourly (hour, guild_id, command_name, count)
+    SELECT strftime('%Y-%m-%d %H:00:00', timestamp), COALESCE(guild_id, 0), COALESCE(command_name, ''), COUNT(*)
+    FROM global_command_logs
+    WHERE timestamp >= ? AND timestamp < ?
+    GROUP BY 1, 2, 3
+    ON CONFLICT(hour, guild_id, command_name) DO UPDATE SET count = count + excluded.count
+"""
+
+def _hour_floor(moment: datetime.datetime) -> str:
+    return moment.strftime('%Y-%m-%d %H:00:00')
+
+def _rollup_command_logs(conn: sqlite3.Connection, until_hour: str) -> int:
+    with conn:
+        row = conn.execute("SELECT value FROM rollup_state WHERE name = 'global_command_logs'").fetchone()
+        since = row[0] if row else ''
+        if since >= until_hour:
+            return 0
+        rolled = conn.execute(_COMMAND_ROLLUP, (since, until_hour)).rowcount
+        conn.execute("INSERT INTO rollup_state (name, value) VALUES ('global_command_logs', ?) "
+                     "ON CONFLICT(name) DO UPDATE SET value = excluded.value", (until_hour,))
+    return rolled
+
+def _prune_batch(conn: sqlite3.Connection, table: str, cutoff: str) -> int:
+    with conn:
+        return conn.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE timestamp < ? ORDER BY timestamp LIMIT ?)",
+                            (cutoff, PRUNE_BATCH_SIZE)).rowcount
+
+async def _prune_logs(table: str, cutoff: str) -> int:
+    """Borra por lotes para no retener el hilo escritor durante mucho tiempo."""
+    total = 0
+    while True:
+        deleted = await _manager.run_write(lambda conn: _prune_batch(conn, table, cutoff), f"LOG PRUNE: {table}")
+        total += deleted
+        if deleted < PRUNE_BATCH_SIZE:
+            return total
+        await asyncio.sleep(0)
+
+async def compact_logs(now: Optional[datetime.datetime] = None) -> Dict[str, int]:
+    """Agrega las horas cerradas de global_command_logs y aplica la retención a los logs crudos."""
+    await flush_log_buffer()
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    until_hour = _hour_floor(now - datetime.timedelta(seconds=ROLLUP_GRACE_SECONDS))
+    rolled = await _manager.run_write(lambda conn: _rollup_command_logs(conn, until_hour), "LOG ROLLUP: global_command_logs")
+
+    command_cutoff = min((now - datetime.timedelta(days=LOG_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S'), until_hour)
+    system_cutoff = (now - datetime.timedelta(days=SYSTEM_LOG_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    return {
+        'rolled_up_groups': rolled,
+        'pruned_command_logs': await _prune_logs('global_command_logs', command_cutoff),
+        'pruned_system_logs': await _prune_logs('bot_logs', system_cutoff),
+    }
+
+async def get_total_commands_run() -> int:
+    """Comandos ejecutados desde siempre: agregados + filas crudas aún sin agregar."""
+    row = await fetchone("""
+        SELECT (SELECT COALESCE(SUM(count), 0) FROM command_stats_hourly)
+             + (SELECT COUNT(*) FROM global_command_logs
+                WHERE timestamp >= COALESCE((SELECT value FROM rollup_state WHERE name = 'global_command_logs'), '')) AS total
+    """)
+    return row['total'] if row else 0
+
+async def get_command_usage(hours: int = 24, limit: int = 10) -> List[Dict[str, Any]]:
+    """Comandos más usados en las últimas `hours` horas cerradas, leídos de los agregados."""
+    since = _hour_floor(datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=hours))
+    return await fetchall(
+        "SELECT command_name, SUM(count) AS uses FROM command_stats_hourly WHERE hour >= ? GROUP BY command_name ORDER BY uses DESC LIMIT ?",
+        (since, limit)
+    )
+
 async def record_dashboard_login(user_id: int, username: str, avatar: str):
     await execute(
         "INSERT INTO dashboard_users (user_id, username, avatar, last_login) VALUES (?, ?, ?, CURRENT_TIMESTAMP) ON CONFLICT(user_id) DO UPDATE SET username=excluded.username, avatar=excluded.avatar, last_login=CURRENT_TIMESTAMP",
@@ -0,0 +1,83 @@
+import sqlite3
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# Herramientas sobre economy_ledger (libro mayor de solo inserción). Trabajan sobre
+# una conexión sqlite3 normal para poder usarse también con el bot apagado, desde
+# scripts/economy_ledger.py, p. ej. sobre una copia de la base de datos dañada.
+
+_BALANCES_SCAN = "SELECT guild_id, user_id, wallet, bank FROM balances {where} ORDER BY guild_id, user_id"
+_LEDGER_SCAN = ("SELECT guild_id, user_id, SUM(delta_wallet) AS wallet, SUM(delta_bank) AS bank, COUNT(*) AS entries "
+                "FROM economy_ledger {where} GROUP BY guild_id, user_id ORDER BY guild_id, user_id")
+
+def _scope(guild_id: Optional[int]) -> Tuple[str, tuple]:
+    return ("WHERE guild_id = ?", (guild_id,)) if guild_id is not None else ("", ())
+
+def iter_drift(conn: sqlite3.Connection, guild_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Recorre balances y las sumas del ledger a la vez, en orden de clave, y emite cada diferencia.
+
+    Los dos cursores avanzan en paralelo (merge join sobre (guild_id, user_id), ambos
+    servidos por índice), así que la memoria no depende del número de usuarios.
+    """
+    where, params = _scope(guild_id)
+    # Con el primer cursor abierto, el segundo lee de la misma instantánea
+    balances = conn.execute(_BALANCES_SCAN.format(where=where), params)
+    ledger = conn.execute(_LEDGER_SCAN.format(where=where), params)
+    balance = balances.fetchone()
+    summed = ledger.fetchone()
+    while balance is not None or summed is not None:
+        balance_key = (balance[0], balance[1]) if balance is not None else None
+        ledger_key = (summed[0], summed[1]) if summed is not None else None
+        if ledger_key is None or (balance_key is not None and balance_key < ledger_key):
+            # Balance sin ningún movimiento en el ledger
+            if balance[2] or balance[3]:
+                yield _drift(balance_key, (balance[2], balance[3]), (0, 0), 0)
+            balance = balances.fetchone()
+        elif balance_key is None or ledger_key < balance_key:
+            # Movimientos de un usuario cuya fila de balances ya no existe
+            if summed[2] or summed[3]:
+                yield _drift(ledger_key, None, (summed[2], summed[3]), summed[4])
+            summed = ledger.fetchone()
+        else:
+            if (balance[2], balance[3]) != (summed[2], summed[3]):
+                yield _drift(balance_key, (balance[2], balance[3]), (summed[2], summed[3]), summed[4])
+            balance = balances.fetchone()
+            summed = ledger.fetchone()
+
+def _drift(key: Tuple[int, int], stored: Optional[Tuple[int, int]], expected: Tuple[int, int], entries: int) -> Dict[str, Any]:
+    return {
+        'guild_id': key[0], 'user_id': key[1],
+        'wallet': stored[0] if stored else None, 'bank': stored[1] if stored else None,
+        'ledger_wallet': expected[0], 'ledger_bank': expected[1], 'entries': entries,
+    }
+
+def check(conn: sqlite3.Connection, guild_id: Optional[int] = None, sample: int = 20) -> Dict[str, Any]:
+    """Resumen de la comprobación: cuántos usuarios no cuadran y unos cuantos de ejemplo."""
+    mismatches = 0
+    examples = []
+    for drift in iter_drift(conn, guild_id):
+        mismatches += 1
+        if len(examples) < sample:
+            examples.append(drift)
+    return {'ok': mismatches == 0, 'mismatches': mismatches, 'examples': examples}
+
+def replay(conn: sqlite3.Connection, guild_id: Optional[int] = None) -> Dict[str, int]:
+    """Reconstruye `balances` (todo o un servidor) a partir de la suma de sus movimientos.
+
+    Los balances sin movimientos se dejan a cero. Todo ocurre en una transacción.
+    """
+    where, params = _scope(guild_id)
+    ledger_where = where or "WHERE true"  # WHERE obligatorio antes de ON CONFLICT en un INSERT ... SELECT
+    with conn:
+        restored = conn.execute(f"""
+            INSERT INTO balances (guild_id, user_id, wallet, bank)
+            SELECT guild_id, user_id, SUM(delta_wallet), SUM(delta_bank) FROM economy_ledger {ledger_where}
+            GROUP BY guild_id, user_id
+            ON CONFLICT(guild_id, user_id) DO UPDATE SET wallet = excluded.wallet, bank = excluded.bank
+            WHERE wallet != excluded.wallet OR bank != excluded.bank
+        """, params).rowcount
+        balances_where = f"{where} AND" if where else "WHERE"
+        zeroed = conn.execute(f"""
+            UPDATE balances SET wallet = 0, bank = 0 {balances_where} (wallet != 0 OR bank != 0)
+            AND NOT EXISTS (SELECT 1 FROM economy_ledger l WHERE l.guild_id = balances.guild_id AND l.user_id = balances.user_id)
+        """, params).rowcount
+    return {'restored': restored, 'zeroed': zeroed}
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+import discord
+
+from utils import database_manager as db
+from utils.rate_limiter import TokenBuckets
+
+# Envío de un mensaje a todos los servidores (anuncios globales) con varios envíos
+# en vuelo a la vez. discord.py ya respeta los buckets por ruta (cada canal es una
+# ruta distinta); aquí se añade un tope propio por debajo del límite global de
+# Discord (50 peticiones/s por bot) para dejar margen al resto del bot, y un 429
+# pausa a todos los envíos. El resultado de cada servidor se guarda por lotes en
+# broadcast_deliveries: si el proceso muere, al reintentar la tarea se salta lo
+# ya entregado (como mucho se repite el último lote sin guardar).
+
+FANOUT_CONCURRENCY = int(os.environ.get("FANOUT_CONCURRENCY", "8"))
+FANOUT_GLOBAL_RATE = float(os.environ.get("FANOUT_GLOBAL_RATE", "35"))
+# Reintentos por servidor ante errores de red o 5xx/429 (los 4xx no se reintentan)
+FANOUT_RETRIES = int(os.environ.get("FANOUT_RETRIES", "3"))
+# Resultados que se acumulan antes de escribirlos en la DB
+FANOUT_FLUSH_EVERY = int(os.environ.get("FANOUT_FLUSH_EVERY", "50"))
+
+Delivery = Tuple[str, Optional[int], Optional[str]]  # (status, channel_id, error)
+
+class ChannelResolver:
+    """Canal de anuncios de cada servidor: el de sistema o el primer canal de texto donde se pueda escribir.
+
+    El resultado se cachea por servidor; el canal cacheado se vuelve a validar
+    (sigue existiendo y se puede escribir) en cada uso, así que solo se recorren
+    los canales del servidor la primera vez o cuando deja de servir.
+    """
+
+    def __init__(self):
+        self._channels: Dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._channels)
+
+    @staticmethod
+    def _can_send(guild, channel) -> bool:
+        return channel is not None and channel.permissions_for(guild.me).send_messages
+
+    def resolve(self, guild) -> Optional[Any]:
+        cached = self._channels.get(guild.id)
+        if cached is not None:
+            channel = guild.get_channel(cached)
+            if self._can_send(guild, channel):
+                return channel
+            del self._channels[guild.id]
+        if self._can_send(guild, guild.system_channel):
+            channel = guild.system_channel
+        else:
+            channel = next((c for c in guild.text_channels if self._can_send(guild, c)), None)
+        if channel is not None:
+            self._channels[guild.id] = channel.id
+        return channel
+
+    def forget(self, guild_id: int):
+        self._channels.pop(guild_id, None)
+
+channel_resolver = ChannelResolver()
+
+def _retry_after(error: discord.HTTPException) -> float:
+    headers = getattr(error.response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After', 1.0))
+    except (TypeError, ValueError):
+        return 1.0
+
+class BroadcastFanOut:
+    """Entrega `send(channel)` en cada servidor con concurrencia acotada y progreso reanudable.
+
+    Con `task_id` los resultados se guardan en broadcast_deliveries y los
+    servidores que ya tienen resultado se saltan; sin él no se toca la DB.
+    """
+
+    def __init__(self, send: Callable[[Any], Awaitable[Any]], task_id: Optional[int] = None,
+                 resolver: ChannelResolver = channel_resolver, concurrency: int = FANOUT_CONCURRENCY,
+                 rate: float = FANOUT_GLOBAL_RATE, retries: int = FANOUT_RETRIES, flush_every: int = FANOUT_FLUSH_EVERY,
+                 on_progress: Optional[Callable[[Dict[str, int]], Any]] = None, clock: Callable[[], float] = time.monotonic):
+        self.send = send
+        self.task_id = task_id
+        self.resolver = resolver
+        self.concurrency = max(1, concurrency)
+        self.retries = retries
+        self.flush_every = flush_every
+        self.on_progress = on_progress
+        self.clock = clock
+        # Ráfaga de como mucho un segundo de envíos y luego `rate` por segundo
+        self._bucket = TokenBuckets(max(rate, 1.0), 1.0 / rate, clock=clock)
+        self._paused_until = 0.0
+        self._rows: List[tuple] = []
+        self.counts = {'total': 0, 'resumed': 0, 'sent': 0, 'skipped': 0, 'failed': 0}
+
+    def progress(self) -> Dict[str, int]:
+        return dict(self.counts)
+
+    async def _acquire(self):
+        """Espera turno en el cubo global (y a que pase un 429 si lo hubo)."""
+        while True:
+            now = self.clock()
+            wait = max(self._paused_until - now, self._bucket.wait_time('global', 1, now))
+            if wait <= 0:
+                self._bucket.consume('global', 1, now)
+                return
+            await asyncio.sleep(wait)
+
+    async def _deliver(self, guild) -> Delivery:
+        error: Any = None
+        channel_id = None
+        stale_channel = False
+        for attempt in range(self.retries + 1):
+            channel = self.resolver.resolve(guild)
+            if channel is None:
+                return 'skipped', None, "sin canal donde escribir"
+            channel_id = channel.id
+            await self._acquire()
+            try:
+                await self.send(channel)
+                return 'sent', channel_id, None
+            except (discord.Forbidden, discord.NotFound) as e:
+                error = e
+                # Permisos o canal cambiados desde que se cacheó: se resuelve otra vez, una sola
+                self.resolver.forget(guild.id)
+                if stale_channel:
+                    break
+                stale_channel = True
+            except discord.HTTPException as e:
+                error = e
+                if e.status == 429:
+                    self._paused_until = max(self._paused_until, self.clock() + _retry_after(e))
+                elif e.status < 500:
+                    break
+                else:
+                    await asyncio.sleep(2 ** attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+                await asyncio.sleep(2 ** attempt)
+        return 'failed', channel_id, str(error)[:200]
+
+    async def flush(self):
+        rows, self._rows = self._rows, []
+        if self.task_id is not None and rows:
+            await db.record_broadcast_deliveries(self.task_id, rows)
+
+    async def _worker(self, guilds):
+        for guild in guilds:
+            try:
+                status, channel_id, error = await self._deliver(guild)
+            except Exception as e:
+                status, channel_id, error = 'failed', None, str(e)[:200]
+            self.counts[status] += 1
+            self._rows.append((guild.id, channel_id, status, error, time.time()))
+            if len(self._rows) >= self.flush_every:
+                await self.flush()
+            if self.on_progress:
+                self.on_progress(self.progress())
+
+    async def run(self, guilds: Iterable[Any]) -> Dict[str, int]:
+        guilds = list(guilds)
+        self.counts['total'] = len(guilds)
+        if self.task_id is not None:
+            done = await db.get_broadcast_delivered(self.task_id)
+            await db.set_broadcast_total(self.task_id, len(guilds))
+            pending = [guild for guild in guilds if guild.id not in done]
+            self.counts['resumed'] = len(guilds) - len(pending)
+        else:
+            pending = guilds
+        # Un único iterador compartido: cada trabajador toma el siguiente servidor libre
+        shared = iter(pending)
+        workers = [asyncio.create_task(self._worker(shared)) for _ in range(min(self.concurrency, len(pending)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            raise
+        finally:
+            # También al cancelar: lo ya enviado no se repite al reanudar
+            await self.flush()
+        return self.progress()
@@ -0,0 +1,189 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Renderizado de imágenes (tarjeta de /rank, banners, carteles) en procesos aparte:
+# el trabajo de PIL no retiene el GIL del proceso del bot y el bucle de eventos
+# (y con él los heartbeats del gateway) sigue respondiendo aunque haya mucha carga.
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Renders en cola como máximo; por encima se rechaza en lugar de acumular retraso
+IMAGE_MAX_QUEUE = int(os.environ.get("IMAGE_MAX_QUEUE", "64"))
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "arial.ttf")
+RANK_CARD_SIZE = (934, 282)
+RANK_AVATAR_SIZE = 200
+RANK_BAR_BOX = (260, 200, 890, 236)
+
+class ImageServiceBusy(Exception):
+    """La cola de renderizado está llena; el llamante debe responder sin imagen."""
+
+# --- Código que corre dentro de cada proceso trabajador ---
+
+_worker: Dict[str, Any] = {}
+
+def _load_font(size: int):
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except IOError:
+        return ImageFont.load_default()
+
+def _init_worker():
+    """Precarga fuentes y capas estáticas una sola vez por proceso."""
+    if _worker:
+        return
+    _worker['fonts'] = {size: _load_font(size) for size in (24, 32, 36, 40, 60)}
+
+    card = Image.new("RGBA", RANK_CARD_SIZE, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(card)
+    draw.rounded_rectangle((0, 0, RANK_CARD_SIZE[0] - 1, RANK_CARD_SIZE[1] - 1), radius=28, fill=(35, 39, 42, 255))
+    draw.rounded_rectangle(RANK_BAR_BOX, radius=18, fill=(72, 75, 78, 255))
+    _worker['rank_base'] = card
+
+    mask = Image.new("L", (RANK_AVATAR_SIZE, RANK_AVATAR_SIZE), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, RANK_AVATAR_SIZE, RANK_AVATAR_SIZE), fill=255)
+    _worker['avatar_mask'] = mask
+    _worker['banner_mask'] = Image.new("L", (256, 256), 0)
+    ImageDraw.Draw(_worker['banner_mask']).ellipse((0, 0, 256, 256), fill=255)
+
+def _to_png(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def _render_rank_card(avatar_bytes: Optional[bytes], name: str, level: int, xp: int, xp_needed: int,
+                      rank: Optional[int], total: Optional[int], accent: str = "#ff6b9e") -> bytes:
+    _init_worker()
+    fonts = _worker['fonts']
+    card = _worker['rank_base'].copy()
+    draw = ImageDraw.Draw(card)
+
+    if avatar_bytes:
+        avatar = Image.open(BytesIO(avatar_bytes)).convert("RGBA").resize((RANK_AVATAR_SIZE, RANK_AVATAR_SIZE))
+        card.paste(avatar, (40, 41), _worker['avatar_mask'])
+    else:
+        draw.ellipse((40, 41, 40 + RANK_AVATAR_SIZE, 41 + RANK_AVATAR_SIZE), fill=accent)
+
+    x0, y0, x1, y1 = RANK_BAR_BOX
+    progress = max(0.0, min(1.0, xp / xp_needed)) if xp_needed > 0 else 0.0
+    if progress > 0:
+        draw.rounded_rectangle((x0, y0, x0 + max(int((x1 - x0) * progress), y1 - y0), y1), radius=18, fill=accent)
+
+    draw.text((x0, y0 - 16), name[:24], fill="white", font=fonts[40], anchor="ls")
+    draw.text((x1, y0 - 16), f"{xp:,} / {xp_needed:,} XP", fill=(200, 200, 200), font=fonts[24], anchor="rs")
+    draw.text((x1, 70), f"NIVEL {level}", fill=accent, font=fonts[60], anchor="rs")
+    if rank:
+        label = f"#{rank:,}" + (f" de {total:,}" if total else "")
+        draw.text((x0, 70), label, fill="white", font=fonts[36], anchor="ls")
+    return _to_png(card)
+
+def _render_banner(background_bytes: bytes, avatar_bytes: bytes, name: str, message: str,
+                   title_color: str, subtitle_color: str) -> bytes:
+    _init_worker()
+    fonts = _worker['fonts']
+    bg = Image.open(BytesIO(background_bytes)).convert("RGBA").resize((1000, 400))
+    avatar = Image.open(BytesIO(avatar_bytes)).convert("RGBA").resize((256, 256))
+    bg.paste(avatar, (372, 20), _worker['banner_mask'])
+    draw = ImageDraw.Draw(bg)
+    draw.text((500, 320), name, fill=title_color, font=fonts[60], anchor="ms", stroke_width=2, stroke_fill="black")
+    draw.text((500, 365), message, fill=subtitle_color, font=fonts[32], anchor="ms", stroke_width=1, stroke_fill="black")
+    return _to_png(bg)
+
+def _render_wanted(template_bytes: bytes, avatar_bytes: bytes) -> bytes:
+    template = Image.open(BytesIO(template_bytes)).convert("RGBA")
+    avatar = Image.open(BytesIO(avatar_bytes)).convert("RGBA").resize((833, 820))
+    template.paste(avatar, (96, 445), avatar)
+    return _to_png(template)
+
+_RENDERERS = {
+    'rank_card': _render_rank_card,
+    'banner': _render_banner,
+    'wanted': _render_wanted,
+}
+
+def _render(kind: str, args: tuple) -> bytes:
+    return _RENDERERS[kind](*args)
+
+# --- Lado del bot ---
+
+class ImageService:
+    """Pool de procesos para renderizar imágenes con concurrencia acotada y contrapresión.
+
+    Como mucho `workers` renders a la vez y `max_queue` esperando; si la cola está
+    llena render() lanza ImageServiceBusy al momento en vez de seguir acumulando.
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS, max_queue: int = IMAGE_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._starting: Optional[asyncio.Future] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop = None
+        self._queued = 0
+        self.rendered = 0
+        self.rejected = 0
+
+    def _start_sync(self) -> ProcessPoolExecutor:
+        # forkserver/spawn: no heredar hilos (p. ej. el escritor de la DB) ni importar main.py
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        if method == "forkserver":
+            context.set_forkserver_preload([__name__])
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker)
+        # El primer submit lanza los procesos: que ocurra aquí y no en el bucle de eventos
+        executor.submit(_init_worker).result()
+        return executor
+
+    async def start(self):
+        """Lanza los procesos trabajadores (en un hilo, sin bloquear el bucle de eventos)."""
+        if self._starting is None or self._starting.done() and self._executor is None:
+            self._starting = asyncio.ensure_future(asyncio.to_thread(self._start_sync))
+            self._starting.add_done_callback(self._on_started)
+        await asyncio.shield(self._starting)
+
+    def _on_started(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is None:
+            self._executor = future.result()
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.workers)
+            self._slots_loop = loop
+        return self._slots
+
+    async def render(self, kind: str, *args) -> bytes:
+        if kind not in _RENDERERS:
+            raise ValueError(f"Tipo de imagen desconocido: {kind}")
+        slots = self._get_slots()
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise ImageServiceBusy(f"Hay {self._queued} imágenes en cola")
+        self._queued += 1
+        try:
+            async with slots:
+                if self._executor is None:
+                    await self.start()
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._executor, _render, kind, args)
+        finally:
+            self._queued -= 1
+        self.rendered += 1
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        return {'workers': self.workers, 'queued': self._queued, 'max_queue': self.max_queue,
+                'rendered': self.rendered, 'rejected': self.rejected}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._starting = None
+
+image_service = ImageService()
@@ -0,0 +1,29 @@
+import discord
+
+from utils import database_manager as db
+
+BLACKLISTED_MESSAGE = "🚫 No tienes permitido usar este bot."
+
+async def reject_blacklisted(interaction: discord.Interaction) -> bool:
+    """Responde y devuelve True si el usuario o el servidor de la interacción están en la lista negra."""
+    if not await db.is_blacklisted(interaction.user.id, interaction.guild_id):
+        return False
+    # El autocompletado pasa por el mismo check pero no admite un mensaje como respuesta
+    if interaction.type is not discord.InteractionType.autocomplete and not interaction.response.is_done():
+        await interaction.response.send_message(BLACKLISTED_MESSAGE, ephemeral=True)
+    return True
+
+class GuardedView(discord.ui.View):
+    """Base de las vistas del bot: los botones y menús no responden a la lista negra.
+
+    Las subclases que redefinen interaction_check deben llamar primero a super().
+    """
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return not await reject_blacklisted(interaction)
+
+class GuardedModal(discord.ui.Modal):
+    """Igual que GuardedView para los formularios (modales)."""
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return not await reject_blacklisted(interaction)
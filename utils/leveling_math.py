@@ -0,0 +1,95 @@
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+class LevelCurve(NamedTuple):
+    """XP para pasar del nivel l al l+1: a*l² + b*l + c (por defecto 5l² + 50l + 100).
+
+    Internamente se guarda el XP total acumulado; nivel y XP dentro del nivel se
+    derivan de él con la inversa cerrada de la curva acumulada.
+    """
+    a: int = 5
+    b: int = 50
+    c: int = 100
+
+    @classmethod
+    def from_settings(cls, settings: Optional[Dict[str, Any]]) -> "LevelCurve":
+        """Curva configurada en server_settings (xp_curve_a/b/c) o la curva por defecto."""
+        if not settings:
+            return DEFAULT_CURVE
+        values = [settings.get(f'xp_curve_{name}') for name in cls._fields]
+        return cls(*(default if value is None else int(value) for value, default in zip(values, cls._field_defaults.values())))
+
+    def is_valid(self) -> bool:
+        # Cada nivel debe costar al menos 1 XP para que la curva sea estrictamente creciente
+        return self.a >= 0 and self.b >= 0 and self.c > 0
+
+    def xp_for_next_level(self, level: int) -> int:
+        return self.a * level * level + self.b * level + self.c
+
+    def _cumulative(self, n):
+        # Suma de a*l² + b*l + c para l = 1..n; n(n+1)(2n+1) es siempre múltiplo de 6.
+        # Sirve tanto para enteros de Python como para arrays int64 de NumPy.
+        total = self.c * n
+        if self.b:
+            total = total + self.b * (n * (n + 1) // 2)
+        if self.a:
+            total = total + self.a * (n * (n + 1) * (2 * n + 1) // 6)
+        return total
+
+    def total_for_level(self, level: int) -> int:
+        """XP total necesario para llegar a `level` desde el nivel 1."""
+        return self._cumulative(max(level - 1, 0))
+
+    def _estimate_levels(self, total):
+        """Raíz real de S(n) = total (S es la suma acumulada), en coma flotante y vectorizada."""
+        a, b, c = self.a, self.b, self.c
+        total = np.asarray(total, dtype=np.float64)
+        if a == 0 and b == 0:
+            return total / c
+        if a == 0:
+            # Cuadrática: (b/2) n² + (b/2 + c) n - total = 0
+            p, q = b / 2, b / 2 + c
+            return (-q + np.sqrt(q * q + 4 * p * total)) / (2 * p)
+        # Cúbica: (a/3) n³ + (a+b)/2 n² + (a/6 + b/2 + c) n - total = 0, por Cardano
+        k3, k2, k1 = a / 3, (a + b) / 2, a / 6 + b / 2 + c
+        shift = k2 / (3 * k3)
+        p = (3 * k3 * k1 - k2 * k2) / (3 * k3 * k3)
+        q = (2 * k2 ** 3 - 9 * k3 * k2 * k1 - 27 * k3 * k3 * total) / (27 * k3 ** 3)
+        disc = (q / 2) ** 2 + (p / 3) ** 3
+        root = np.sqrt(np.maximum(disc, 0))
+        one_real = np.cbrt(-q / 2 + root) + np.cbrt(-q / 2 - root)
+        if p < 0:
+            # Tres raíces reales (disc < 0): la mayor es la que nos interesa
+            r = 2 * np.sqrt(-p / 3)
+            three_real = r * np.cos(np.arccos(np.clip(3 * q / (p * r), -1.0, 1.0)) / 3)
+            one_real = np.where(disc >= 0, one_real, three_real)
+        return one_real - shift
+
+    def level_for_total(self, total_xp: int) -> int:
+        """Nivel alcanzado con `total_xp`: fórmula cerrada + corrección entera exacta."""
+        if total_xp <= 0:
+            return 1
+        n = max(int(self._estimate_levels(total_xp)), 0)
+        # El redondeo en coma flotante se corrige en uno o dos pasos
+        while n > 0 and self._cumulative(n) > total_xp:
+            n -= 1
+        while self._cumulative(n + 1) <= total_xp:
+            n += 1
+        return n + 1
+
+    def split(self, total_xp: int) -> Tuple[int, int]:
+        """(nivel, XP dentro del nivel) a partir del XP total."""
+        level = self.level_for_total(total_xp)
+        return level, max(total_xp, 0) - self.total_for_level(level)
+
+    def split_many(self, totals: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Versión vectorizada de split() para recalcular servidores enteros de golpe."""
+        totals = np.maximum(np.asarray(totals, dtype=np.int64), 0)
+        n = np.maximum(np.floor(self._estimate_levels(totals)).astype(np.int64), 0)
+        for _ in range(2):
+            n = np.where((n > 0) & (self._cumulative(n) > totals), n - 1, n)
+            n = np.where(self._cumulative(n + 1) <= totals, n + 1, n)
+        return n + 1, totals - self._cumulative(n)
+
+DEFAULT_CURVE = LevelCurve()
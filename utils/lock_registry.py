@@ -0,0 +1,72 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Hashable, List
+
+class LockRegistry:
+    """Candados asyncio por clave (p. ej. (guild_id, user_id)) que se liberan solos.
+
+    Los candados se guardan en un WeakValueDictionary: existen mientras alguien los
+    tiene o espera por ellos y desaparecen en cuanto nadie los usa, así que el
+    registro no crece con cada usuario que ha pasado alguna vez por el bot.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._locks: "weakref.WeakValueDictionary[Hashable, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def __len__(self):
+        return len(self._locks)
+
+    def get(self, key: Hashable) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def hold(self, *keys: Hashable) -> AsyncIterator[None]:
+        """`async with registry.hold(k1, k2, ...)`: toma los candados de todas las claves.
+
+        Se toman siempre en orden para que dos operaciones cruzadas (A paga a B
+        mientras B roba a A) no se bloqueen mutuamente.
+        """
+        locks = [self.get(key) for key in sorted(set(keys))]
+        acquired: List[asyncio.Lock] = []
+        try:
+            for lock in locks:
+                contended = lock.locked()
+                start = time.perf_counter()
+                await lock.acquire()
+                acquired.append(lock)
+                self._record(contended, time.perf_counter() - start)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def _record(self, contended: bool, wait: float):
+        self.acquisitions += 1
+        if contended:
+            self.contended += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'live_locks': len(self._locks),
+            'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'contention_rate': round(self.contended / self.acquisitions, 4) if self.acquisitions else 0.0,
+            'avg_wait_ms': round(self.total_wait * 1000 / self.contended, 3) if self.contended else 0.0,
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+        }
+
+# Saldo de cada usuario en cada servidor: lo comparten economía y casino
+balance_locks = LockRegistry("balances")
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+class LRUCache:
+    """Caché LRU acotada para valores que se cargan de forma asíncrona (p. ej. desde la DB).
+
+    - Como mucho `max_size` entradas: al llenarse se expulsa la menos usada.
+    - Una entrada es fresca durante `ttl` segundos. Después, y durante `stale_ttl`
+      segundos más, se sigue devolviendo al instante mientras se recarga en segundo
+      plano (stale-while-revalidate). Pasado ese margen se recarga esperando.
+    - Las cargas concurrentes de la misma clave se agrupan en una sola.
+    - invalidate() descarta la entrada y evita que una carga en curso guarde un valor viejo.
+    """
+
+    def __init__(self, name: str, max_size: int = 1024, ttl: float = 600.0, stale_ttl: float = 3600.0):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self._invalidated_while_loading = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.refreshes = 0
+        self.load_errors = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Devuelve el valor guardado sin tocar el orden LRU ni los contadores."""
+        entry = self._data.get(key)
+        return entry[0] if entry else default
+
+    def get_fresh(self, key: Hashable, default: Any = None) -> Any:
+        """Lectura síncrona: el valor si sigue dentro del TTL (cuenta como acierto o fallo)."""
+        entry = self._data.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry[0]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (value, time.monotonic())
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self.invalidations += 1
+        self._data.pop(key, None)
+        if key in self._loading:
+            self._invalidated_while_loading.add(key)
+
+    def clear(self):
+        self.invalidations += 1
+        self._data.clear()
+        self._invalidated_while_loading.update(self._loading)
+
+    async def get(self, key: Hashable, loader: Callable[[Hashable], Awaitable[Any]]) -> Any:
+        """Devuelve el valor de `key`, cargándolo con `await loader(key)` si hace falta."""
+        entry = self._data.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age < self.ttl:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._data.move_to_end(key)
+                if key not in self._loading:
+                    self.refreshes += 1
+                    self._start_load(key, loader)
+                return value
+
+        self.misses += 1
+        future = self._loading.get(key) or self._start_load(key, loader)
+        return await asyncio.shield(future)
+
+    def _start_load(self, key: Hashable, loader: Callable[[Hashable], Awaitable[Any]]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_task(self._load(key, loader))
+        # Las recargas en segundo plano pueden fallar sin que nadie las espere
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._loading[key] = future
+        return future
+
+    async def _load(self, key: Hashable, loader: Callable[[Hashable], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader(key)
+        except Exception:
+            self.load_errors += 1
+            raise
+        finally:
+            self._loading.pop(key, None)
+            invalidated = key in self._invalidated_while_loading
+            self._invalidated_while_loading.discard(key)
+        if not invalidated:
+            self.set(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'refreshes': self.refreshes,
+            'load_errors': self.load_errors,
+            'hit_rate': round((self.hits + self.stale_hits) / lookups, 4) if lookups else None,
+        }
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Dict, Iterable, List
+
+import discord
+
+from utils import database_manager as db
+from utils.lru_cache import LRUCache
+
+# Nombres visibles por (guild_id, user_id), compartidos por los rankings y el gacha
+NAME_TTL = 600
+_name_cache = db.register_cache(LRUCache("member_names", max_size=20000, ttl=NAME_TTL, stale_ttl=0))
+
+# Discord acepta como mucho 100 IDs por petición de miembros del gateway
+QUERY_MEMBERS_LIMIT = 100
+
+def remember(member: discord.abc.User, guild_id: int):
+    _name_cache.set((guild_id, member.id), member.display_name)
+
+def forget(guild_id: int, user_id: int):
+    _name_cache.invalidate((guild_id, user_id))
+
+async def resolve_display_names(bot: discord.Client, guild: discord.Guild, user_ids: Iterable[int]) -> Dict[int, str]:
+    """Nombres visibles de varios usuarios con el mínimo de peticiones.
+
+    Orden: caché TTL → caché de miembros del servidor → una sola petición
+    query_members al gateway para los que falten → caché global de usuarios.
+    Nunca hace un fetch_user por fila.
+    """
+    names: Dict[int, str] = {}
+    missing: List[int] = []
+    for user_id in dict.fromkeys(user_ids):
+        name = _name_cache.get_fresh((guild.id, user_id))
+        if name is not None:
+            names[user_id] = name
+            continue
+        member = guild.get_member(user_id)
+        if member:
+            remember(member, guild.id)
+            names[user_id] = member.display_name
+        else:
+            missing.append(user_id)
+
+    if missing and not getattr(guild, 'chunked', False):
+        try:
+            for start in range(0, len(missing), QUERY_MEMBERS_LIMIT):
+                members = await guild.query_members(user_ids=missing[start:start + QUERY_MEMBERS_LIMIT], cache=True,
+                                                    limit=QUERY_MEMBERS_LIMIT)
+                for member in members:
+                    remember(member, guild.id)
+                    names[member.id] = member.display_name
+        except (asyncio.TimeoutError, discord.ClientException) as e:
+            print(f"No se pudieron consultar miembros de {guild.id}: {e}")
+
+    for user_id in missing:
+        if user_id in names:
+            continue
+        # Ya no está en el servidor: el nombre global si lo conocemos, sin ir a la API
+        user = bot.get_user(user_id)
+        names[user_id] = user.display_name if user else f"Usuario ({user_id})"
+    return names
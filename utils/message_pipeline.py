@@ -0,0 +1,158 @@
+import functools
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import discord
+
+from utils import database_manager as db
+
+# Un único listener de mensajes: se resuelve una vez el contexto del servidor
+# (ajustes, idioma, TTS, automod, niveles, lista negra) y se pasa a cada etapa
+# en orden fijo. Una etapa que devuelve True corta las siguientes (p. ej. el
+# automod borra el mensaje y no debe dar XP, leerse por TTS ni ejecutar comandos).
+
+# Muestras recientes por etapa para los percentiles
+PIPELINE_TIMING_SAMPLES = int(os.environ.get("PIPELINE_TIMING_SAMPLES", "512"))
+
+# Orden de las etapas registradas por los cogs y por el bot
+STAGE_AUTOMOD = 10
+STAGE_LEVELING = 20
+STAGE_TTS = 30
+STAGE_COMMANDS = 40
+
+CONTEXT_STAGE = "context"
+
+Stage = Callable[[discord.Message, "GuildContext"], Awaitable[Optional[bool]]]
+
+@functools.lru_cache(maxsize=1024)
+def parse_banned_words(raw: Optional[str]) -> Tuple[str, ...]:
+    """automod_banned_words ("a,b,c") en minúsculas; se parsea una vez por valor distinto."""
+    return tuple(word for word in (raw or '').lower().split(',') if word)
+
+class GuildContext:
+    """Lo que las etapas necesitan saber del servidor para un mensaje, resuelto una sola vez."""
+    __slots__ = ('guild_id', 'settings', 'language', 'prefix', 'blacklisted', 'leveling_enabled',
+                 'automod_enabled', 'banned_words', 'tts_enabled', 'tts_channel_id', 'tts_lang', 'stopped_by')
+
+    def __init__(self, guild_id: int, settings: Dict[str, Any], tts: Optional[Dict[str, Any]], blacklisted: bool):
+        self.guild_id = guild_id
+        self.settings = settings
+        self.language = settings.get('language', 'es')
+        self.prefix = settings.get('prefix', '!') or '!'
+        self.blacklisted = blacklisted
+        self.leveling_enabled = bool(settings.get('leveling_enabled'))
+        self.automod_enabled = bool(settings.get('mod_enabled', 1))
+        self.banned_words = parse_banned_words(settings.get('automod_banned_words'))
+        self.tts_enabled = tts is not None
+        self.tts_channel_id = tts['channel_id'] if tts else None
+        self.tts_lang = tts['lang'] if tts else 'es'
+        self.stopped_by: Optional[str] = None
+
+async def build_context(guild_id: int, author_id: int) -> GuildContext:
+    settings = await db.get_cached_server_settings(guild_id)
+    # Solo se mira la configuración de TTS si el módulo está activo
+    tts = await db.get_tts_config(guild_id) if settings.get('tts_enabled', 1) else None
+    return GuildContext(guild_id, settings, tts, await db.is_blacklisted(author_id, guild_id))
+
+class StageTiming:
+    """Llamadas, errores, cortes y tiempos (ms) de una etapa."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.stops = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=PIPELINE_TIMING_SAMPLES)
+
+    def record(self, elapsed: float):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.samples.append(elapsed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        samples = sorted(self.samples)
+        p95 = samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))] if samples else 0.0
+        return {
+            'stage': self.name,
+            'calls': self.calls,
+            'errors': self.errors,
+            'stops': self.stops,
+            'total_ms': round(self.total * 1000, 2),
+            'avg_ms': round(self.total * 1000 / (self.calls or 1), 3),
+            'p95_ms': round(p95 * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+class MessagePipeline:
+    """Etapas por orden; cada una recibe el mensaje y el GuildContext compartido."""
+
+    def __init__(self, context_builder: Callable[[int, int], Awaitable[GuildContext]] = build_context):
+        self.context_builder = context_builder
+        self._stages: List[Tuple[int, str, Stage]] = []
+        self._timings: Dict[str, StageTiming] = {CONTEXT_STAGE: StageTiming(CONTEXT_STAGE)}
+        # Contexto de los mensajes que se están procesando (lo usa get_prefix)
+        self._inflight: Dict[int, GuildContext] = {}
+
+    def register(self, name: str, stage: Stage, order: int):
+        """Añade (o sustituye, si ya existe con ese nombre) una etapa."""
+        self.unregister(name)
+        self._stages.append((order, name, stage))
+        self._stages.sort(key=lambda entry: entry[0])
+        self._timings.setdefault(name, StageTiming(name))
+
+    def unregister(self, name: str):
+        self._stages = [entry for entry in self._stages if entry[1] != name]
+
+    @property
+    def stages(self) -> List[str]:
+        return [name for _, name, _ in self._stages]
+
+    def context_for(self, message: discord.Message) -> Optional[GuildContext]:
+        return self._inflight.get(message.id)
+
+    async def run(self, message: discord.Message) -> Optional[GuildContext]:
+        """Procesa un mensaje de servidor. Devuelve el contexto (con stopped_by si alguna etapa cortó)."""
+        if message.author.bot or not message.guild:
+            return None
+        timing = self._timings[CONTEXT_STAGE]
+        started = time.perf_counter()
+        try:
+            context = await self.context_builder(message.guild.id, message.author.id)
+        except Exception as e:
+            timing.errors += 1
+            print(f"Error resolviendo el contexto del mensaje en {message.guild.id}: {e}")
+            return None
+        timing.record(time.perf_counter() - started)
+
+        self._inflight[message.id] = context
+        try:
+            # Copia: un cog puede (des)registrarse mientras se procesa el mensaje
+            for _, name, stage in list(self._stages):
+                timing = self._timings[name]
+                started = time.perf_counter()
+                try:
+                    stop = await stage(message, context)
+                except Exception as e:
+                    # Como los antiguos listeners independientes: un fallo no frena al resto
+                    timing.errors += 1
+                    print(f"Error en la etapa '{name}' del mensaje {message.id}: {e}")
+                    stop = False
+                timing.record(time.perf_counter() - started)
+                if stop:
+                    timing.stops += 1
+                    context.stopped_by = name
+                    break
+        finally:
+            self._inflight.pop(message.id, None)
+        return context
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Tiempos por etapa, con el contexto primero y las demás en orden de ejecución."""
+        names = [CONTEXT_STAGE] + [name for name in self.stages if name != CONTEXT_STAGE]
+        names += [name for name in self._timings if name not in names]
+        return [self._timings[name].to_dict() for name in names]
@@ -0,0 +1,138 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+# Consultas que tardan más que esto (en ms, solo ejecución) van al log de consultas lentas
+SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "200"))
+# Muestras recientes que se guardan por sentencia para calcular percentiles
+SAMPLE_SIZE = int(os.environ.get("DB_METRICS_SAMPLES", "512"))
+# Tope de sentencias distintas; a partir de ahí se agrupan en OTHER_KEY
+MAX_STATEMENTS = 500
+OTHER_KEY = "<otras sentencias>"
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_NAMED_RE = re.compile(r":\w+")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+def normalize_sql(query: str) -> str:
+    """Convierte una sentencia en su "forma": sin literales, con ? como marcadores y espacios colapsados."""
+    query = _STRING_RE.sub("?", query)
+    query = _NAMED_RE.sub("?", query)
+    query = _NUMBER_RE.sub("?", query)
+    query = _IN_LIST_RE.sub("(?, ...)", query)
+    return _SPACE_RE.sub(" ", query).strip()
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class StatementStats:
+    """Contadores acumulados y muestras recientes de una sentencia normalizada."""
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.calls = 0
+        self.rows = 0
+        self.total_exec = 0.0
+        self.total_queue_wait = 0.0
+        self.total_lock_wait = 0.0
+        self.max_exec = 0.0
+        self.slow_calls = 0
+        self.errors = 0
+        self.exec_samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+
+    def to_dict(self) -> Dict[str, Any]:
+        samples = sorted(self.exec_samples)
+        calls = self.calls or 1
+        return {
+            'sql': self.sql,
+            'calls': self.calls,
+            'errors': self.errors,
+            'slow_calls': self.slow_calls,
+            'rows': self.rows,
+            'avg_rows': round(self.rows / calls, 2),
+            'total_ms': round(self.total_exec * 1000, 3),
+            'avg_queue_wait_ms': round(self.total_queue_wait * 1000 / calls, 3),
+            'avg_lock_wait_ms': round(self.total_lock_wait * 1000 / calls, 3),
+            'p50_ms': round(_percentile(samples, 50) * 1000, 3),
+            'p95_ms': round(_percentile(samples, 95) * 1000, 3),
+            'p99_ms': round(_percentile(samples, 99) * 1000, 3),
+            'max_ms': round(self.max_exec * 1000, 3),
+        }
+
+class QueryMetrics:
+    """Registro de métricas por sentencia; se alimenta desde los hilos de la base de datos."""
+
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS, slow_log_size: int = 100):
+        self.slow_query_ms = slow_query_ms
+        self.enabled = True
+        self._stats: Dict[str, StatementStats] = {}
+        self._slow_log: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def record(self, query: str, queue_wait: float, lock_wait: float, exec_time: float, rows: int = 0, error: bool = False):
+        if not self.enabled:
+            return
+        sql = normalize_sql(query)
+        slow = exec_time * 1000 >= self.slow_query_ms
+        with self._lock:
+            stats = self._stats.get(sql)
+            if stats is None:
+                if len(self._stats) >= MAX_STATEMENTS:
+                    sql = OTHER_KEY
+                    stats = self._stats.get(sql)
+                if stats is None:
+                    stats = self._stats[sql] = StatementStats(sql)
+            stats.calls += 1
+            stats.rows += rows
+            stats.total_exec += exec_time
+            stats.total_queue_wait += queue_wait
+            stats.total_lock_wait += lock_wait
+            stats.max_exec = max(stats.max_exec, exec_time)
+            stats.exec_samples.append(exec_time)
+            if error:
+                stats.errors += 1
+            if slow:
+                stats.slow_calls += 1
+                self._slow_log.append({
+                    'sql': sql,
+                    'exec_ms': round(exec_time * 1000, 3),
+                    'queue_wait_ms': round(queue_wait * 1000, 3),
+                    'lock_wait_ms': round(lock_wait * 1000, 3),
+                    'rows': rows,
+                    'at': time.time(),
+                })
+        if slow:
+            print(f"[DB] Consulta lenta ({exec_time * 1000:.1f} ms): {sql[:300]}")
+
+    def top(self, limit: int = 20, sort: str = 'total_ms') -> List[Dict[str, Any]]:
+        """Las sentencias que más pesan según `sort` (total_ms, p99_ms, calls, avg_lock_wait_ms...)."""
+        with self._lock:
+            rows = [stats.to_dict() for stats in self._stats.values()]
+        if rows and sort not in rows[0]:
+            sort = 'total_ms'
+        rows.sort(key=lambda r: r[sort], reverse=True)
+        return rows[:limit]
+
+    def get(self, query: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            stats = self._stats.get(normalize_sql(query))
+            return stats.to_dict() if stats else None
+
+    def slow_queries(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._slow_log)[-limit:][::-1]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow_log.clear()
+
+metrics = QueryMetrics()
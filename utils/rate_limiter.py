@@ -0,0 +1,148 @@
+import math
+import os
+import time
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set
+
+# Límite global de comandos (prefijo y slash) con cubetas de tokens por usuario y
+# por servidor. Una cubeta llena equivale a no tener cubeta, así que cada clave se
+# agenda en una rueda temporal para el instante en que se habrá rellenado y se
+# borra entonces: la memoria depende de los usuarios activos, no de los históricos.
+
+def _env_set(name: str, default: str) -> Set[str]:
+    return {item.strip() for item in os.environ.get(name, default).split(',') if item.strip()}
+
+def _env_costs(name: str, default: str) -> Dict[str, float]:
+    """Formato "comando=coste,otro=coste"."""
+    costs = {}
+    for item in os.environ.get(name, default).split(','):
+        command, _, cost = item.partition('=')
+        if command.strip() and cost.strip():
+            costs[command.strip()] = float(cost)
+    return costs
+
+# Por usuario: ráfaga de 3 comandos y uno nuevo cada 3 s (el ritmo del antiguo cooldown de 3 s)
+RATE_LIMIT_USER_BURST = float(os.environ.get("RATE_LIMIT_USER_BURST", "3"))
+RATE_LIMIT_USER_PERIOD = float(os.environ.get("RATE_LIMIT_USER_PERIOD", "3"))
+# Por servidor: protege de que muchos usuarios a la vez saturen el bot desde un mismo sitio
+RATE_LIMIT_GUILD_BURST = float(os.environ.get("RATE_LIMIT_GUILD_BURST", "60"))
+RATE_LIMIT_GUILD_PERIOD = float(os.environ.get("RATE_LIMIT_GUILD_PERIOD", "0.5"))
+# Comandos que ya tienen su propio cooldown (economía) o que se usan en ráfaga (música)
+RATE_LIMIT_EXEMPT_COMMANDS = _env_set("RATE_LIMIT_EXEMPT_COMMANDS", "work,rob,daily,deposit,withdraw,balance,rank,play,pause,resume,skip")
+# Coste en tokens por comando (1 por defecto): los que generan imágenes o llaman a APIs externas cuestan más
+RATE_LIMIT_COSTS = _env_costs("RATE_LIMIT_COSTS", "wanted=2,ask=2")
+RATE_LIMIT_WHEEL_RESOLUTION = float(os.environ.get("RATE_LIMIT_WHEEL_RESOLUTION", "1.0"))
+
+class TokenBuckets:
+    """Cubetas de tokens por clave con expiración por rueda temporal.
+
+    `capacity` tokens como máximo y uno nuevo cada `period` segundos. Solo se
+    guardan las cubetas que no están llenas; cada una se agenda en la casilla de
+    la rueda del instante en que se llenará y se descarta al pasar por ella.
+    """
+
+    def __init__(self, capacity: float, period: float, resolution: float = RATE_LIMIT_WHEEL_RESOLUTION,
+                 clock: Callable[[], float] = time.monotonic):
+        self.capacity = capacity
+        self.rate = 1.0 / period
+        self.resolution = resolution
+        self.clock = clock
+        # La rueda cubre el tiempo máximo de rellenado: nunca hay que dar más de una vuelta
+        self._slots: List[Set[Hashable]] = [set() for _ in range(math.ceil(capacity * period / resolution) + 2)]
+        self._tick = math.floor(clock() / resolution)
+        # clave -> [tokens, instante de la última actualización, tick de expiración]
+        self._buckets: Dict[Hashable, list] = {}
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _advance(self, now: float):
+        tick = math.floor(now / self.resolution)
+        # Tras mucho tiempo sin actividad basta con una vuelta: todo lo agendado ya venció
+        start = max(self._tick + 1, tick - len(self._slots) + 1)
+        for current in range(start, tick + 1):
+            slot = self._slots[current % len(self._slots)]
+            for key in slot:
+                bucket = self._buckets.get(key)
+                if bucket is not None and bucket[2] <= current:
+                    del self._buckets[key]
+                    self.expired += 1
+            slot.clear()
+        self._tick = max(self._tick, tick)
+
+    def available(self, key: Hashable, now: Optional[float] = None) -> float:
+        now = self.clock() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        return min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+
+    def wait_time(self, key: Hashable, cost: float, now: Optional[float] = None) -> float:
+        """Segundos hasta que haya `cost` tokens (0 si ya los hay)."""
+        missing = min(cost, self.capacity) - self.available(key, now)
+        return max(0.0, missing / self.rate)
+
+    def consume(self, key: Hashable, cost: float, now: Optional[float] = None):
+        """Gasta `cost` tokens (llamar tras comprobar wait_time) y reagenda la expiración."""
+        now = self.clock() if now is None else now
+        self._advance(now)
+        tokens = self.available(key, now) - min(cost, self.capacity)
+        full_at = now + (self.capacity - tokens) / self.rate
+        expire_tick = math.ceil(full_at / self.resolution)
+        self._buckets[key] = [tokens, now, expire_tick]
+        self._slots[expire_tick % len(self._slots)].add(key)
+
+    def sweep(self, now: Optional[float] = None):
+        """Descarta las cubetas ya llenas aunque no haya tráfico nuevo."""
+        self._advance(self.clock() if now is None else now)
+
+class RateLimiter:
+    """Límite global: un comando pasa si hay tokens en la cubeta del usuario y en la del servidor."""
+
+    def __init__(self, user_burst: float = RATE_LIMIT_USER_BURST, user_period: float = RATE_LIMIT_USER_PERIOD,
+                 guild_burst: float = RATE_LIMIT_GUILD_BURST, guild_period: float = RATE_LIMIT_GUILD_PERIOD,
+                 costs: Optional[Dict[str, float]] = None, exempt_commands: Optional[Iterable[str]] = None,
+                 exempt_users: Iterable[int] = (), clock: Callable[[], float] = time.monotonic):
+        self.users = TokenBuckets(user_burst, user_period, clock=clock)
+        self.guilds = TokenBuckets(guild_burst, guild_period, clock=clock)
+        self.costs = dict(RATE_LIMIT_COSTS if costs is None else costs)
+        self.exempt_commands = set(RATE_LIMIT_EXEMPT_COMMANDS if exempt_commands is None else exempt_commands)
+        self.exempt_users = {int(user_id) for user_id in exempt_users}
+        self.clock = clock
+        self.allowed = 0
+        self.limited = 0
+
+    def is_exempt(self, user_id: int, command: Optional[str]) -> bool:
+        return command is None or command in self.exempt_commands or user_id in self.exempt_users
+
+    def hit(self, user_id: int, guild_id: Optional[int], command: Optional[str]) -> float:
+        """Registra un uso. Devuelve 0 si se permite o los segundos que faltan si no.
+
+        Si se rechaza no se gasta nada, ni del usuario ni del servidor.
+        """
+        if self.is_exempt(user_id, command):
+            return 0.0
+        now = self.clock()
+        cost = self.costs.get(command, 1.0)
+        wait = self.users.wait_time(user_id, cost, now)
+        if guild_id is not None:
+            wait = max(wait, self.guilds.wait_time(guild_id, cost, now))
+        if wait > 0:
+            self.limited += 1
+            return wait
+        self.users.consume(user_id, cost, now)
+        if guild_id is not None:
+            self.guilds.consume(guild_id, cost, now)
+        self.allowed += 1
+        return 0.0
+
+    def sweep(self):
+        """Descarta las cubetas llenas de usuarios y servidores (la expiración normal ocurre al consumir)."""
+        now = self.clock()
+        self.users.sweep(now)
+        self.guilds.sweep(now)
+
+    def stats(self) -> Dict[str, int]:
+        return {'tracked_users': len(self.users), 'tracked_guilds': len(self.guilds),
+                'allowed': self.allowed, 'limited': self.limited,
+                'expired': self.users.expired + self.guilds.expired}
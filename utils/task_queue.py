@@ -0,0 +1,140 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from utils import database_manager as db
+
+# Consumidor de broadcast_queue dirigido por eventos. Se despierta al instante
+# cuando la tarea se encola en el mismo proceso (run.py: bot y dashboard juntos)
+# y, si el dashboard corre aparte, con la vigilancia de PRAGMA data_version que
+# ya usa el bus de invalidación. Sin avisos solo duerme hasta el próximo
+# reintento o lease que venza, con TASK_IDLE_POLL como red de seguridad.
+
+# Duración del lease; las tareas largas lo renuevan cada tercio de este tiempo
+TASK_LEASE_SECONDS = float(os.environ.get("TASK_LEASE_SECONDS", "120"))
+# Espera antes del primer reintento; se dobla en cada intento fallido
+TASK_RETRY_DELAY = float(os.environ.get("TASK_RETRY_DELAY", "30"))
+TASK_IDLE_POLL = float(os.environ.get("TASK_IDLE_POLL", "300"))
+
+TaskHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+class TaskQueue:
+    """Ejecuta las tareas de broadcast_queue con el handler registrado para su tipo.
+
+    Un handler recibe la fila de la tarea (el payload va en 'message'); si lanza
+    una excepción la tarea se reintenta con espera exponencial hasta agotar max_attempts.
+    Solo se reclaman tareas de tipos con handler registrado.
+    """
+
+    def __init__(self, owner: Optional[str] = None, lease_seconds: float = TASK_LEASE_SECONDS,
+                 retry_delay: float = TASK_RETRY_DELAY, idle_poll: float = TASK_IDLE_POLL):
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.idle_poll = idle_poll
+        self.handlers: Dict[str, TaskHandler] = {}
+        self.completed = 0
+        self.failed = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, task_type: str, handler: TaskHandler):
+        self.handlers[task_type] = handler
+        # Puede haber tareas de este tipo esperando a que se cargue el cog
+        self.notify()
+
+    def unregister(self, task_type: str):
+        self.handlers.pop(task_type, None)
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _on_db_change(self):
+        self.notify()
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._wakeup = asyncio.Event()
+        db.add_task_listener(self.notify)
+        db.add_change_watcher(self._on_db_change)
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        """Detiene el consumidor. Una tarea a medias conserva su lease y se reintenta al caducar."""
+        db.remove_task_listener(self.notify)
+        db.remove_change_watcher(self._on_db_change)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            self._wakeup.clear()
+            due = None
+            try:
+                # Lectura barata antes de reclamar: los avisos de data_version llegan con cualquier escritura
+                due = await db.next_task_due(list(self.handlers))
+                if due is not None and due <= time.time():
+                    await self.run_pending()
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error en la cola de tareas: {e}")
+                due = time.time() + min(self.idle_poll, 5.0)
+            timeout = self.idle_poll if due is None else min(self.idle_poll, max(0.0, due - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_pending(self) -> int:
+        """Ejecuta las tareas disponibles hasta vaciar la cola. Devuelve cuántas se procesaron."""
+        processed = 0
+        while self.handlers:
+            task = await db.claim_task(list(self.handlers), self.owner, self.lease_seconds)
+            if task is None:
+                break
+            await self._execute(task)
+            processed += 1
+        return processed
+
+    async def _heartbeat(self, task_id: int):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await db.extend_task_lease(task_id, self.owner, self.lease_seconds):
+                return
+
+    async def _execute(self, task: Dict[str, Any]):
+        task_id, task_type = task['id'], task['type']
+        handler = self.handlers.get(task_type)
+        heartbeat = asyncio.create_task(self._heartbeat(task_id))
+        try:
+            if handler is None:
+                raise RuntimeError(f"sin handler para '{task_type}'")
+            await handler(task)
+        except Exception as e:
+            delay = self.retry_delay * 2 ** (task['attempts'] - 1)
+            status = await db.fail_task(task_id, self.owner, str(e)[:500], delay)
+            if status == 'failed':
+                self.failed += 1
+            print(f"Tarea {task_type} #{task_id} falló (intento {task['attempts']}/{task['max_attempts']}): {e}")
+            return
+        finally:
+            heartbeat.cancel()
+        if await db.complete_task(task_id, self.owner):
+            self.completed += 1
+        else:
+            print(f"Tarea {task_type} #{task_id} terminada tras perder su lease (la reclamó otro consumidor).")
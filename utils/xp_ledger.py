@@ -0,0 +1,170 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+from utils import database_manager as db
+from utils.leveling_math import DEFAULT_CURVE, LevelCurve
+
+XP_COOLDOWN_SECONDS = 60
+# Entradas limpias sin actividad durante este tiempo se sueltan de la RAM al volcar
+IDLE_EVICT_SECONDS = 900
+
+class XPEntry:
+    __slots__ = ('level', 'xp', 'total_xp', 'base_total', 'curve', 'stale',
+                 'last_gain', 'last_seen', 'version', 'flushed_version')
+
+    def __init__(self, level: int, xp: int, total_xp: int):
+        self.level = level
+        self.xp = xp
+        self.total_xp = total_xp
+        # XP total que hay en la DB (al cargar o en el último volcado)
+        self.base_total = total_xp
+        self.curve = DEFAULT_CURVE
+        # Otra escritura tocó la fila: se relee antes del próximo uso
+        self.stale = False
+        self.last_gain = 0.0
+        self.last_seen = time.monotonic()
+        self.version = 0
+        self.flushed_version = 0
+
+    @property
+    def dirty(self) -> bool:
+        return self.version != self.flushed_version
+
+    def set_total(self, total_xp: int, curve: LevelCurve):
+        self.total_xp = max(total_xp, 0)
+        self.curve = curve
+        self.level, self.xp = curve.split(self.total_xp)
+        self.version += 1
+
+    def refresh(self, row: Optional[dict]):
+        """Adopta la fila de la DB y vuelve a sumar el XP ganado en memoria y aún sin volcar."""
+        pending = self.total_xp - self.base_total
+        self.stale = False
+        if row:
+            self.level, self.xp, self.total_xp = row['level'], row['xp'], row['total_xp']
+        else:
+            self.level, self.xp, self.total_xp = 1, 0, 0
+        self.base_total = self.total_xp
+        if pending:
+            self.set_total(self.total_xp + pending, self.curve)
+
+class XPLedger:
+    """Nivel, XP y cooldown de ganancia de XP en memoria, por servidor y usuario.
+
+    Cada usuario se lee de la DB una sola vez; después los mensajes solo tocan la
+    RAM y flush() escribe las filas modificadas en una única transacción. El
+    cooldown de 60 s vive solo en memoria: tras un reinicio, como mucho, un
+    usuario gana XP una vez antes de tiempo.
+    """
+
+    def __init__(self, cooldown: float = XP_COOLDOWN_SECONDS):
+        self.cooldown = cooldown
+        self._guilds: Dict[int, Dict[int, XPEntry]] = {}
+        db.subscribe_invalidation('levels', self._on_levels_invalidated)
+
+    def close(self):
+        db.unsubscribe_invalidation('levels', self._on_levels_invalidated)
+
+    def __len__(self):
+        return sum(len(users) for users in self._guilds.values())
+
+    def _on_levels_invalidated(self, guild_id: Optional[int]):
+        # Una escritura externa en `levels` manda sobre lo que haya en memoria, pero sin
+        # perder el XP sin volcar ni los cooldowns: las filas se releen al usarlas y se
+        # les vuelve a sumar lo pendiente (ver XPEntry.refresh)
+        guilds = self._guilds.values() if guild_id is None else [self._guilds.get(guild_id, {})]
+        for users in guilds:
+            for entry in users.values():
+                entry.stale = True
+
+    @staticmethod
+    async def _read_row(guild_id: int, user_id: int) -> Optional[dict]:
+        return await db.fetchone("SELECT level, xp, total_xp FROM levels WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+
+    async def _entry(self, guild_id: int, user_id: int) -> XPEntry:
+        users = self._guilds.setdefault(guild_id, {})
+        entry = users.get(user_id)
+        if entry is None:
+            row = await self._read_row(guild_id, user_id)
+            # Otra corrutina pudo cargarlo mientras esperábamos
+            entry = self._guilds.setdefault(guild_id, {}).get(user_id)
+            if entry is None:
+                entry = XPEntry(row['level'], row['xp'], row['total_xp']) if row else XPEntry(1, 0, 0)
+                self._guilds[guild_id][user_id] = entry
+        elif entry.stale:
+            row = await self._read_row(guild_id, user_id)
+            if entry.stale:
+                entry.refresh(row)
+        entry.last_seen = time.monotonic()
+        return entry
+
+    async def get(self, guild_id: int, user_id: int) -> Tuple[int, int]:
+        entry = await self._entry(guild_id, user_id)
+        return entry.level, entry.xp
+
+    async def set(self, guild_id: int, user_id: int, level: int, xp: int, curve: LevelCurve = DEFAULT_CURVE):
+        entry = await self._entry(guild_id, user_id)
+        entry.set_total(curve.total_for_level(level) + xp, curve)
+
+    async def add(self, guild_id: int, user_id: int, amount: int, curve: LevelCurve = DEFAULT_CURVE) -> Tuple[int, int]:
+        """Suma (o resta) XP sin mirar el cooldown. Devuelve (nivel_anterior, nivel_nuevo)."""
+        entry = await self._entry(guild_id, user_id)
+        old_level = entry.level
+        entry.set_total(entry.total_xp + amount, curve)
+        return old_level, entry.level
+
+    async def gain(self, guild_id: int, user_id: int, amount: int, curve: LevelCurve = DEFAULT_CURVE) -> Optional[Tuple[int, int]]:
+        """Suma XP si el usuario no está en cooldown.
+
+        Devuelve (nivel_anterior, nivel_nuevo), o None si el cooldown lo impidió.
+        """
+        entry = await self._entry(guild_id, user_id)
+        now = time.monotonic()
+        if entry.last_gain and now - entry.last_gain < self.cooldown:
+            return None
+        entry.last_gain = now
+        return await self.add(guild_id, user_id, amount, curve)
+
+    def recompute(self, guild_id: int, curve: LevelCurve):
+        """Aplica una nueva curva a las entradas en memoria de un servidor (el XP total no cambia)."""
+        for entry in self._guilds.get(guild_id, {}).values():
+            entry.curve = curve
+            entry.level, entry.xp = curve.split(entry.total_xp)
+
+    def reset_cooldown(self, guild_id: int, user_id: int):
+        entry = self._guilds.get(guild_id, {}).get(user_id)
+        if entry:
+            entry.last_gain = 0.0
+
+    async def flush(self) -> int:
+        """Escribe todas las filas modificadas en una sola transacción."""
+        # Las filas sucias que otro escribió entretanto se releen antes, para no pisar ese cambio
+        for guild_id, users in list(self._guilds.items()):
+            for user_id, entry in list(users.items()):
+                if entry.dirty and entry.stale:
+                    row = await self._read_row(guild_id, user_id)
+                    if entry.stale:
+                        entry.refresh(row)
+        snapshot: List[Tuple[XPEntry, int, int]] = []
+        rows = []
+        for guild_id, users in self._guilds.items():
+            for user_id, entry in users.items():
+                if entry.dirty:
+                    snapshot.append((entry, entry.version, entry.total_xp))
+                    rows.append((guild_id, user_id, entry.level, entry.xp, entry.total_xp))
+        if rows:
+            await db.save_user_levels(rows)
+            for entry, version, total_xp in snapshot:
+                entry.flushed_version = version
+                entry.base_total = total_xp
+        self._evict_idle()
+        return len(rows)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - IDLE_EVICT_SECONDS
+        for guild_id in list(self._guilds):
+            users = self._guilds[guild_id]
+            for user_id in [u for u, e in users.items() if not e.dirty and e.last_seen < cutoff and e.last_gain < cutoff]:
+                del users[user_id]
+            if not users:
+                del self._guilds[guild_id]
@@ -25,6 +25,7 @@ load_dotenv(os.path.join(PROJECT_ROOT, '.env'))
 sys.path.append(PROJECT_ROOT)
 from utils import database_manager, api_helpers
 from utils.lang_utils import _t
+from utils.lock_registry import balance_locks
 
 app = Quart(__name__, 
             static_url_path='/static',
@@ -93,6 +94,16 @@ if not CLIENT_ID or not CLIENT_SECRET:
 ADMIN_COOLDOWNS = {} # {user_id: last_action_timestamp}
 COOLDOWN_SECONDS = 3
 
+# True si el bot corre en este mismo proceso (run.py). Las métricas en memoria
+# (consultas, candados) son de cada proceso: solo aquí incluyen las del bot.
+BOT_IN_PROCESS = False
+
+def metrics_scope() -> dict:
+    if BOT_IN_PROCESS:
+        return {"scope": "bot+dashboard"}
+    return {"scope": "dashboard",
+            "note": "El dashboard corre aparte del bot: estas métricas son solo del proceso web, no las del bot."}
+
 # Rate Limiter Global (Anti-Spam DDoS básico)
 RATE_LIMITS = {}
 RATE_LIMIT_MAX_REQUESTS = 25 # Aumentamos para evitar falsos positivos en el dashboard
@@ -489,6 +500,16 @@ async def dashboard_account():
 
 
 # Ayudantes para la obtención de datos de Discord API
+def _invalidate_api_cache(guild_id):
+    """El bot entró o salió de un servidor (bot_guilds): descartar su entrada de API_CACHE."""
+    api_cache = app.config.setdefault('API_CACHE', {})
+    if guild_id is None:
+        api_cache.clear()
+    else:
+        api_cache.pop(str(guild_id), None)
+
+database_manager.subscribe_invalidation('bot_guilds', _invalidate_api_cache)
+
 async def fetch_guild_channels(guild_id):
     """Obtiene los canales del servidor via Bot API."""
     text_channels = []
@@ -600,23 +621,9 @@ async def get_server_context(guild_id):
             'roles': roles
         }
 
-    # Servidor settings
-    settings = await database_manager.fetchone("SELECT * FROM server_settings WHERE guild_id = ?", (guild_id,))
-    if not settings:
-        await database_manager.execute("INSERT OR IGNORE INTO server_settings (guild_id) VALUES (?)", (int(guild_id),))
-        settings = await database_manager.fetchone("SELECT * FROM server_settings WHERE guild_id = ?", (guild_id,))
-        if not settings:
-            settings = {'prefix': '!', 'language': 'es', 'leveling_enabled': 1}
-
-    # Economy settings
-    economy_settings = await database_manager.fetchone("SELECT * FROM economy_settings WHERE guild_id = ?", (guild_id,))
-    if not economy_settings:
-        await database_manager.execute("INSERT OR IGNORE INTO economy_settings (guild_id) VALUES (?)", (int(guild_id),))
-        economy_settings = await database_manager.fetchone("SELECT * FROM economy_settings WHERE guild_id = ?", (guild_id,))
-        if not economy_settings:
-            economy_settings = {'currency_name': 'créditos', 'currency_emoji': '🪙', 'start_balance': 100,
-                               'daily_min': 100, 'daily_max': 500, 'work_min': 50, 'work_max': 250,
-                               'work_cooldown': 3600, 'rob_cooldown': 21600}
+    # Servidor y economía: misma caché que el bot, invalidada por el bus en cada escritura
+    settings = await database_manager.get_cached_server_settings(int(guild_id))
+    economy_settings = await database_manager.get_cached_economy_settings(int(guild_id))
     
     # Gambling channels
     gambling_channels = await database_manager.fetchall(
@@ -644,11 +651,8 @@ async def get_server_context(guild_id):
         "SELECT level, role_id FROM role_rewards WHERE guild_id = ? ORDER BY level ASC", 
         (guild_id,)
     )
-    # Fetch Shop Items
-    shop_items = await database_manager.fetchall(
-        "SELECT * FROM shop_items WHERE guild_id = ? ORDER BY price ASC", 
-        (guild_id,)
-    )
+    # Shop Items: catálogo en caché, invalidado por el bus al añadir o borrar artículos
+    shop_items = (await database_manager.get_shop_catalog(int(guild_id))).items
     
     return target_guild, {
         "bot_on": bot_on,
@@ -870,25 +874,27 @@ async def dashboard_server(guild_id, section):
                      int(work_cooldown), int(rob_cooldown), int(guild_id))
                 )
 
-                # Update active channels
+                # Update active channels (en una transacción: el bot nunca ve la lista vacía a medias)
                 selected_channels = form.getlist('economy_channels')
-                await database_manager.execute("DELETE FROM economy_active_channels WHERE guild_id = ?", (int(guild_id),))
-                for ch_id in selected_channels:
-                    if ch_id:
-                        await database_manager.execute("INSERT INTO economy_active_channels (guild_id, channel_id) VALUES (?, ?)", (int(guild_id), int(ch_id)))
+                async with database_manager.transaction() as tx:
+                    tx.execute("DELETE FROM economy_active_channels WHERE guild_id = ?", (int(guild_id),))
+                    for ch_id in selected_channels:
+                        if ch_id:
+                            tx.execute("INSERT OR IGNORE INTO economy_active_channels (guild_id, channel_id) VALUES (?, ?)", (int(guild_id), int(ch_id)))
 
         elif section == 'gambling':
             gamble_enabled = 1 if form.get('gamble_enabled') == 'on' else 0
             # Get selected channel IDs from form
             selected_channels = form.getlist('gambling_channels')
-            # Clear existing and re-insert
-            await database_manager.execute("DELETE FROM gambling_active_channels WHERE guild_id = ?", (int(guild_id),))
-            for ch_id in selected_channels:
-                if ch_id:
-                    await database_manager.execute(
-                        "INSERT OR IGNORE INTO gambling_active_channels (guild_id, channel_id) VALUES (?, ?)",
-                        (int(guild_id), int(ch_id))
-                    )
+            # Clear existing and re-insert, en una sola transacción
+            async with database_manager.transaction() as tx:
+                tx.execute("DELETE FROM gambling_active_channels WHERE guild_id = ?", (int(guild_id),))
+                for ch_id in selected_channels:
+                    if ch_id:
+                        tx.execute(
+                            "INSERT OR IGNORE INTO gambling_active_channels (guild_id, channel_id) VALUES (?, ?)",
+                            (int(guild_id), int(ch_id))
+                        )
             await database_manager.execute(
                 "UPDATE server_settings SET gamble_enabled = ? WHERE guild_id = ?",
                 (gamble_enabled, int(guild_id))
@@ -1048,6 +1054,11 @@ async def dashboard_server(guild_id, section):
     def t(key, **kwargs):
         return _t(key, lang=lang, **kwargs)
 
+    if section == 'economy':
+        # Indicadores en vivo (vectorizados, ver utils/economy_analytics.py) y la serie de instantáneas
+        ctx['economy_stats'] = await database_manager.get_economy_stats(int(guild_id))
+        ctx['economy_trend'] = await database_manager.get_economy_snapshots(int(guild_id))
+
     return await render_template('guild_panel.html', 
                                user=session['user'], 
                                server=target_guild, 
@@ -1103,13 +1114,15 @@ async def global_stats():
         # Usuarios únicos en niveles
         user_rows = await database_manager.fetchall("SELECT COUNT(DISTINCT user_id) as count FROM levels")
         total_users = user_rows[0]['count'] if user_rows else 0
+        # Comandos ejecutados (agregados horarios + logs aún sin agregar)
+        commands_run = await database_manager.get_total_commands_run()
     except:
-        total_servers, total_users = 0, 0
+        total_servers, total_users, commands_run = 0, 0, 0
 
     return {
         "servers": total_servers,
         "users": total_users,
-        "commands_run": 0 # TODO: Implementar contador de comandos en DB
+        "commands_run": commands_run
     }
 
 def admin_required(f):
@@ -1141,6 +1154,9 @@ async def admin_panel():
     recent_logs = await database_manager.get_recent_global_logs(50)
     system_logs = await database_manager.get_recent_system_logs(50)
     admin_audit_logs = await database_manager.get_recent_admin_audit_logs(50)
+    # Uso de comandos desde los agregados horarios (no recorre los logs crudos)
+    commands_run = await database_manager.get_total_commands_run()
+    top_commands = await database_manager.get_command_usage(hours=24 * 7, limit=10)
     
     # Obtener lista de tablas para el explorador
     tables_query = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
@@ -1158,6 +1174,8 @@ async def admin_panel():
                                  recent_logs=recent_logs,
                                  system_logs=system_logs,
                                  admin_audit_logs=admin_audit_logs,
+                                 commands_run=commands_run,
+                                 top_commands=top_commands,
                                  db_tables=db_tables)
 
 @app.route('/api/admin/db/table/<table_name>')
@@ -1276,10 +1294,7 @@ async def api_admin_guild_leave():
     data = await request.form
     guild_id = data.get('guild_id')
     if guild_id:
-        await database_manager.execute(
-            "INSERT INTO broadcast_queue (message, type, status) VALUES (?, 'leave_guild', 'pending')", 
-            (guild_id,)
-        )
+        await database_manager.enqueue_task('leave_guild', guild_id)
         await database_manager.log_admin_action(user['id'], user['username'], "leave_guild", target_id=guild_id)
         ADMIN_COOLDOWNS[str(user['id'])] = now
         return {"success": True, "message": "Tarea de abandono programada correctamente."}
@@ -1316,6 +1331,33 @@ async def api_admin_backup():
         return await send_file(abs_db_path, as_attachment=True, attachment_filename=f"umapyoi_backup_{int(time.time())}.db")
     return "Base de datos no encontrada.", 404
 
+@app.route('/api/admin/cache/stats')
+@admin_required
+async def api_admin_cache_stats():
+    # Contadores de las cachés de este proceso (el dashboard)
+    return {"caches": database_manager.get_cache_stats()}
+
+@app.route('/api/admin/locks/stats')
+@admin_required
+async def api_admin_lock_stats():
+    # Contención de los candados de saldo (solo tiene datos si el dashboard corre junto al bot)
+    return {"locks": [balance_locks.stats()], **metrics_scope()}
+
+@app.route('/api/admin/economy/ledger/check')
+@admin_required
+async def api_admin_economy_ledger_check():
+    # Balances que no cuadran con la suma de economy_ledger (?guild_id=N para un servidor)
+    guild_id = request.args.get('guild_id', type=int)
+    return await database_manager.check_economy_ledger(guild_id)
+
+@app.route('/api/admin/db/metrics')
+@admin_required
+async def api_admin_db_metrics():
+    # ?sort=total_ms|p99_ms|calls|avg_lock_wait_ms|avg_queue_wait_ms & ?limit=N
+    sort = request.args.get('sort', 'total_ms')
+    limit = max(1, min(request.args.get('limit', 20, type=int), 200))
+    return {**database_manager.get_query_metrics(limit, sort), **metrics_scope()}
+
 @app.route('/api/admin/broadcast', methods=['POST'])
 @admin_required
 async def api_admin_broadcast():
@@ -1327,12 +1369,19 @@ async def api_admin_broadcast():
     data = await request.form
     message = data.get('message')
     if message:
-        await database_manager.execute("INSERT INTO broadcast_queue (message) VALUES (?)", (message,))
+        # Se puede reintentar: el envío guarda qué servidores ya recibieron el anuncio
+        await database_manager.enqueue_task('broadcast', message)
         await database_manager.log_admin_action(user['id'], user['username'], "global_broadcast", details=message[:100])
         ADMIN_COOLDOWNS[str(user['id'])] = now
         return {"success": True, "message": "Transmisión global programada correctamente."}
     return {"success": False, "message": "El mensaje no puede estar vacío."}, 400
 
+@app.route('/api/admin/broadcasts')
+@admin_required
+async def api_admin_broadcasts():
+    # Progreso de las últimas transmisiones (servidores entregados / total)
+    return {"broadcasts": await database_manager.get_recent_broadcasts()}
+
 @app.route('/api/admin/dm/send', methods=['POST'])
 @admin_required
 async def api_admin_dm_send():
@@ -1347,10 +1396,7 @@ async def api_admin_dm_send():
     if user_id and content:
         import json
         payload = json.dumps({"user_id": user_id, "content": content})
-        await database_manager.execute(
-            "INSERT INTO broadcast_queue (message, type, status) VALUES (?, 'send_dm', 'pending')", 
-            (payload,)
-        )
+        await database_manager.enqueue_task('send_dm', payload)
         await database_manager.log_admin_action(user['id'], user['username'], "send_dm", target_id=user_id, details=content[:100])
         ADMIN_COOLDOWNS[str(user['id'])] = now
         return {"success": True, "message": "Mensaje directo programado correctamente."}
@@ -1362,10 +1408,7 @@ async def api_admin_guilds_sync():
     """Programar una tarea de sincronización completa para el bot."""
     user = session['user']
     try:
-        await database_manager.execute(
-            "INSERT INTO broadcast_queue (message, type, status) VALUES (?, 'sync_all', 'pending')", 
-            ('Web Trigger', )
-        )
+        await database_manager.enqueue_task('sync_all', 'Web Trigger')
         await database_manager.log_admin_action(user['id'], user['username'], "force_guild_sync", details="Sincronización manual solicitada via Panel.")
         return {"success": True, "message": "Sincronización programada. Verás los cambios en unos segundos."}
     except Exception as e:
@@ -1375,7 +1418,9 @@ def is_port_in_use(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('localhost', port)) == 0
 
-async def run_app():
+async def run_app(with_bot: bool = False):
+    global BOT_IN_PROCESS
+    BOT_IN_PROCESS = with_bot
     # El puerto por defecto en Quart es 5000, pero permitimos configurarlo
     port = int(os.getenv("PORT", 5000))
     if is_port_in_use(port):
@@ -1389,12 +1434,19 @@ async def run_app():
     
     # Asegurar que la base de datos esté inicializada (tablas de reportes, etc)
     database_manager.setup_database()
+    # Recibir invalidaciones de caché hechas por el proceso del bot
+    database_manager.start_change_watcher()
     
     print(f"Servidor web iniciado en http://localhost:{config['port']}")
     try:
         await app.run_task(**config)
     except (asyncio.CancelledError, KeyboardInterrupt):
         print("\nDeteniendo servidor web...")
+    finally:
+        # Como UmapyoiBot.close(): no perder los logs diferidos (auditoría, logs del sistema).
+        # close_database() los vuelca antes de cerrar; con el bot en el proceso lo hace su close()
+        if not with_bot:
+            database_manager.close_database()
 
 if __name__ == '__main__':
     try: